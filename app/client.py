@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import logging
+import time
+import urllib.error
+import urllib.request
+from typing import Optional
+from urllib.parse import quote, urlencode
+
+import numpy as np
+
+from .core.frames import decode_frame, unpack_indices
+from .core.quantize import PaletteQuantizer, impression_palette
+
+
+logger = logging.getLogger(__name__)
+
+
+class FrameClient:
+    """Thin panel client: download this device's frame from a render farm and show it.
+
+    Nothing is fetched, rendered or quantized here; the server sends packed palette
+    indices (see ``app.core.frames``). Each poll names the frame on the panel, so an
+    unchanged frame costs a ``304`` and a changed one usually a delta of a few
+    hundred bytes.
+    """
+
+    def __init__(self, server: str, device: str, poll_seconds: float = 60, timeout: float = 30, coding: str = "zlib") -> None:
+        self.url = f"{server.rstrip('/')}/api/devices/{quote(device)}/frame.bin"
+        self.poll_seconds = poll_seconds
+        self.timeout = timeout
+        self.coding = coding
+        self.frame_hash: Optional[str] = None
+        self.packed: Optional[bytes] = None
+        # Only used to give preview.png its colours; the panel takes the indices as they are
+        self._palette = PaletteQuantizer(impression_palette())
+        self._inky = None
+        try:
+            from inky.auto import auto
+
+            self._inky = auto()
+            self._inky.set_border(self._inky.WHITE)
+        except Exception:
+            self._inky = None
+
+    def poll_once(self) -> bool:
+        """Fetch the frame and show it if it changed; returns ``True`` when the panel was updated."""
+        query = {"coding": self.coding}
+        if self.frame_hash:
+            query["base"] = self.frame_hash
+        request = urllib.request.Request(f"{self.url}?{urlencode(query)}")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                frame_hash = (response.headers.get("ETag") or "").strip('"') or None
+        except urllib.error.HTTPError as exc:
+            if exc.code == 304:
+                return False
+            raise
+        packed, width, height = decode_frame(body, self.packed)
+        self.show(unpack_indices(packed, width, height))
+        self.packed, self.frame_hash = packed, frame_hash
+        return True
+
+    def show(self, indices: np.ndarray) -> None:
+        image = self._palette.to_image(indices)
+        if self._inky is None:
+            image.save("preview.png")
+            return
+        self._inky.set_image(image)
+        self._inky.show()
+
+    def run_forever(self) -> None:
+        while True:
+            try:
+                if self.poll_once():
+                    logger.info("Panel updated (%s)", (self.frame_hash or "")[:12])
+            except Exception as exc:
+                logger.warning("Frame poll failed: %s", exc)
+            time.sleep(self.poll_seconds)
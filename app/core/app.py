@@ -1,103 +1,500 @@
+import hashlib
+import importlib
+import json
+import logging
 import os
 import threading
 import time
-from typing import List
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+from PIL import Image
 
 from .config import ConfigManager
-from .renderer import DisplayRenderer
+from .metrics import in_context, metrics, serve_http
+from .layout import LayoutEngine
+from .renderer import DisplayRenderer, template_keys
+from .worker import RenderWorker, render_frame
 from ..widgets.base import Widget
-from ..widgets.agenda import AgendaWidget
-from ..widgets.news import NewsWidget
-from ..widgets.market import MarketWidget
-from ..services.calendar import CalendarService
-from ..services.news import NewsService
-from ..services.market import MarketService
-from ..services.weather import WeatherService
+from ..services.cache import SWRCache
+
+if TYPE_CHECKING:
+    from ..services.calendar import CalendarSource
+    from ..services.timeseries import SeriesStore
+    from ..services.weather import WeatherNow
+
+# Services, widgets and the scheduler are imported where they are first used, so a
+# mode or widget that is not enabled never pays for icalendar, requests
+# or asyncio at start-up (see ``python run.py --profile-startup``).
+
+# Widget name in ``layout.enabled_widgets`` -> "module:class" under app.widgets
+WIDGETS: Dict[str, str] = {
+    "agenda": "agenda:AgendaWidget",
+    "news": "news:NewsWidget",
+    "market": "market:MarketWidget",
+}
+
+
+def format_weather(w: Optional["WeatherNow"], places: Sequence[Tuple[str, Optional["WeatherNow"]]] = ()) -> dict:
+    return {
+        "temp": f"{w.temperature_c:.0f}°C" if w else "-",
+        "cond": w.condition if w else "",
+        "icon": w.icon if w else "☁",
+        "hi": f"{w.high_c:.0f}°" if (w and w.high_c is not None) else "",
+        "lo": f"{w.low_c:.0f}°" if (w and w.low_c is not None) else "",
+        "hourly": w.hourly if w and w.hourly else [],
+        "places": [
+            {"name": name, "temp": f"{p.temperature_c:.0f}°" if p else "-", "icon": p.icon if p else "☁"}
+            for name, p in places
+        ],
+    }
+
+
+def format_now(now: datetime) -> str:
+    return now.strftime("%a %d %b • %H:%M")
+
+
+logger = logging.getLogger(__name__)
+
+
+def context_hash(context: dict, ignore: List[str]) -> str:
+    payload = {k: v for k, v in context.items() if k not in ignore}
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+AGENDA_ITEMS = 6  # rows the agenda panel has room for
+
+# Data sources with a long-lived, cached service (see ``_service``)
+SERVICE_SOURCES = ("calendar", "news", "weather", "market")
+
+# Refresh source (``refresh.sources.<name>``) -> template context key it fills
+SOURCE_KEYS: Dict[str, str] = {"calendar": "agenda", "news": "headlines", "market": "market", "weather": "weather"}
+
+# Rendered when a source has never produced a value (first frame after start-up)
+EMPTY_CONTEXT: Dict[str, Any] = {
+    "agenda": [],
+    "headlines": [],
+    "market": {"symbol": "", "price": "-", "change_pct": 0.0, "history": []},
+    "weather": format_weather(None),
+}
+
+
+def data_cache(config: ConfigManager) -> SWRCache:
+    return SWRCache(
+        os.path.join(config.cache_dir, "data"),
+        max_entries=config.get("cache.max_entries"),
+        max_bytes=config.get("cache.max_mb") * 1024 * 1024,
+        max_age=config.get("cache.max_age_days") * 86400,
+    )
+
+
+def widget_class(name: str) -> Type[Widget]:
+    module, cls = WIDGETS[name].split(":")
+    return getattr(importlib.import_module(f"..widgets.{module}", __package__), cls)
+
+
+def load_widgets(config: ConfigManager) -> List[Widget]:
+    """Instances of the widgets named in ``layout.enabled_widgets``, in order."""
+    widgets = []
+    for name in config.get("layout.enabled_widgets"):
+        if name not in WIDGETS:
+            logger.warning("Unknown widget %r in layout.enabled_widgets", name)
+            continue
+        widgets.append(widget_class(name)(config))
+    return widgets
+
+
+def required_sources(config: ConfigManager) -> Dict[str, float]:
+    """Sources the configured display draws -> seconds between refreshes.
+
+    In ``pil`` mode these are the sources the enabled widgets declare. In ``html`` and
+    ``native`` mode they are the ones whose context key the template (or the native
+    layout) reads, except sources only a switched-off widget declares. A source is
+    refreshed every ``refresh.sources.<name>`` seconds, or sooner when an enabled
+    widget asks for fresher data.
+    """
+    mode = config.get("display.mode")
+    enabled = [name for name in config.get("layout.enabled_widgets") if name in WIDGETS]
+    max_age: Dict[str, List[float]] = {}
+    for name in enabled:
+        for source, age in widget_class(name).requires.items():
+            max_age.setdefault(source, []).append(age)
+    if mode == "pil":
+        needed = set(max_age)
+    else:
+        switched_off = {source for name in WIDGETS if name not in enabled for source in widget_class(name).requires}
+        if mode == "html":
+            keys = template_keys(config.get("display.template", "display.html"))
+            if keys is not None and "spark_points" in keys:
+                keys = keys | {"market"}
+        else:
+            keys = LayoutEngine.CONTEXT_KEYS
+        needed = {
+            source
+            for source, key in SOURCE_KEYS.items()
+            if (keys is None or key in keys) and (source in max_age or source not in switched_off)
+        }
+    return {
+        source: min([config.get(f"refresh.sources.{source}", 900), *max_age.get(source, [])])
+        for source in SOURCE_KEYS
+        if source in needed
+    }
+
+
+def _close_service(service: Any) -> None:
+    # Services fetching several feeds in parallel own a thread pool; let it go with them
+    close = getattr(service, "close", None)
+    if close is not None:
+        close()
+
+
+class DataSources:
+    """Fetch-only half of the app: the data services, their last good values and refreshes.
+
+    Nothing here renders or touches the panel, so the render farm keeps one of these
+    per distinct source configuration; ``executor`` lets several of them share threads.
+    """
+
+    def __init__(
+        self,
+        config: ConfigManager,
+        cache: Optional[SWRCache] = None,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ) -> None:
+        self.config = config
+        self.cache = cache or data_cache(config)
+        self.fetch_executor = executor or ThreadPoolExecutor(max_workers=4, thread_name_prefix="fetch")
+        self._pending: Dict[str, Future] = {}
+        self._last_good: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._services: Dict[str, Any] = {}
+        self._market_store: Optional["SeriesStore"] = None
+        self._fetchers: Dict[str, Callable[[], Any]] = {
+            "agenda": self._fetch_agenda,
+            "headlines": self._fetch_headlines,
+            "market": self._fetch_market,
+            "weather": self._fetch_weather,
+        }
+        # Sources nothing draws any more give up their service and data
+        config.subscribe("layout", lambda _: self._release_unused())
+        config.subscribe("display", lambda _: self._release_unused())
+        for source in SERVICE_SOURCES:
+            config.subscribe(f"data.{source}", lambda _, source=source: self._drop_service(source))
+            config.subscribe(f"cache.ttl.{source}", lambda _, source=source: self._drop_service(source))
+
+    def required_sources(self) -> Dict[str, float]:
+        return required_sources(self.config)
+
+    def refresh_source(self, source: str) -> bool:
+        """Fetch one source now; returns ``True`` when its data changed."""
+        key = SOURCE_KEYS[source]
+        try:
+            value = self._timed_fetch(key, self._fetchers[key])
+        except Exception:
+            metrics.inc("fetch_failures_total", source=key)
+            raise
+        with self._lock:
+            changed = self._last_good.get(key) != value
+            self._last_good[key] = value
+        return changed
+
+    def latest(self, key: str) -> Any:
+        """Last good value of context ``key`` (``EMPTY_CONTEXT`` until a fetch succeeded)."""
+        with self._lock:
+            return self._last_good.get(key, EMPTY_CONTEXT[key])
+
+    def build_context(self) -> dict:
+        """Context with the sources the display draws fetched now, within the fetch deadline."""
+        deadline = self.config.get("refresh.fetch_deadline_seconds")
+        needed = {SOURCE_KEYS[source] for source in self.required_sources()}
+        data = self._fetch_all({key: fetch for key, fetch in self._fetchers.items() if key in needed}, deadline)
+        return {"now_str": format_now(datetime.now()), **EMPTY_CONTEXT, **data}
+
+    def snapshot_context(self, now: datetime) -> dict:
+        """Context from the data already fetched by the scheduler, without fetching."""
+        with self._lock:
+            data = {key: self._last_good.get(key, EMPTY_CONTEXT[key]) for key in self._fetchers}
+        return {"now_str": format_now(now), **data}
+
+    def _fetch_all(self, fetchers: Dict[str, Callable[[], Any]], deadline: float) -> Dict[str, Any]:
+        """Run all fetchers concurrently and wait at most ``deadline`` seconds.
+
+        A source that is still running (or failed) contributes its last good value; a
+        late fetch keeps running and its result is picked up by a later frame.
+        """
+        futures = []
+        started = []
+        with self._lock:
+            for name, fetch in fetchers.items():
+                future = self._pending.get(name)
+                if future is None:
+                    future = self._pending[name] = self.fetch_executor.submit(in_context(self._timed_fetch), name, fetch)
+                    started.append((name, future))
+                futures.append(future)
+        for name, future in started:
+            future.add_done_callback(lambda f, name=name: self._fetch_done(name, f))
+        _, late = wait(futures, timeout=deadline)
+        if late:
+            late_names = sorted(name for name, future in zip(fetchers, futures) if future in late)
+            for name in late_names:
+                metrics.inc("fetch_deadline_missed_total", source=name)
+            metrics.annotate(late_sources=late_names)
+        with self._lock:
+            return {name: self._last_good.get(name, EMPTY_CONTEXT[name]) for name in fetchers}
+
+    @staticmethod
+    def _timed_fetch(name: str, fetch: Callable[[], Any]) -> Any:
+        with metrics.timer("fetch", source=name):
+            return fetch()
+
+    def _fetch_done(self, name: str, future: Future) -> None:
+        with self._lock:
+            if self._pending.get(name) is future:
+                del self._pending[name]
+            if future.exception() is None:
+                self._last_good[name] = future.result()
+            else:
+                metrics.inc("fetch_failures_total", source=name)
+                logger.warning("Fetching %s failed: %s", name, future.exception())
+
+    def _service(self, source: str, factory: Callable[..., Any], **params: Any) -> Any:
+        """Return the long-lived service for ``source``; settings changes drop it via ``_drop_service``."""
+        with self._lock:
+            service = self._services.get(source)
+            if service is None:
+                ttl = self.config.get(f"cache.ttl.{source}")
+                service = self._services[source] = factory(cache=self.cache, ttl=ttl, **params)
+            return service
+
+    def _drop_service(self, source: str) -> None:
+        with self._lock:
+            service = self._services.pop(source, None)
+        _close_service(service)
+
+    def _release_unused(self) -> None:
+        needed = self.required_sources()
+        released = []
+        with self._lock:
+            for source, key in SOURCE_KEYS.items():
+                if source not in needed:
+                    released.append(self._services.pop(source, None))
+                    self._last_good.pop(key, None)
+        for service in released:
+            _close_service(service)
+
+    def close(self) -> None:
+        """Release every service; the render farm calls this when no profile uses these settings."""
+        with self._lock:
+            services, self._services = list(self._services.values()), {}
+        for service in services:
+            _close_service(service)
+
+    def _calendar_sources(self) -> Tuple["CalendarSource", ...]:
+        from ..services.calendar import CalendarSource
+
+        sources = []
+        for item in self.config.get("data.calendar.sources", []) or []:
+            if isinstance(item, str):
+                item = {"url": item}
+            if isinstance(item, dict) and item.get("url"):
+                sources.append(CalendarSource(url=item["url"], label=item.get("label", ""), color=item.get("color", "")))
+        ics_url = self.config.get("data.calendar.ics_url", "")
+        if not sources and ics_url:
+            sources.append(CalendarSource(url=ics_url))
+        return tuple(sources)
+
+    def _fetch_agenda(self) -> List[dict]:
+        from ..services.calendar import MultiCalendarService
+
+        cal = self._service(
+            "calendar",
+            MultiCalendarService,
+            sources=self._calendar_sources(),
+            lookahead_days=self.config.get("data.calendar.lookahead_days"),
+            timezone_name=self.config.get("data.calendar.timezone", None),
+        )
+        events = cal.fetch_events(limit=AGENDA_ITEMS)
+        return [
+            {
+                "time": e.start.strftime("%H:%M"),
+                "title": e.title,
+                "location": e.location or "",
+                "label": e.label or "",
+                "color": e.color or "",
+            }
+            for e in events
+        ]
+
+    def _fetch_headlines(self) -> List[str]:
+        from ..services.news import MultiNewsService
+
+        feeds = self.config.get("data.news.feeds") or []
+        rss_url = self.config.get("data.news.rss_url")
+        if not feeds and rss_url:
+            feeds = [rss_url]
+        news = self._service(
+            "news",
+            MultiNewsService,
+            feeds=tuple(feeds),
+            limit=self.config.get("data.news.limit"),
+            per_feed=self.config.get("data.news.per_feed"),
+        )
+        return news.fetch_headlines()
+
+    def _fetch_market(self) -> dict:
+        from ..services.market import MarketService, provider_for
+
+        symbol = self.config.get("data.market.symbol", "VWCE")
+        provider = self.config.get("data.market.provider", "fake")
+        msvc = self._service(
+            "market",
+            lambda **kw: MarketService(provider=provider_for(provider), **kw),
+            symbol=symbol,
+            store=self.market_store,
+        )
+        q = msvc.fetch_quote()
+        hist = msvc.fetch_history(self.config.get("data.market.history_days"))
+        return {"symbol": symbol, "price": f"{q.price:.2f}" if q else "-", "change_pct": round(q.change_pct, 2) if q else 0.0, "history": hist}
+
+    @property
+    def market_store(self) -> "SeriesStore":
+        if self._market_store is None:
+            from ..services.timeseries import SeriesStore
+
+            self._market_store = SeriesStore(os.path.join(self.config.cache_dir, "market"))
+        return self._market_store
+
+    def _fetch_weather(self) -> dict:
+        from ..services.weather import Location, WeatherService
+
+        lat = self.config.get("data.weather.lat")
+        lon = self.config.get("data.weather.lon")
+        places = self.config.get("data.weather.locations") or []
+        locations = tuple(Location(p["lat"], p["lon"], p["name"]) for p in places)
+        # Home and every extra place come back from one request
+        home, *others = self._service("weather", WeatherService, lat=lat, lon=lon, locations=locations).fetch_all()
+        return format_weather(home, [(p["name"], w) for p, w in zip(places, others)])
 
 
 class SmartDisplayApp:
-    def __init__(self) -> None:
-        self.config = ConfigManager()
+    def __init__(self, config: Optional[ConfigManager] = None, cache: Optional[SWRCache] = None) -> None:
+        self.config = config or ConfigManager()
         self.renderer = DisplayRenderer(self.config)
+        self.data = DataSources(self.config, cache)
+        # Started on the first render with display.worker.enabled
+        self._worker: Optional[RenderWorker] = None
+        self._worker_lock = threading.Lock()
         self.widgets: List[Widget] = []
+        self._context_hash: Optional[str] = None
         self._load_widgets()
+        # Rebuild only what a settings change actually touches
+        self.config.subscribe("layout.enabled_widgets", lambda _: self._load_widgets())
+        self.config.watch()
+
+    @property
+    def cache(self) -> SWRCache:
+        return self.data.cache
+
+    @property
+    def fetch_executor(self) -> ThreadPoolExecutor:
+        return self.data.fetch_executor
 
     def _load_widgets(self) -> None:
-        layout = self.config.get("layout.enabled_widgets", ["agenda", "news", "market"])
-        widget_map = {
-            "agenda": AgendaWidget,
-            "news": NewsWidget,
-            "market": MarketWidget,
-        }
-        self.widgets = [widget_map[name](self.config) for name in layout if name in widget_map]
+        self.widgets = load_widgets(self.config)
 
-    def render_once(self) -> None:
-        mode = (self.config.get("display.mode", "html") or "html").lower()
-        if mode == "html":
-            context = self._build_context()
-            image = self.renderer.render_html(context)
-            self.renderer.show(image)
+    @property
+    def mode(self) -> str:
+        return self.config.get("display.mode")
+
+    def uses_context(self) -> bool:
+        return self.mode in ("html", "native")
+
+    def context_digest(self, context: dict) -> str:
+        # now_str has minute resolution, so an aligned or heartbeat frame redraws a stale clock;
+        # list it in ignore_keys to only redraw the panel for new data
+        ignore = self.config.get("display.change_detection.ignore_keys", []) or []
+        return context_hash(context, ignore)
+
+    def render_image(self, context: Optional[dict] = None) -> Image.Image:
+        """Render a frame for the configured mode without pushing it to the panel."""
+        if context is None:
+            context = self.data.build_context()
+        with metrics.timer("render", mode=self.mode):
+            if self.config.get("display.worker.enabled"):
+                image, self.renderer.dirty_rects = self.render_worker.render(context)
+                return image
+            return render_frame(self.config, self.renderer, self.widgets, context)
+
+    @property
+    def render_worker(self) -> RenderWorker:
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = RenderWorker(self.config)
+            return self._worker
+
+    def sources(self) -> List[str]:
+        return list(SOURCE_KEYS)
+
+    def required_sources(self) -> Dict[str, float]:
+        return self.data.required_sources()
+
+    def source_interval(self, source: str) -> Optional[float]:
+        """Seconds between refreshes of ``source``, or ``None`` while nothing draws it."""
+        return self.required_sources().get(source)
+
+    def refresh_source(self, source: str) -> bool:
+        """Fetch one source now; returns ``True`` when its data changed."""
+        return self.data.refresh_source(source)
+
+    def latest(self, key: str) -> Any:
+        return self.data.latest(key)
+
+    def render_once(self, now: Optional[datetime] = None, force: bool = False) -> None:
+        """Render and push a frame; ``now`` is the time the frame is meant for."""
+        with metrics.trace("frame", mode=self.mode, forced=force):
+            try:
+                self._render_frame(now, force)
+            except Exception:
+                metrics.inc("frames_failed_total")
+                raise
+        metrics.set("last_frame_timestamp_seconds", time.time())
+
+    def _render_frame(self, now: Optional[datetime], force: bool) -> None:
+        if self.uses_context():
+            with metrics.timer("context"):
+                context = self.data.snapshot_context(now) if now is not None else self.data.build_context()
+            digest = self.context_digest(context)
+            metrics.annotate(context=digest[:12])
+            if digest == self._context_hash and not force and not self.renderer.full_refresh_due():
+                metrics.inc("frames_skipped_total", reason="context_unchanged")
+                metrics.annotate(skipped="context_unchanged")
+                logger.info("Skipping render: context unchanged (%s)", digest[:12])
+                return
+            image = self.render_image(context)
+            metrics.annotate(panel_updated=self.renderer.show(image))
+            self._context_hash = digest
             return
 
         # Fallback to PIL widgets mode
-        image = self.renderer.create_canvas()
-        draw = self.renderer.get_draw(image)
-        width, height = image.size
-        num = max(1, len(self.widgets))
-        slot_h = height // num
-        y = 0
-        for widget in self.widgets:
-            region = (0, y, width, y + slot_h)
-            widget.draw(draw, region)
-            y += slot_h
-        self.renderer.show(image)
-
-    def _build_context(self) -> dict:
-        from datetime import datetime
-
-        now_str = datetime.now().strftime("%a %d %b • %H:%M")
-
-        # Calendar
-        ics_url = self.config.get("data.calendar.ics_url", "")
-        look = int(self.config.get("data.calendar.lookahead_days", 3) or 3)
-        tzname = self.config.get("data.calendar.timezone", None)
-        cal = CalendarService(ics_url=ics_url, lookahead_days=look, timezone_name=tzname)
-        events = cal.fetch_events()
-        agenda = [{"time": e.start.strftime("%H:%M"), "title": e.title, "location": e.location or ""} for e in events][:6]
-
-        # News
-        rss_url = self.config.get("data.news.rss_url", "https://feeds.bbci.co.uk/news/rss.xml")
-        news_limit = int(self.config.get("data.news.limit", 3) or 3)
-        headlines = NewsService(rss_url=rss_url, limit=news_limit).fetch_headlines()
-
-        # Market
-        symbol = self.config.get("data.market.symbol", "VWCE")
-        msvc = MarketService(symbol=symbol)
-        q = msvc.fetch_quote()
-        hist = msvc.fetch_history(30)
-        market = {"symbol": symbol, "price": f"{q.price:.2f}" if q else "-", "change_pct": round(q.change_pct, 2) if q else 0.0, "history": hist}
-
-        # Weather
-        lat = float(self.config.get("data.weather.lat", 52.3676) or 52.3676)
-        lon = float(self.config.get("data.weather.lon", 4.9041) or 4.9041)
-        wsvc = WeatherService(lat=lat, lon=lon)
-        w = wsvc.fetch()
-        weather = {
-            "temp": f"{w.temperature_c:.0f}°C" if w else "-",
-            "cond": w.condition if w else "",
-            "icon": w.icon if w else "☁",
-            "hi": f"{w.high_c:.0f}°" if (w and w.high_c is not None) else "",
-            "lo": f"{w.low_c:.0f}°" if (w and w.low_c is not None) else "",
-            "hourly": w.hourly if w and w.hourly else [],
-        }
-
-        return {"now_str": now_str, "agenda": agenda, "headlines": headlines, "market": market, "weather": weather}
+        with metrics.timer("context"):
+            context = self.data.snapshot_context(now) if now is not None else self.data.build_context()
+        image = self.render_image(context)
+        logger.info("Widget render: %d dirty region(s) %s", len(self.renderer.dirty_rects), self.renderer.dirty_rects)
+        metrics.annotate(dirty_rects=len(self.renderer.dirty_rects))
+        if self.renderer.dirty_rects:
+            metrics.annotate(panel_updated=self.renderer.show(image))
+        else:
+            metrics.inc("frames_skipped_total", reason="no_dirty_tiles")
 
     def run(self) -> None:
-        interval = int(self.config.get("refresh.interval_seconds", 300))
-        while True:
-            self._load_widgets()
-            self.render_once()
-            time.sleep(interval)
+        from .scheduler import RefreshScheduler
+
+        port = self.config.get("display.metrics_port")
+        if port:
+            # The web server's /metrics only sees preview renders; the panel loop serves its own
+            serve_http(self.config.get("server.host"), port)
+            logger.info("Serving display metrics on port %d", port)
+        RefreshScheduler(self).run_forever()
 
 
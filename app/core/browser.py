@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import atexit
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import quote
+
+from selenium import webdriver
+from selenium.common.exceptions import JavascriptException, WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service as ChromeService
+
+from .metrics import metrics
+from .procs import process_tree_rss_kb
+
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserSession:
+    """Long-lived headless Chrome shared by every HTML render.
+
+    The driver is started on first use, reused across renders and restarted when it
+    stops responding, after ``display.browser.max_renders`` screenshots, or when the
+    chromedriver/Chrome process tree grows beyond ``display.browser.max_rss_mb``.
+
+    ``patch_screenshot`` keeps one page loaded instead: the page is only loaded when its
+    shell (template, styles, size) changes, and later frames hand the changed values to
+    the page's ``applyContext`` hook, so Chrome re-lays out a few elements rather than
+    parsing, styling and loading fonts for a whole new document.
+    """
+
+    def __init__(self, config, cache_dir: str) -> None:
+        self.config = config
+        self.cache_dir = cache_dir
+        self._driver: Optional[webdriver.Chrome] = None
+        self._window: Optional[Tuple[int, int]] = None
+        self._renders = 0
+        # Shell key of the page currently loaded for patch_screenshot
+        self._page: Any = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def screenshot(self, html: str, size: Tuple[int, int]) -> bytes:
+        with self._lock:
+            driver = self._ensure(size)
+            try:
+                png = self._capture(driver, html)
+            except WebDriverException:
+                logger.warning("Chrome session failed during render; restarting", exc_info=True)
+                self._quit()
+                driver = self._ensure(size)
+                png = self._capture(driver, html)
+            self._renders += 1
+            self._maybe_recycle()
+            return png
+
+    def patch_screenshot(
+        self,
+        shell_key: Any,
+        build_page: Callable[[], str],
+        changed: Dict[str, str],
+        size: Tuple[int, int],
+    ) -> bytes:
+        """Screenshot of the warm page after applying ``changed`` (context key -> JSON text).
+
+        ``build_page`` renders the complete page for the current values; it is only
+        called when the page has to be loaded, i.e. the first time, after ``shell_key``
+        changed, after a restart, or for a template without the ``applyContext`` hook.
+        """
+        with self._lock:
+            driver = self._ensure(size)
+            try:
+                png = self._patch(driver, shell_key, build_page, changed, size)
+            except WebDriverException:
+                logger.warning("Chrome session failed during render; restarting", exc_info=True)
+                self._quit()
+                driver = self._ensure(size)
+                png = self._patch(driver, shell_key, build_page, changed, size)
+            self._renders += 1
+            self._maybe_recycle()
+            return png
+
+    def close(self) -> None:
+        with self._lock:
+            self._quit()
+
+    def _capture(self, driver: webdriver.Chrome, html: str) -> bytes:
+        self._page = None
+        driver.get("data:text/html;charset=utf-8," + quote(html))
+        return driver.get_screenshot_as_png()
+
+    def _patch(
+        self,
+        driver: webdriver.Chrome,
+        shell_key: Any,
+        build_page: Callable[[], str],
+        changed: Dict[str, str],
+        size: Tuple[int, int],
+    ) -> bytes:
+        if self._page != shell_key:
+            self._load_page(driver, build_page(), size, reason="shell")
+            self._page = shell_key
+        elif changed:
+            values = "{%s}" % ",".join(f"{json.dumps(key)}:{text}" for key, text in changed.items())
+            try:
+                with metrics.timer("page_patch"):
+                    applied = driver.execute_script(
+                        "return window.applyContext ? applyContext(JSON.parse(arguments[0])) : false", values
+                    )
+            except JavascriptException:
+                logger.warning("applyContext failed; reloading the page", exc_info=True)
+                applied = False
+            if not applied:
+                # A template without (or with a broken) hook: load the whole page for this frame
+                self._load_page(driver, build_page(), size, reason="fallback")
+        width, height = size
+        shot = driver.execute_cdp_cmd(
+            "Page.captureScreenshot",
+            {"format": "png", "clip": {"x": 0, "y": 0, "width": width, "height": height, "scale": 1}},
+        )
+        return base64.b64decode(shot["data"])
+
+    def _load_page(self, driver: webdriver.Chrome, html: str, size: Tuple[int, int], reason: str) -> None:
+        width, height = size
+        with metrics.timer("page_load"):
+            # The layout viewport is exactly the canvas, whatever the window decorations take
+            driver.execute_cdp_cmd(
+                "Emulation.setDeviceMetricsOverride",
+                {"width": width, "height": height, "deviceScaleFactor": 1, "mobile": False},
+            )
+            driver.get("data:text/html;charset=utf-8," + quote(html))
+            # Web fonts load once here rather than racing the first patched frame
+            driver.execute_async_script(
+                "var done = arguments[arguments.length - 1]; document.fonts.ready.then(function () { done(true); });"
+            )
+        metrics.inc("browser_page_loads_total", reason=reason)
+
+    def _ensure(self, size: Tuple[int, int]) -> webdriver.Chrome:
+        if self._driver is not None and not self._healthy(self._driver):
+            logger.warning("Chrome session is unresponsive; restarting")
+            self._quit()
+        if self._driver is None:
+            self._driver = self._start(size)
+            self._window = size
+            self._renders = 0
+        elif self._window != size:
+            self._driver.set_window_size(*size)
+            self._window = size
+        return self._driver
+
+    def _healthy(self, driver: webdriver.Chrome) -> bool:
+        try:
+            return driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def _start(self, size: Tuple[int, int]) -> webdriver.Chrome:
+        width, height = size
+        options = Options()
+        options.add_argument("--headless=new")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--hide-scrollbars")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument(f"--window-size={width},{height}")
+        service = ChromeService(self._driver_path())
+        started = time.monotonic()
+        driver = webdriver.Chrome(service=service, options=options)
+        logger.info("Started Chrome session in %.1fs", time.monotonic() - started)
+        return driver
+
+    def _driver_path(self) -> str:
+        configured = self.config.get("display.browser.driver_path", "")
+        if configured:
+            return configured
+        path_file = os.path.join(self.cache_dir, "chromedriver.json")
+        try:
+            with open(path_file, "r", encoding="utf-8") as f:
+                cached = json.load(f).get("path", "")
+            if cached and os.access(cached, os.X_OK):
+                return cached
+        except (OSError, ValueError):
+            pass
+        from webdriver_manager.chrome import ChromeDriverManager
+
+        path = ChromeDriverManager().install()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path_file, "w", encoding="utf-8") as f:
+                json.dump({"path": path}, f)
+        except OSError:
+            logger.warning("Could not cache chromedriver path in %s", path_file)
+        return path
+
+    def _maybe_recycle(self) -> None:
+        max_renders = self.config.get("display.browser.max_renders", 50)
+        if max_renders and self._renders >= max_renders:
+            logger.info("Recycling Chrome after %d renders", self._renders)
+            self._quit()
+            return
+        max_rss_mb = self.config.get("display.browser.max_rss_mb", 350)
+        if max_rss_mb and self._driver is not None:
+            process = getattr(self._driver.service, "process", None)
+            rss_kb = process_tree_rss_kb(process.pid) if process else 0
+            if rss_kb > max_rss_mb * 1024:
+                logger.info("Recycling Chrome at %d MB RSS", rss_kb // 1024)
+                self._quit()
+
+    def _quit(self) -> None:
+        driver, self._driver = self._driver, None
+        self._window = None
+        self._page = None
+        if driver is None:
+            return
+        try:
+            driver.quit()
+        except Exception:
+            logger.debug("Chrome did not quit cleanly", exc_info=True)
@@ -1,13 +1,40 @@
+import copy
+import ctypes
+import ctypes.util
+import logging
 import os
-from typing import Any, Dict
+import select
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import yaml
 
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_SETTINGS = {
-    "refresh": {"interval_seconds": 28800},
-    "display": {"orientation": "portrait"},
-    "display": {"mode": "html", "orientation": "portrait", "template": "display.html"},
+    "refresh": {
+        "interval_seconds": 28800,
+        "fetch_deadline_seconds": 8,
+        "align_seconds": 60,
+        "quiet_hours": "",
+        "sources": {"calendar": 300, "news": 900, "market": 600, "weather": 1800},
+    },
+    "display": {
+        "mode": "html",
+        "orientation": "portrait",
+        "template": "display.html",
+        "full_refresh_hours": 24,
+        "saturation": 0.5,
+        "dither": "bayer",
+        "change_detection": {"ignore_keys": []},
+        "browser": {"max_renders": 50, "max_rss_mb": 350, "warm_page": True},
+        "worker": {"enabled": True, "timeout_seconds": 90, "max_rss_mb": 500},
+        # /metrics and /api/traces of the panel loop itself (0 turns them off)
+        "metrics_port": 8081,
+    },
     "layout": {"enabled_widgets": ["agenda", "news", "market"]},
     "theme": {
         "background": "#0b1220",
@@ -17,65 +44,391 @@ DEFAULT_SETTINGS = {
         "font": "DejaVuSans.ttf",
     },
     "data": {
-        "calendar": {"ics_url": "", "lookahead_days": 3, "timezone": "Europe/Amsterdam", "clock": "24h"},
-        "news": {"rss_url": "https://feeds.bbci.co.uk/news/rss.xml", "limit": 3},
-        "market": {"symbol": "VWCE", "provider": "mock"},
-        "weather": {"lat": 52.3676, "lon": 4.9041},
+        "calendar": {"ics_url": "", "sources": [], "lookahead_days": 3, "timezone": "Europe/Amsterdam", "clock": "24h"},
+        "news": {"rss_url": "https://feeds.bbci.co.uk/news/rss.xml", "feeds": [], "limit": 3, "per_feed": 20},
+        "market": {"symbol": "VWCE", "provider": "fake", "history_days": 30},
+        "weather": {"lat": 52.3676, "lon": 4.9041, "locations": []},
+    },
+    "cache": {
+        "ttl": {"calendar": 300, "news": 600, "weather": 900, "market": 900},
+        "max_entries": 64,
+        "max_mb": 32,
+        "max_age_days": 7,
     },
-    "server": {"host": "0.0.0.0", "port": 8080},
+    "server": {"host": "0.0.0.0", "port": 8080, "preview_poll_seconds": 60, "render_workers": 0},
+    # Render farm profiles: name -> settings overrides (display, theme, layout, data, ...)
+    "devices": {},
 }
 
 
+def _choice(*options: str) -> Callable[[Any], str]:
+    def coerce(value: Any) -> str:
+        value = str(value).strip().lower()
+        if value not in options:
+            raise ValueError(f"expected one of {options}")
+        return value
+
+    return coerce
+
+
+def _number(kind: Callable[[Any], Any], minimum: float = 0, maximum: Optional[float] = None) -> Callable[[Any], Any]:
+    def coerce(value: Any) -> Any:
+        # YAML and the web form both deliver numbers as strings ("300", "5")
+        number = kind(float(value)) if kind is int else kind(value)
+        if number < minimum:
+            raise ValueError(f"must be >= {minimum}")
+        if maximum is not None and number > maximum:
+            raise ValueError(f"must be <= {maximum}")
+        return number
+
+    return coerce
+
+
+def _flag(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("1", "true", "yes", "on"):
+        return True
+    if text in ("0", "false", "no", "off", ""):
+        return False
+    raise ValueError("expected true or false")
+
+
+def _time_range(value: Any) -> str:
+    """``"23:00-07:00"`` style range, normalised; empty disables it."""
+    text = str(value or "").strip()
+    if not text:
+        return ""
+    parts = text.replace(" ", "").split("-")
+    if len(parts) != 2:
+        raise ValueError("expected HH:MM-HH:MM")
+    times = []
+    for part in parts:
+        hour, _, minute = part.partition(":")
+        hour_i, minute_i = int(hour), int(minute or 0)
+        if not (0 <= hour_i < 24 and 0 <= minute_i < 60):
+            raise ValueError("expected HH:MM-HH:MM")
+        times.append(f"{hour_i:02d}:{minute_i:02d}")
+    return "-".join(times)
+
+
+def _string_list(value: Any) -> List[str]:
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(",") if item.strip()]
+    return [str(item) for item in value]
+
+
+def _locations(value: Any) -> List[Dict[str, Any]]:
+    """Extra weather places: ``[{"name", "lat", "lon"}]`` or ``"Paris:48.85,2.35; Berlin:52.52,13.40"``."""
+    if isinstance(value, str):
+        items = []
+        for part in value.split(";"):
+            if part.strip():
+                name, _, coords = part.rpartition(":")
+                lat, _, lon = coords.partition(",")
+                items.append({"name": name.strip(), "lat": lat, "lon": lon})
+        value = items
+    places = []
+    for item in value or []:
+        lat, lon = float(item["lat"]), float(item["lon"])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"coordinates out of range: {lat}, {lon}")
+        places.append({"name": str(item.get("name") or f"{lat:.2f}, {lon:.2f}"), "lat": lat, "lon": lon})
+    return places
+
+
+# Leaves that are validated and coerced once per change, so readers get typed values
+SCHEMA: Dict[str, Callable[[Any], Any]] = {
+    "refresh.interval_seconds": _number(int, 1),
+    "refresh.fetch_deadline_seconds": _number(float),
+    "refresh.align_seconds": _number(int, 1),
+    "refresh.quiet_hours": _time_range,
+    "refresh.sources.calendar": _number(float, 10),
+    "refresh.sources.news": _number(float, 10),
+    "refresh.sources.market": _number(float, 10),
+    "refresh.sources.weather": _number(float, 10),
+    "display.mode": _choice("html", "native", "pil"),
+    "display.orientation": _choice("portrait", "landscape"),
+    "display.full_refresh_hours": _number(float),
+    "display.saturation": _number(float),
+    "display.dither": _choice("none", "bayer", "diffusion"),
+    "display.browser.max_renders": _number(int),
+    "display.browser.max_rss_mb": _number(int),
+    "display.browser.warm_page": _flag,
+    "display.worker.enabled": _flag,
+    "display.worker.timeout_seconds": _number(float, 1),
+    "display.worker.max_rss_mb": _number(int),
+    "display.metrics_port": _number(int, 0, 65535),
+    "layout.enabled_widgets": _string_list,
+    "data.calendar.lookahead_days": _number(int, 1),
+    "data.news.feeds": _string_list,
+    "data.news.limit": _number(int, 1),
+    "data.news.per_feed": _number(int, 1),
+    "data.market.history_days": _number(int, 2),
+    "data.weather.lat": _number(float, -90, 90),
+    "data.weather.lon": _number(float, -180, 180),
+    "data.weather.locations": _locations,
+    "cache.ttl.calendar": _number(float),
+    "cache.ttl.news": _number(float),
+    "cache.ttl.weather": _number(float),
+    "cache.ttl.market": _number(float),
+    "cache.max_entries": _number(int, 1),
+    "cache.max_mb": _number(int, 1),
+    "cache.max_age_days": _number(float),
+    "server.port": _number(int, 1),
+    "server.preview_poll_seconds": _number(float, 1),
+    "server.render_workers": _number(int),
+}
+
+
+def _merge_defaults(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(a)
+    for k, v in b.items():
+        if isinstance(v, dict):
+            out[k] = _merge_defaults(out.get(k, {}) or {}, v)
+        else:
+            out.setdefault(k, copy.deepcopy(v))
+    return out
+
+
+def _lookup(node: Any, path: str) -> Tuple[bool, Any]:
+    for key in path.split("."):
+        if not isinstance(node, dict) or key not in node:
+            return False, None
+        node = node[key]
+    return True, node
+
+
+def _assign(node: Dict[str, Any], path: str, value: Any) -> None:
+    keys = path.split(".")
+    for key in keys[:-1]:
+        child = node.get(key)
+        if not isinstance(child, dict):
+            child = node[key] = {}
+        node = child
+    node[keys[-1]] = value
+
+
+def _flatten(node: Any, prefix: str = "") -> Dict[str, Any]:
+    if not isinstance(node, dict):
+        return {prefix: node}
+    out: Dict[str, Any] = {}
+    for key, value in node.items():
+        out.update(_flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    return out
+
+
 class ConfigManager:
+    """Settings from ``config/settings.yaml``, merged with defaults and typed by ``SCHEMA``.
+
+    Updates are copy-on-write: a new settings tree is built, validated and swapped in
+    with a single assignment, so readers never see a half-applied change. Callbacks
+    registered with ``subscribe`` receive the changed dotted paths under their prefix.
+    ``watch()`` reloads the file when it is edited outside this process.
+    """
+
     def __init__(self, base_dir: str | None = None) -> None:
         self.base_dir = base_dir or os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
         self.config_dir = os.path.join(self.base_dir, "config")
         self.settings_file = os.path.join(self.config_dir, "settings.yaml")
+        self.cache_dir = os.path.join(self.base_dir, "cache")
         os.makedirs(self.config_dir, exist_ok=True)
         self._settings: Dict[str, Any] = {}
+        self._subscribers: List[Tuple[str, Callable[[Set[str]], None]]] = []
+        self._lock = threading.RLock()
+        self._watcher: Optional["SettingsWatcher"] = None
         self._load()
 
     def _load(self) -> None:
         if not os.path.exists(self.settings_file):
-            self._settings = DEFAULT_SETTINGS.copy()
+            self._apply(copy.deepcopy(DEFAULT_SETTINGS))
             self.save()
         else:
-            with open(self.settings_file, "r", encoding="utf-8") as f:
-                self._settings = yaml.safe_load(f) or {}
+            self.reload()
 
-        # Merge defaults for missing keys
-        def merge(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
-            out = dict(a)
-            for k, v in b.items():
-                if isinstance(v, dict):
-                    out[k] = merge(out.get(k, {}), v)
-                else:
-                    out.setdefault(k, v)
-            return out
-
-        self._settings = merge(self._settings, DEFAULT_SETTINGS)
+    def reload(self) -> bool:
+        """Re-read the settings file; keeps the current settings if it cannot be parsed."""
+        try:
+            with open(self.settings_file, "r", encoding="utf-8") as f:
+                loaded = yaml.safe_load(f) or {}
+            if not isinstance(loaded, dict):
+                raise ValueError("top level must be a mapping")
+        except (OSError, ValueError, yaml.YAMLError) as exc:
+            logger.warning("Ignoring unreadable %s: %s", self.settings_file, exc)
+            return False
+        return bool(self._apply(loaded))
 
     def get(self, path: str, default: Any | None = None) -> Any:
-        node: Any = self._settings
-        for key in path.split("."):
-            if not isinstance(node, dict) or key not in node:
-                return default
-            node = node[key]
-        return node
+        found, value = _lookup(self._settings, path)
+        return value if found else default
 
     def set(self, path: str, value: Any) -> None:
-        keys = path.split(".")
-        node = self._settings
-        for key in keys[:-1]:
-            node = node.setdefault(key, {})
-        node[keys[-1]] = value
+        self.update({path: value})
+
+    def update(self, values: Dict[str, Any]) -> Set[str]:
+        with self._lock:
+            new = copy.deepcopy(self._settings)
+            for path, value in values.items():
+                _assign(new, path, value)
+            return self._apply(new)
 
     def save(self) -> None:
-        with open(self.settings_file, "w", encoding="utf-8") as f:
-            yaml.safe_dump(self._settings, f, sort_keys=False)
+        with self._lock:
+            tmp = f"{self.settings_file}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                yaml.safe_dump(self._settings, f, sort_keys=False)
+            os.replace(tmp, self.settings_file)
+
+    def subscribe(self, prefix: str, callback: Callable[[Set[str]], None]) -> None:
+        """Call ``callback(changed_paths)`` whenever a setting under ``prefix`` changes."""
+        with self._lock:
+            self._subscribers.append((prefix, callback))
+
+    def watch(self, poll_interval: float = 2.0) -> None:
+        if self._watcher is None:
+            self._watcher = SettingsWatcher(self, poll_interval)
+            self._watcher.start()
 
     @property
     def settings(self) -> Dict[str, Any]:
         return self._settings
 
+    def _apply(self, raw: Dict[str, Any]) -> Set[str]:
+        new = _merge_defaults(raw, DEFAULT_SETTINGS)
+        for path, coerce in SCHEMA.items():
+            found, value = _lookup(new, path)
+            if not found:
+                continue
+            try:
+                _assign(new, path, coerce(value))
+            except (TypeError, ValueError) as exc:
+                _, fallback = _lookup(DEFAULT_SETTINGS, path)
+                logger.warning("Invalid setting %s=%r (%s); using %r", path, value, exc, fallback)
+                _assign(new, path, copy.deepcopy(fallback))
+
+        with self._lock:
+            old_flat, new_flat = _flatten(self._settings), _flatten(new)
+            changed = {p for p in old_flat.keys() | new_flat.keys() if old_flat.get(p) != new_flat.get(p)}
+            self._settings = new
+            subscribers = list(self._subscribers)
+        if changed and old_flat:
+            logger.info("Settings changed: %s", ", ".join(sorted(changed)))
+            for prefix, callback in subscribers:
+                relevant = {p for p in changed if not prefix or p == prefix or p.startswith(prefix + ".")}
+                if relevant:
+                    try:
+                        callback(relevant)
+                    except Exception:
+                        logger.exception("Settings subscriber for %r failed", prefix)
+        return changed
+
+
+def profile_settings(settings: Dict[str, Any], name: str) -> Dict[str, Any]:
+    """``settings`` with ``devices.<name>`` layered on top (and no ``devices`` of its own)."""
+    overrides = (settings.get("devices") or {}).get(name) or {}
+    base = {k: v for k, v in settings.items() if k != "devices"}
+    return _merge_defaults(copy.deepcopy(overrides), base) if isinstance(overrides, dict) else base
+
+
+class ProfileConfig(ConfigManager):
+    """Settings of one render farm device, held in memory and typed like the file settings.
+
+    The farm builds them with ``profile_settings`` and pushes changes with ``replace``;
+    profiles are edited under ``devices.<name>`` in the main settings, never saved here.
+    """
+
+    def __init__(self, base_dir: str, name: str, settings: Dict[str, Any]) -> None:
+        self.name = name
+        self._initial = settings
+        super().__init__(base_dir)
+
+    def _load(self) -> None:
+        self._apply(copy.deepcopy(self._initial))
+
+    def reload(self) -> bool:
+        return False
+
+    def replace(self, settings: Dict[str, Any]) -> Set[str]:
+        return self._apply(copy.deepcopy(settings))
+
+    def save(self) -> None:
+        pass
+
+    def watch(self, poll_interval: float = 2.0) -> None:
+        pass
+
+
+class SettingsWatcher(threading.Thread):
+    """Reload settings when the file changes: inotify on Linux, mtime polling elsewhere."""
+
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, config: ConfigManager, poll_interval: float = 2.0) -> None:
+        super().__init__(name="settings-watcher", daemon=True)
+        self.config = config
+        self.poll_interval = poll_interval
+
+    def run(self) -> None:
+        fd = self._inotify()
+        if fd is None:
+            self._poll()
+        else:
+            self._watch(fd)
+
+    def _inotify(self) -> Optional[int]:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            # Watch the directory: editors and save() replace the file rather than rewrite it
+            mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            if libc.inotify_add_watch(fd, self.config.config_dir.encode(), mask) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def _watch(self, fd: int) -> None:
+        name = os.path.basename(self.config.settings_file).encode()
+        while True:
+            select.select([fd], [], [])
+            touched = False
+            # Editors emit bursts of events; drain them and reload once
+            while True:
+                try:
+                    data = os.read(fd, 4096)
+                except BlockingIOError:
+                    break
+                offset = 0
+                while offset < len(data):
+                    _, _, _, length = self._EVENT.unpack_from(data, offset)
+                    offset += self._EVENT.size
+                    touched = touched or data[offset : offset + length].rstrip(b"\0") == name
+                    offset += length
+                if not select.select([fd], [], [], 0.2)[0]:
+                    break
+            if touched:
+                self.config.reload()
+
+    def _poll(self) -> None:
+        last = self._stamp()
+        while True:
+            time.sleep(self.poll_interval)
+            stamp = self._stamp()
+            if stamp != last:
+                last = stamp
+                self.config.reload()
 
+    def _stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.config.settings_file)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
@@ -0,0 +1,355 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from datetime import datetime
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+from .app import (
+    EMPTY_CONTEXT,
+    SOURCE_KEYS,
+    DataSources,
+    context_hash,
+    data_cache,
+    format_now,
+    load_widgets,
+    required_sources,
+)
+from .config import ConfigManager, ProfileConfig, profile_settings
+from .frames import FrameHistory, pack_indices
+from .metrics import metrics
+from .procs import process_tree
+from .renderer import BASE_LANDSCAPE, DisplayRenderer, panel_frame
+from .worker import render_frame
+from ..services.cache import SWRCache
+from ..widgets.base import Widget
+
+
+logger = logging.getLogger(__name__)
+
+# Device names end up in URLs (/api/devices/<name>/frame.png)
+_DEVICE_NAME = re.compile(r"[A-Za-z0-9_-]+")
+
+RENDER_TIMEOUT = 120  # seconds a round of device frames may take; a worker still busy then is killed
+WORKER_DEVICES = 8  # renderers (each with its own Chrome in html mode) one pool worker keeps
+
+
+@dataclass
+class DeviceFrame:
+    png: bytes  # panel-ready 800x480 palette PNG
+    etag: str  # hash of the palette indices, so identical pictures keep their ETag
+    signature: str  # settings + context it was rendered from
+    rendered_at: float
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+# Pool worker state: device name -> (settings digest, config, renderer, widgets), least recently rendered first
+_worker_devices: "OrderedDict[str, Tuple[str, ProfileConfig, DisplayRenderer, List[Widget]]]" = OrderedDict()
+
+
+def render_device(name: str, base_dir: str, settings: Dict[str, Any], context: dict) -> Tuple[bytes, bytes, str, float]:
+    """Render one device frame in a pool worker: ``(palette PNG, packed indices, frame hash, seconds)``.
+
+    Each device always renders on the same worker, which keeps its renderer, so
+    templates, styles, the palette LUT and (in html mode) the browser stay warm from one
+    frame to the next. Beyond ``WORKER_DEVICES`` the least recently rendered is closed.
+    """
+    started = time.perf_counter()
+    digest = _digest(settings)
+    state = _worker_devices.get(name)
+    if state is None:
+        config = ProfileConfig(base_dir, name, settings)
+        state = (digest, config, DisplayRenderer(config, headless=True), load_widgets(config))
+    elif state[0] != digest:
+        state[1].replace(settings)
+        state = (digest, state[1], state[2], load_widgets(state[1]))
+    _worker_devices[name] = state
+    _worker_devices.move_to_end(name)
+    while len(_worker_devices) > WORKER_DEVICES:
+        _, (_, _, evicted, _) = _worker_devices.popitem(last=False)
+        evicted.close()
+    _, config, renderer, widgets = state
+
+    image = render_frame(config, renderer, widgets, context)
+    quantizer = renderer.quantizer()
+    indices = quantizer.quantize(
+        panel_frame(image, config.get("display.orientation", "portrait")),
+        config.get("display.dither", "bayer") or "none",
+    )
+    buf = BytesIO()
+    quantizer.to_image(indices).save(buf, format="PNG")
+    packed = pack_indices(indices)
+    return buf.getvalue(), packed, hashlib.sha1(indices.tobytes()).hexdigest(), time.perf_counter() - started
+
+
+def _record_pid(pid: Any) -> None:
+    """Pool initializer: publish the worker's pid, so a hung render can be killed."""
+    pid.value = os.getpid()
+
+
+class RenderFarm:
+    """One server rendering panel frames for every device profile under ``devices``.
+
+    A profile is the main settings with ``devices.<name>`` layered on top, so it can
+    change orientation, template, theme, widgets or data sources. Each source some
+    profile draws (``required_sources``) is fetched once per distinct configuration: profiles whose ``data.<source>`` and
+    ``cache.ttl.<source>`` settings are equal read the same fetched value. Frames are
+    rendered by ``server.render_workers`` worker processes (default one per core), each
+    device pinned to one of them, and kept as panel-ready palette PNGs (``frame(name)``) and packed frames (``history(name)``).
+    ``RefreshScheduler`` drives fetches and frames exactly as it does for one panel.
+    """
+
+    def __init__(self, config: ConfigManager, cache: Optional[SWRCache] = None, workers: Optional[int] = None) -> None:
+        self.config = config
+        self.cache = cache or data_cache(config)
+        self.workers = workers or config.get("server.render_workers") or os.cpu_count() or 1
+        self.fetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="farm-fetch")
+        # Shared by every fetcher; separate from fetch_executor, so refresh_source waiting cannot starve it
+        self._source_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="farm-source")
+        # One single-process pool per worker, so a device always lands where its renderer is
+        self._pools: List[Optional[ProcessPoolExecutor]] = [None] * self.workers
+        self._worker_pids: List[Any] = [None] * self.workers  # shared ints set by _record_pid
+        self._slots: Dict[str, int] = {}
+        # device -> its last render job, so a device is never queued twice
+        self._running: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._profiles: Dict[str, ProfileConfig] = {}
+        # (source, digest of its settings) -> data sources that fetch it for every profile
+        self._fetchers: Dict[Tuple[str, str], DataSources] = {}
+        self._frames: Dict[str, DeviceFrame] = {}
+        self._history: Dict[str, FrameHistory] = {}
+        # device -> sources its profile draws, with their refresh intervals
+        self._required: Dict[str, Dict[str, float]] = {}
+        self._scheduler: Any = None
+        self._sync_profiles()
+        config.subscribe("", lambda _: self._sync_profiles())
+
+    def start(self) -> None:
+        """Fetch and render in the background until the process exits."""
+        from .scheduler import RefreshScheduler
+
+        self._scheduler = RefreshScheduler(self)
+        threading.Thread(target=self._scheduler.run_forever, name="farm-scheduler", daemon=True).start()
+
+    def devices(self) -> List[str]:
+        with self._lock:
+            return list(self._profiles)
+
+    def frame(self, name: str) -> Optional[DeviceFrame]:
+        with self._lock:
+            return self._frames.get(name)
+
+    def history(self, name: str) -> Optional[FrameHistory]:
+        """Recent packed frames of ``name``, for key frame and delta responses."""
+        with self._lock:
+            return self._history.get(name)
+
+    def status(self) -> List[dict]:
+        with self._lock:
+            return [
+                {
+                    "name": name,
+                    "mode": config.get("display.mode"),
+                    "orientation": config.get("display.orientation"),
+                    "etag": self._frames[name].etag if name in self._frames else None,
+                    "rendered_at": self._frames[name].rendered_at if name in self._frames else None,
+                }
+                for name, config in self._profiles.items()
+            ]
+
+    # -- RefreshScheduler interface ------------------------------------------------
+
+    def sources(self) -> List[str]:
+        return list(SOURCE_KEYS)
+
+    def source_interval(self, source: str) -> Optional[float]:
+        """Shortest refresh interval any profile asks of ``source``; ``None`` when no profile draws it."""
+        with self._lock:
+            intervals = [required[source] for required in self._required.values() if source in required]
+        return min(intervals) if intervals else None
+
+    def refresh_source(self, source: str) -> bool:
+        """Fetch ``source`` once per distinct configuration; ``True`` when any of them changed."""
+        with self._lock:
+            fetchers = [data for (name, _), data in self._fetchers.items() if name == source]
+        futures = [self._source_executor.submit(data.refresh_source, source) for data in fetchers]
+        changed = False
+        for future in futures:
+            try:
+                changed = future.result() or changed
+            except Exception as exc:
+                logger.warning("Refreshing %s failed: %s", source, exc)
+        return changed
+
+    def render_once(self, now: Optional[datetime] = None, force: bool = False) -> None:
+        """Render every device whose settings or data changed since its last frame."""
+        now = now or datetime.now()
+        with self._lock:
+            profiles = list(self._profiles.items())
+        with metrics.trace("farm", devices=len(profiles), forced=force):
+            jobs: Dict[str, Tuple[str, Future]] = {}
+            for name, config in profiles:
+                context = self._context(config, now)
+                ignore = config.get("display.change_detection.ignore_keys", []) or []
+                signature = _digest([config.settings, context_hash(context, ignore)])
+                current = self.frame(name)
+                if current is not None and current.signature == signature and not force:
+                    metrics.inc("frames_skipped_total", reason="context_unchanged", device=name)
+                    continue
+                running = self._running.get(name)
+                if running is not None and not running.done():
+                    metrics.inc("frames_skipped_total", reason="render_running", device=name)
+                    continue
+                future = self._pool(name).submit(render_device, name, self.config.base_dir, config.settings, context)
+                self._running[name] = future
+                jobs[name] = (signature, future)
+            deadline = time.monotonic() + RENDER_TIMEOUT
+            for name, (signature, future) in jobs.items():
+                try:
+                    png, packed, etag, seconds = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                except TimeoutError:
+                    logger.error("Rendering %s took longer than %gs; killing its worker", name, RENDER_TIMEOUT)
+                    metrics.inc("frames_failed_total", device=name)
+                    self._reset_pool(name, kill=True)
+                    continue
+                except BrokenProcessPool:
+                    logger.error("Render worker died while rendering %s; restarting it", name)
+                    metrics.inc("frames_failed_total", device=name)
+                    self._reset_pool(name)
+                    continue
+                except Exception:
+                    logger.exception("Rendering %s failed", name)
+                    metrics.inc("frames_failed_total", device=name)
+                    continue
+                metrics.observe("render", seconds, mode="farm", device=name)
+                metrics.inc("panel_updates_total", device=name)
+                with self._lock:
+                    if name in self._profiles:
+                        self._frames[name] = DeviceFrame(png, etag, signature, time.time())
+                        self._history.setdefault(name, FrameHistory(*BASE_LANDSCAPE)).add(etag, packed)
+            metrics.annotate(rendered=sorted(jobs))
+        metrics.set("last_frame_timestamp_seconds", time.time())
+
+    # -------------------------------------------------------------------------------
+
+    def _pool(self, name: str) -> ProcessPoolExecutor:
+        """The worker ``name`` renders on; new devices go to the worker with the fewest."""
+        with self._lock:
+            slot = self._slots.get(name)
+            if slot is None:
+                load = [0] * self.workers
+                for assigned in self._slots.values():
+                    load[assigned] += 1
+                slot = self._slots[name] = load.index(min(load))
+            if self._pools[slot] is None:
+                # spawn: workers must not inherit the server's threads and sockets
+                context = multiprocessing.get_context("spawn")
+                pid = self._worker_pids[slot] = context.Value("i", 0)
+                self._pools[slot] = ProcessPoolExecutor(
+                    max_workers=1, mp_context=context, initializer=_record_pid, initargs=(pid,)
+                )
+            return self._pools[slot]
+
+    def _reset_pool(self, name: str, kill: bool = False) -> None:
+        """Drop the worker ``name`` renders on; ``kill`` first ends a hung one with its Chrome.
+
+        The worker is shared by every device pinned to it: their queued or running
+        frames fail for this round and their warm renderers (and Chrome sessions) are
+        rebuilt by the next worker on that slot.
+        """
+        with self._lock:
+            slot = self._slots.get(name)
+            if slot is None:
+                return
+            pool, self._pools[slot] = self._pools[slot], None
+            pid, self._worker_pids[slot] = self._worker_pids[slot], None
+            sharing = sorted(other for other, assigned in self._slots.items() if assigned == slot and other != name)
+        if pool is None:
+            return
+        if kill and pid is not None and pid.value:
+            if sharing:
+                logger.warning("Also restarting %s, rendered by the same worker", ", ".join(sharing))
+            # A hung worker cannot close Chrome itself; its chromedriver and Chrome go with it
+            for child in reversed(process_tree(pid.value)):
+                try:
+                    os.kill(child, signal.SIGKILL)
+                except OSError:
+                    pass
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _context(self, config: ProfileConfig, now: datetime) -> dict:
+        context: Dict[str, Any] = {"now_str": format_now(now)}
+        with self._lock:
+            for source, key in SOURCE_KEYS.items():
+                data = self._fetchers.get((source, self._source_digest(config, source)))
+                context[key] = data.latest(key) if data is not None else EMPTY_CONTEXT[key]
+        return context
+
+    @staticmethod
+    def _source_digest(config: ConfigManager, source: str) -> str:
+        return _digest([config.get(f"data.{source}"), config.get(f"cache.ttl.{source}")])
+
+    def _sync_profiles(self) -> None:
+        """Follow ``devices`` edits: add, update and remove profiles and their fetchers."""
+        settings = self.config.settings
+        names = []
+        for name in settings.get("devices") or {}:
+            if _DEVICE_NAME.fullmatch(str(name)):
+                names.append(str(name))
+            else:
+                logger.warning("Ignoring device %r: names may only use letters, digits, '-' and '_'", name)
+        started: List[Tuple[str, DataSources]] = []
+        with self._lock:
+            for name in names:
+                merged = profile_settings(settings, name)
+                if name in self._profiles:
+                    self._profiles[name].replace(merged)
+                else:
+                    self._profiles[name] = ProfileConfig(self.config.base_dir, name, merged)
+            for name in set(self._profiles) - set(names):
+                del self._profiles[name]
+                self._slots.pop(name, None)
+                self._running.pop(name, None)
+                self._frames.pop(name, None)
+                self._history.pop(name, None)
+            self._required = {name: required_sources(config) for name, config in self._profiles.items()}
+
+            wanted = {
+                (source, self._source_digest(config, source)): config
+                for name, config in self._profiles.items()
+                for source in self._required[name]
+            }
+            for key in set(self._fetchers) - set(wanted):
+                self._fetchers.pop(key).close()
+            for key, config in wanted.items():
+                if key not in self._fetchers:
+                    # A frozen copy: these sources fetch for one configuration and are replaced, not updated
+                    frozen = ProfileConfig(self.config.base_dir, config.name, config.settings)
+                    self._fetchers[key] = DataSources(frozen, cache=self.cache, executor=self._source_executor)
+                    started.append((key[0], self._fetchers[key]))
+        for source, data in started:
+            # New configurations fetch right away instead of waiting for the source's cadence
+            self._source_executor.submit(data.refresh_source, source).add_done_callback(self._first_fetch_done)
+        if started:
+            logger.info("Render farm: %d device(s), %d source configuration(s)", len(names), len(wanted))
+
+    def _first_fetch_done(self, future: Future) -> None:
+        if future.exception() is not None:
+            logger.warning("First fetch failed: %s", future.exception())
+        elif self._scheduler is not None:
+            self._scheduler.request_frame()
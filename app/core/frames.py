@@ -0,0 +1,193 @@
+"""Compact panel frames: 4-bit packed palette indices, whole or as XOR deltas.
+
+A frame body is an 11-byte header followed by the payload::
+
+    magic   4s   b"INKF"
+    version B    1
+    kind    B    0 = key frame, 1 = delta (XOR with the client's previous packed frame)
+    coding  B    0 = raw, 1 = zlib, 2 = PackBits RLE
+    width   H    little-endian
+    height  H
+
+The unencoded payload is always ``width * height / 2`` bytes: two palette indices
+per byte, the left pixel in the high nibble, rows top to bottom. An 800x480 frame is
+192000 bytes raw, and a delta between similar frames is mostly zero bytes, which
+both codings shrink to a few hundred. PackBits is there for clients without zlib.
+"""
+
+from __future__ import annotations
+
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+MAGIC = b"INKF"
+VERSION = 1
+HEADER = struct.Struct("<4sBBBHH")
+
+KEY, DELTA = 0, 1
+CODINGS = {"raw": 0, "zlib": 1, "rle": 2}
+
+
+def pack_indices(indices: np.ndarray) -> bytes:
+    """``(H, W)`` palette indices (< 16) as 4-bit pairs; ``W`` must be even."""
+    flat = np.ascontiguousarray(indices, dtype=np.uint8).reshape(-1)
+    return ((flat[0::2] << 4) | (flat[1::2] & 0x0F)).tobytes()
+
+
+def unpack_indices(packed: bytes, width: int, height: int) -> np.ndarray:
+    pairs = np.frombuffer(packed, dtype=np.uint8)
+    out = np.empty(pairs.size * 2, dtype=np.uint8)
+    out[0::2] = pairs >> 4
+    out[1::2] = pairs & 0x0F
+    return out.reshape(height, width)
+
+
+def xor_bytes(a: bytes, b: bytes) -> bytes:
+    return (np.frombuffer(a, dtype=np.uint8) ^ np.frombuffer(b, dtype=np.uint8)).tobytes()
+
+
+def rle_encode(data: bytes) -> bytes:
+    """PackBits: ``n`` in 0..127 is followed by ``n + 1`` literal bytes, ``257 - n`` in 129..255
+    (a run of ``n`` in 2..128) by the byte to repeat."""
+    a = np.frombuffer(data, dtype=np.uint8)
+    if not a.size:
+        return b""
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(a)) + 1))
+    lengths = np.diff(np.append(starts, a.size))
+    out = bytearray()
+    literal_from = None  # start of pending literal bytes
+
+    def flush_literals(end: int) -> None:
+        for i in range(literal_from, end, 128):
+            chunk = data[i : min(i + 128, end)]
+            out.append(len(chunk) - 1)
+            out.extend(chunk)
+
+    # Loop over runs rather than bytes; a delta frame is a handful of runs
+    for start, length in zip(starts.tolist(), lengths.tolist()):
+        if length < 3:
+            if literal_from is None:
+                literal_from = start
+            continue
+        if literal_from is not None:
+            flush_literals(start)
+            literal_from = None
+        value = data[start]
+        while length > 0:
+            n = min(length, 128)
+            if n < 2:
+                out += bytes((0, value))
+            else:
+                out += bytes((257 - n, value))
+            length -= n
+    if literal_from is not None:
+        flush_literals(a.size)
+    return bytes(out)
+
+
+def rle_decode(data: bytes) -> bytes:
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        n = data[i]
+        if n < 128:
+            out += data[i + 1 : i + n + 2]
+            i += n + 2
+        elif n > 128:
+            out += bytes((data[i + 1],)) * (257 - n)
+            i += 2
+        else:  # 128 is a no-op in PackBits
+            i += 1
+    return bytes(out)
+
+
+def encode_frame(packed: bytes, width: int, height: int, base: Optional[bytes] = None, coding: str = "zlib") -> bytes:
+    """Frame body for ``packed``: a key frame, or a delta against ``base`` when given."""
+    payload = packed if base is None else xor_bytes(packed, base)
+    if coding == "zlib":
+        payload = zlib.compress(payload, 6)
+    elif coding == "rle":
+        payload = rle_encode(payload)
+    elif coding != "raw":
+        raise ValueError(f"unknown frame coding {coding!r}")
+    kind = KEY if base is None else DELTA
+    return HEADER.pack(MAGIC, VERSION, kind, CODINGS[coding], width, height) + payload
+
+
+def decode_frame(body: bytes, previous: Optional[bytes] = None) -> Tuple[bytes, int, int]:
+    """``(packed, width, height)`` from a frame body; deltas need the ``previous`` packed frame."""
+    magic, version, kind, coding, width, height = HEADER.unpack_from(body)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a version 1 frame")
+    payload = body[HEADER.size :]
+    if coding == CODINGS["zlib"]:
+        payload = zlib.decompress(payload)
+    elif coding == CODINGS["rle"]:
+        payload = rle_decode(payload)
+    if len(payload) != width * height // 2:
+        raise ValueError(f"frame payload is {len(payload)} bytes, expected {width * height // 2}")
+    if kind == DELTA:
+        if previous is None or len(previous) != len(payload):
+            raise ValueError("delta frame without a matching previous frame")
+        payload = xor_bytes(payload, previous)
+    return payload, width, height
+
+
+class FrameHistory:
+    """The last few packed frames of one display, and their encoded responses.
+
+    ``encode`` answers a client that holds frame ``base``: a delta when that frame is
+    still remembered, otherwise a key frame. Encodings are cached, since every client
+    of a display asks for the same few.
+    """
+
+    def __init__(self, width: int, height: int, depth: int = 8, encoded: int = 32) -> None:
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self._frames: "OrderedDict[str, bytes]" = OrderedDict()
+        self._encoded: "OrderedDict[Tuple[str, Optional[str], str], bytes]" = OrderedDict()
+        self._encoded_size = encoded
+        self._lock = threading.Lock()
+
+    @property
+    def latest(self) -> Optional[str]:
+        with self._lock:
+            return next(reversed(self._frames), None)
+
+    def add(self, frame_hash: str, packed: bytes) -> None:
+        with self._lock:
+            self._frames[frame_hash] = packed
+            self._frames.move_to_end(frame_hash)
+            while len(self._frames) > self.depth:
+                self._frames.popitem(last=False)
+
+    def encode(self, base: Optional[str], coding: str = "zlib") -> Optional[Tuple[str, bool, bytes]]:
+        """``(frame hash, is delta, body)`` of the latest frame, or ``None`` before the first one."""
+        with self._lock:
+            if not self._frames:
+                return None
+            latest = next(reversed(self._frames))
+            if base not in self._frames or base == latest:
+                base = None
+            key = (latest, base, coding)
+            body = self._encoded.get(key)
+            if body is None:
+                packed = self._frames[latest]
+                reference = self._frames[base] if base is not None else None
+        if body is None:
+            body = encode_frame(packed, self.width, self.height, reference, coding)
+            with self._lock:
+                self._encoded[key] = body
+                while len(self._encoded) > self._encoded_size:
+                    self._encoded.popitem(last=False)
+        else:
+            with self._lock:
+                self._encoded.move_to_end(key)
+        return latest, base is not None, body
@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageStat
+
+from .sparkline import sparkline_points
+
+
+RGB = Tuple[int, int, int]
+
+CONTAINER: Tuple[int, int] = (480, 800)  # .container.portrait
+UP = "#18d18f"  # .spark / .chg.up
+# Pixels the .spark column spans: the container less .grid padding, .panel border and padding, and the .top gap
+SPARK_WIDTH = (CONTAINER[0] - 2 * 12 - 2 * (1 + 16) - 12) // 2
+
+_ROOT_RE = re.compile(r":root\s*\{([^}]*)\}")
+_VAR_RE = re.compile(r"--([\w-]+)\s*:\s*([^;]+);?")
+
+
+def theme_variables(theme: dict) -> Dict[str, str]:
+    """CSS variables overridden by the ``theme`` section of the settings."""
+    return {
+        "bg": theme.get("background", "#0b1220"),
+        "fg": theme.get("primary", "#F2F5F9"),
+        "muted": theme.get("muted", "#7D8CA3"),
+        "accent": theme.get("accent", "#3EC1D3"),
+        "accent2": theme.get("accent2", "#FF6B6B"),
+    }
+
+
+def file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    """``(mtime_ns, size)`` of ``path``, or ``None`` when it is missing: changes whenever the file is edited."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def css_variables(css: str) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    for block in _ROOT_RE.findall(css):
+        for name, value in _VAR_RE.findall(block):
+            out[name] = value.strip()
+    return out
+
+
+def parse_color(value: str) -> RGB:
+    value = value.strip()
+    if value.startswith("#"):
+        h = value[1:]
+        if len(h) == 3:
+            h = "".join(c * 2 for c in h)
+        return (int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16))
+    return Image.new("RGB", (1, 1), value).getpixel((0, 0))
+
+
+def blend(base: RGB, over: RGB, alpha: float) -> RGB:
+    return tuple(round(b + (o - b) * alpha) for b, o in zip(base, over))  # type: ignore[return-value]
+
+
+def frame_difference(a: Image.Image, b: Image.Image) -> float:
+    """Mean absolute per-channel difference between two frames, 0.0 (same) to 1.0."""
+    if a.size != b.size:
+        b = b.resize(a.size)
+    diff = ImageChops.difference(a.convert("RGB"), b.convert("RGB"))
+    return sum(ImageStat.Stat(diff).mean) / (3 * 255)
+
+
+class LayoutEngine:
+    """Browser-free renderer for the ``display.html`` layout.
+
+    Draws the header bar, weather panel, sparkline, ticker, agenda and news lists with
+    PIL. Box sizes mirror ``styles.css`` (paddings, gaps, grid tracks, radii) and colours
+    come from the same CSS variables, so frames stay close to the Chrome path; use
+    ``frame_difference`` to check how close.
+    """
+
+    # Context variables render() draws
+    CONTEXT_KEYS = frozenset({"now_str", "weather", "market", "agenda", "headlines"})
+
+    def __init__(self, config, base_dir: str) -> None:
+        self.config = config
+        self.base_dir = base_dir
+        self._fonts: Dict[Tuple[int, bool], ImageFont.FreeTypeFont] = {}
+        # (styles.css stamp, theme) -> colors, so a frame does not re-read the stylesheet
+        self._palette: Tuple[Any, Dict[str, RGB]] = (None, {})
+
+    # Fonts -----------------------------------------------------------------
+
+    def font(self, size: int, bold: bool = False) -> ImageFont.FreeTypeFont:
+        key = (size, bold)
+        if key not in self._fonts:
+            name = self.config.get("theme.font", "DejaVuSans.ttf")
+            candidates = [name]
+            if bold:
+                stem, ext = os.path.splitext(name)
+                candidates.insert(0, f"{stem}-Bold{ext or '.ttf'}")
+            for candidate in candidates:
+                try:
+                    self._fonts[key] = ImageFont.truetype(candidate, size=size)
+                    break
+                except OSError:
+                    continue
+            else:
+                self._fonts[key] = ImageFont.load_default(size=size)
+        return self._fonts[key]
+
+    def line_height(self, font: ImageFont.FreeTypeFont) -> int:
+        ascent, descent = font.getmetrics()
+        return ascent + descent
+
+    def wrap(self, text: str, font: ImageFont.FreeTypeFont, width: int) -> List[str]:
+        lines: List[str] = []
+        current = ""
+        for word in str(text).split():
+            trial = f"{current} {word}" if current else word
+            if current and font.getlength(trial) > width:
+                lines.append(current)
+                current = word
+            else:
+                current = trial
+        return lines + [current] if current else lines or [""]
+
+    # Rendering -------------------------------------------------------------
+
+    def palette(self) -> Dict[str, RGB]:
+        css_path = os.path.join(self.base_dir, "templates", "styles.css")
+        theme = theme_variables(self.config.get("theme", {}) or {})
+        key = (file_stamp(css_path), tuple(theme.items()))
+        if self._palette[0] == key:
+            return self._palette[1]
+        try:
+            with open(css_path, "r", encoding="utf-8") as f:
+                variables = css_variables(f.read())
+        except OSError:
+            variables = {}
+        variables.update(theme)
+        bg = parse_color(variables["bg"])
+        white = (255, 255, 255)
+        colors = {
+            "bg": bg,
+            "fg": parse_color(variables["fg"]),
+            "muted": parse_color(variables["muted"]),
+            "accent": parse_color(variables["accent"]),
+            "accent2": parse_color(variables["accent2"]),
+            "up": parse_color(UP),
+            "panel": blend(bg, white, 0.04),
+            "line": blend(bg, white, 0.08),
+        }
+        self._palette = (key, colors)
+        return colors
+
+    def render(self, context: dict, size: Tuple[int, int]) -> Image.Image:
+        colors = self.palette()
+        # The template is a fixed portrait container; other canvas sizes crop or pad it like Chrome does
+        image = Image.new("RGB", size, colors["bg"])
+        draw = ImageDraw.Draw(image)
+        width, height = CONTAINER
+
+        top = self._draw_bar(draw, context, colors, width)
+        pad = gap = 12
+        avail = height - top - 2 * pad - 2 * gap
+        rows = [avail / 3.2, avail * 1.2 / 3.2, avail / 3.2]  # grid-template-rows: 1fr 1.2fr 1fr
+        y = top + pad
+        boxes = []
+        for row_h in rows:
+            boxes.append((pad, round(y), width - pad, round(y + row_h)))
+            y += row_h + gap
+
+        self._draw_top(draw, boxes[0], context, colors)
+        self._draw_agenda(draw, boxes[1], context.get("agenda") or [], colors)
+        self._draw_news(draw, boxes[2], context.get("headlines") or [], colors)
+        return image
+
+    def _draw_bar(self, draw: ImageDraw.ImageDraw, context: dict, colors: Dict[str, RGB], width: int) -> int:
+        font = self.font(16)
+        bold = self.font(16, bold=True)
+        bar_h = 16 + self.line_height(font) + 16
+        for row in range(bar_h):
+            # linear-gradient(180deg, rgba(255,255,255,0.04), transparent)
+            draw.line([(0, row), (width - 1, row)], fill=blend(colors["bg"], (255, 255, 255), 0.04 * (1 - row / bar_h)))
+        draw.line([(0, bar_h), (width - 1, bar_h)], fill=colors["line"])
+        draw.text((20, 16), "Board", font=bold, fill=colors["accent"], anchor="la")
+        draw.text((width - 20, 16), str(context.get("now_str", "")), font=font, fill=colors["fg"], anchor="ra")
+        return bar_h + 1
+
+    def _panel(self, draw: ImageDraw.ImageDraw, box: Tuple[int, int, int, int], colors: Dict[str, RGB]) -> Tuple[int, int, int, int]:
+        draw.rounded_rectangle(box, radius=14, fill=colors["panel"], outline=colors["line"], width=1)
+        x0, y0, x1, y1 = box
+        return (x0 + 1 + 16, y0 + 1 + 14, x1 - 1 - 16, y1 - 1 - 14)
+
+    def _heading(self, draw: ImageDraw.ImageDraw, text: str, x: int, y: int, colors: Dict[str, RGB]) -> int:
+        font = self.font(18, bold=True)
+        draw.text((x, y), text, font=font, fill=colors["accent"], anchor="la")
+        return y + self.line_height(font) + 8
+
+    def _dashed(self, draw: ImageDraw.ImageDraw, x0: int, x1: int, y: int, fill: RGB) -> None:
+        for x in range(x0, x1, 6):
+            draw.line([(x, y), (min(x + 2, x1), y)], fill=fill)
+
+    def _draw_top(self, draw: ImageDraw.ImageDraw, box, context: dict, colors: Dict[str, RGB]) -> None:
+        cx0, cy0, cx1, cy1 = self._panel(draw, box, colors)
+        col_w = (cx1 - cx0 - 12) // 2
+        content_h = cy1 - cy0
+        weather = context.get("weather") or {}
+        market = context.get("market") or {}
+
+        # .weather: grid-template-columns 60px 1fr, meta wraps into the 60px track
+        icon_font, temp_font, meta_font = self.font(44), self.font(36, bold=True), self.font(16)
+        row1 = max(self.line_height(icon_font), self.line_height(temp_font))
+        meta = f"{weather.get('cond', '')} • H {weather.get('hi', '')} / L {weather.get('lo', '')}"
+        meta_lines = self.wrap(meta, meta_font, 60)
+        meta_lh = self.line_height(meta_font)
+        weather_h = row1 + 12 + meta_lh * len(meta_lines)
+        # .places spans both tracks, one row below the meta text
+        places = " · ".join(f"{p['name']} {p['icon']} {p['temp']}" for p in weather.get("places") or [])
+        places_font = self.font(14)
+        places = (self.wrap(places, places_font, col_w) or [""])[0] if places else ""
+        if places:
+            weather_h += 12 + self.line_height(places_font)
+        y = cy0 + (content_h - weather_h) // 2
+        draw.text((cx0, y + (row1 - self.line_height(icon_font)) // 2), str(weather.get("icon", "")), font=icon_font, fill=colors["fg"], anchor="la")
+        draw.text((cx0 + 72, y + (row1 - self.line_height(temp_font)) // 2), str(weather.get("temp", "")), font=temp_font, fill=colors["fg"], anchor="la")
+        my = y + row1 + 12
+        for line in meta_lines:
+            draw.text((cx0, my), line, font=meta_font, fill=colors["muted"], anchor="la")
+            my += meta_lh
+        if places:
+            draw.text((cx0, my + 12), places, font=places_font, fill=colors["muted"], anchor="la")
+
+        # .spark: 400x80 viewBox scaled to the column width, ticker below it
+        sx0 = cx0 + col_w + 12
+        svg_h = col_w * 80 // 400
+        sym_font, px_font, chg_font = self.font(16, bold=True), self.font(20, bold=True), self.font(16)
+        ticker_h = max(self.line_height(f) for f in (sym_font, px_font, chg_font))
+        spark_h = svg_h + 4 + ticker_h
+        sy0 = cy0 + (content_h - spark_h) // 2
+        points = self._spark_points(market.get("history") or [], col_w, svg_h)
+        if len(points) > 1:
+            draw.line([(sx0 + px, sy0 + py) for px, py in points], fill=colors["up"], width=max(1, round(3 * col_w / 400)), joint="curve")
+
+        baseline = sy0 + svg_h + 4 + max(f.getmetrics()[0] for f in (sym_font, px_font, chg_font))
+        change = market.get("change_pct", 0) or 0
+        x = sx0
+        for text, font, fill in (
+            (str(market.get("symbol", "")), sym_font, colors["fg"]),
+            (str(market.get("price", "")), px_font, colors["up"]),
+            (f"{change}%", chg_font, colors["up"] if float(change) >= 0 else colors["accent2"]),
+        ):
+            draw.text((x, baseline), text, font=font, fill=fill, anchor="ls")
+            x += int(font.getlength(text)) + 10
+
+    def _spark_points(self, history: Sequence, width: int, height: int) -> List[Tuple[float, float]]:
+        return [tuple(p) for p in sparkline_points(history, width, height).tolist()]
+
+    def _draw_agenda(self, draw: ImageDraw.ImageDraw, box, agenda: Sequence[dict], colors: Dict[str, RGB]) -> None:
+        cx0, cy0, cx1, _ = self._panel(draw, box, colors)
+        y = self._heading(draw, "Agenda", cx0, cy0, colors)
+        bold, regular = self.font(16, bold=True), self.font(16)
+        lh = self.line_height(regular)
+        for i, event in enumerate(agenda):
+            location = str(event.get("location", ""))
+            loc_w = int(regular.getlength(location))
+            title_x = cx0 + 64 + 10
+            title_w = max(1, cx1 - title_x - 10 - loc_w)
+            lines = self.wrap(str(event.get("title", "")), bold, title_w)
+            y += 6
+            time_color = parse_color(event["color"]) if event.get("color") else colors["muted"]
+            draw.text((cx0, y), str(event.get("time", "")), font=bold, fill=time_color, anchor="la")
+            for j, line in enumerate(lines):
+                draw.text((title_x, y + j * lh), line, font=bold, fill=colors["fg"], anchor="la")
+            if location:
+                draw.text((cx1, y), location, font=regular, fill=colors["muted"], anchor="ra")
+            y += lh * len(lines) + 6
+            if i < len(agenda) - 1:
+                self._dashed(draw, cx0, cx1, y, colors["line"])
+                y += 1
+
+    def _draw_news(self, draw: ImageDraw.ImageDraw, box, headlines: Sequence[str], colors: Dict[str, RGB]) -> None:
+        cx0, cy0, cx1, _ = self._panel(draw, box, colors)
+        y = self._heading(draw, "News", cx0, cy0, colors)
+        font = self.font(16)
+        lh = self.line_height(font)
+        for i, headline in enumerate(headlines):
+            y += 6
+            for line in self.wrap(headline, font, cx1 - cx0):
+                draw.text((cx0, y), line, font=font, fill=colors["fg"], anchor="la")
+                y += lh
+            y += 6
+            if i < len(headlines) - 1:
+                self._dashed(draw, cx0, cx1, y, colors["line"])
+                y += 1
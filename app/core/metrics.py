@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import contextvars
+import functools
+import itertools
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+
+# Seconds; covers a sub-millisecond cache hit up to a slow panel refresh
+BUCKETS: Tuple[float, ...] = (0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+@dataclass
+class Span:
+    stage: str
+    start_ms: float
+    duration_ms: float
+    error: Optional[str] = None
+
+
+@dataclass
+class FrameTrace:
+    id: int
+    kind: str
+    started_at: float
+    duration_ms: float = 0.0
+    spans: List[Span] = field(default_factory=list)
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+_current_trace: contextvars.ContextVar[Optional[FrameTrace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+class Metrics:
+    """Process-wide counters, gauges and stage timers, plus the last ``trace_limit`` frame traces.
+
+    Everything is plain dict updates under one lock, cheap enough to leave on for
+    every frame. ``timer`` also adds a span to the frame trace active in the calling
+    context, so a trace shows where a slow frame spent its time.
+    """
+
+    def __init__(self, trace_limit: int = 50) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._timers: Dict[Tuple[str, Labels], List[float]] = {}  # bucket counts, +Inf, sum, count
+        self._traces: Deque[FrameTrace] = deque(maxlen=trace_limit)
+        self._ids = itertools.count(1)
+
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = value
+
+    def observe(self, stage: str, seconds: float, **labels: Any) -> None:
+        key = (stage, _labels(labels))
+        with self._lock:
+            slots = self._timers.get(key)
+            if slots is None:
+                slots = self._timers[key] = [0.0] * (len(BUCKETS) + 3)
+            slots[bisect_left(BUCKETS, seconds)] += 1  # the slot past the last bucket is +Inf
+            slots[-2] += seconds
+            slots[-1] += 1
+
+    @contextmanager
+    def timer(self, stage: str, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as exc:
+            error = type(exc).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe(stage, elapsed, **labels)
+            trace = _current_trace.get()
+            # A fetch that outlives its frame's deadline finishes after the trace closed
+            if trace is not None and "_perf_start" in trace.attributes:
+                offset = (started - trace.attributes["_perf_start"]) * 1000
+                trace.spans.append(Span(stage, round(offset, 2), round(elapsed * 1000, 2), error))
+
+    @contextmanager
+    def trace(self, kind: str, **attributes: Any) -> Iterator[FrameTrace]:
+        """Record a frame trace; stages timed inside it become its spans."""
+        trace = FrameTrace(id=next(self._ids), kind=kind, started_at=time.time(), attributes=dict(attributes))
+        trace.attributes["_perf_start"] = time.perf_counter()
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        except BaseException as exc:
+            trace.error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            _current_trace.reset(token)
+            trace.duration_ms = round((time.perf_counter() - trace.attributes.pop("_perf_start")) * 1000, 2)
+            with self._lock:
+                self._traces.append(trace)
+
+    def replay(self, spans: List[Span], started: float) -> None:
+        """Record stages timed in another process (the render worker) as if timed here.
+
+        ``started`` is this process's ``perf_counter`` when the remote work began; the
+        spans join the active frame trace at their offset from it.
+        """
+        trace = _current_trace.get()
+        for span in spans:
+            self.observe(span.stage, span.duration_ms / 1000)
+            if trace is not None and "_perf_start" in trace.attributes:
+                offset = (started - trace.attributes["_perf_start"]) * 1000 + span.start_ms
+                trace.spans.append(Span(span.stage, round(offset, 2), span.duration_ms, span.error))
+
+    def counters(self) -> Dict[Tuple[str, Labels], float]:
+        """Current counter values, keyed by ``(name, labels)``."""
+        with self._lock:
+            return dict(self._counters)
+
+    def annotate(self, **attributes: Any) -> None:
+        """Attach attributes to the active frame trace, if any."""
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.attributes.update(attributes)
+
+    def traces(self, limit: Optional[int] = None) -> List[dict]:
+        """Most recent traces first."""
+        with self._lock:
+            recent = list(self._traces)[::-1]
+        return [asdict(t) for t in recent[:limit]]
+
+    def prometheus(self, prefix: str = "inky_") -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timers = {k: list(v) for k, v in self._timers.items()}
+        lines: List[str] = []
+        for kind, series in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({n for n, _ in series}):
+                lines.append(f"# TYPE {prefix}{name} {kind}")
+                for (n, labels), value in sorted(series.items()):
+                    if n == name:
+                        lines.append(f"{prefix}{name}{_format(labels)} {_value(value)}")
+        if timers:
+            name = f"{prefix}stage_duration_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            for (stage, labels), slots in sorted(timers.items()):
+                base = (("stage", stage),) + labels
+                cumulative = 0.0
+                for bound, count in zip(BUCKETS + (float("inf"),), slots):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{name}_bucket{_format(base + (('le', le),))} {_value(cumulative)}")
+                lines.append(f"{name}_sum{_format(base)} {_value(slots[-2])}")
+                lines.append(f"{name}_count{_format(base)} {_value(slots[-1])}")
+        return "\n".join(lines) + "\n"
+
+
+def in_context(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """``fn`` bound to a copy of the caller's context, for handing work to a thread pool.
+
+    Pool threads do not inherit context variables, so without this the stages timed
+    there never reach the frame trace that is waiting for them.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def serve_http(host: str, port: int, registry: Optional["Metrics"] = None) -> ThreadingHTTPServer:
+    """Serve ``/metrics`` and ``/api/traces`` from a background thread of this process.
+
+    The web server only sees its own preview renders; the display process (``run.py``)
+    calls this so its frame, fetch and panel timings can be scraped too.
+    """
+    registry = registry or metrics
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            if url.path == "/metrics":
+                body, kind = registry.prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+            elif url.path == "/api/traces":
+                limit = parse_qs(url.query).get("limit", [""])[0]
+                traces = registry.traces(int(limit) if limit.isdigit() else None)
+                body, kind = json.dumps(traces, default=str).encode("utf-8"), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", kind)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _value(value: float) -> str:
+    # Shortest text that reads back as the same float: ':g' turns timestamps into 1.79235e+09
+    return repr(float(value))
+
+
+def _format(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+metrics = Metrics()
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import os
+from typing import Dict, List
+
+
+def process_tree(pid: int) -> List[int]:
+    """``pid`` followed by all of its descendants (Linux only; just ``[pid]`` elsewhere)."""
+    children: Dict[int, List[int]] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return [pid]
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r", encoding="utf-8") as f:
+                # comm may contain spaces; ppid is the second field after the closing paren
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    tree = []
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def process_tree_rss_kb(pid: int) -> int:
+    """Resident memory of ``pid`` and all of its descendants, in KiB (Linux only)."""
+    total = 0
+    for current in process_tree(pid):
+        try:
+            with open(f"/proc/{current}/status", "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except (OSError, ValueError):
+            continue
+    return total
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+# Inky Impression 7.3" (AC073TC1A) palette in driver index order:
+# black, white, green, blue, red, yellow, orange. Index 7 ("clean") is never drawn.
+DESATURATED_PALETTE = np.array(
+    [[0, 0, 0], [255, 255, 255], [0, 255, 0], [0, 0, 255], [255, 0, 0], [255, 255, 0], [255, 140, 0]],
+    dtype=np.float32,
+)
+SATURATED_PALETTE = np.array(
+    [[57, 48, 57], [255, 255, 255], [58, 91, 70], [61, 59, 94], [156, 72, 75], [208, 190, 71], [177, 106, 73]],
+    dtype=np.float32,
+)
+
+DITHER_METHODS = ("none", "bayer", "diffusion")
+
+
+def impression_palette(saturation: float = 0.5) -> np.ndarray:
+    """Blend the two reference palettes the same way the Inky library does."""
+    s = float(saturation)
+    return (SATURATED_PALETTE * s + DESATURATED_PALETTE * (1.0 - s)).astype(np.uint8)
+
+
+def bayer_matrix(n: int = 8) -> np.ndarray:
+    m = np.zeros((1, 1), dtype=np.float32)
+    while m.shape[0] < n:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    # Centre thresholds on zero: values in [-0.5, 0.5)
+    return (m + 0.5) / m.size - 0.5
+
+
+class PaletteQuantizer:
+    """Map RGB frames to palette indices with an RGB lookup table.
+
+    The table holds the nearest palette entry for every colour at ``bits`` of
+    precision per channel and is cached to ``cache_dir`` keyed by the palette, so it
+    is only computed once per palette. ``quantize`` returns an ``(H, W)`` uint8 index
+    buffer that the Inky driver accepts unchanged as a ``P`` image.
+
+    Dithering: ``bayer`` adds an 8x8 ordered threshold before the lookup; ``diffusion``
+    is Floyd-Steinberg. Pixel ``(y, x)`` only depends on pixels with a smaller
+    ``2 * y + x``, so each such anti-diagonal is quantized in one vectorised step.
+    """
+
+    def __init__(self, palette: np.ndarray, cache_dir: Optional[str] = None, bits: int = 6, spread: float = 64.0) -> None:
+        self.palette = np.asarray(palette, dtype=np.uint8)
+        self.bits = bits
+        self.spread = spread
+        self.cache_dir = cache_dir
+        self._lut: Optional[np.ndarray] = None
+        self._bayer = bayer_matrix(8) * spread
+
+    @property
+    def lut(self) -> np.ndarray:
+        if self._lut is None:
+            self._lut = self._load_or_build_lut()
+        return self._lut
+
+    def quantize(self, image: Image.Image, dither: str = "diffusion") -> np.ndarray:
+        rgb = np.asarray(image.convert("RGB"), dtype=np.float32)
+        if dither == "bayer":
+            h, w = rgb.shape[:2]
+            threshold = np.tile(self._bayer, (h // 8 + 1, w // 8 + 1))[:h, :w]
+            return self._lookup(rgb + threshold[..., None])
+        if dither == "diffusion":
+            return self._diffuse(rgb)
+        if dither != "none":
+            raise ValueError(f"Unknown dither method {dither!r}; expected one of {DITHER_METHODS}")
+        return self._lookup(rgb)
+
+    def to_image(self, indices: np.ndarray) -> Image.Image:
+        image = Image.fromarray(indices, mode="P")
+        image.putpalette(self.palette.flatten().tolist() + [255, 255, 255])
+        return image
+
+    def _lookup(self, rgb: np.ndarray) -> np.ndarray:
+        shift = 8 - self.bits
+        q = np.clip(rgb, 0, 255).astype(np.uint32) >> shift
+        flat = (q[..., 0] << (2 * self.bits)) | (q[..., 1] << self.bits) | q[..., 2]
+        return self.lut.reshape(-1)[flat]
+
+    def _diffuse(self, rgb: np.ndarray) -> np.ndarray:
+        h, w = rgb.shape[:2]
+        out = np.empty(h * w, dtype=np.uint8)
+        source = rgb.reshape(-1, 3)
+        palette = self.palette.astype(np.float32)
+        # Flat error buffer padded by one column each side and one row below
+        stride = w + 2
+        err = np.zeros(((h + 1) * stride, 3), dtype=np.float32)
+        for t in range(2 * (h - 1) + w):
+            ys = np.arange(max(0, (t - w + 2) // 2), min(h - 1, t // 2) + 1)
+            xs = t - 2 * ys
+            pos = ys * stride + xs + 1
+            pixel = ys * w + xs
+            value = source[pixel] + err[pos]
+            idx = self._lookup(value)
+            out[pixel] = idx
+            e = value - palette[idx]
+            err[pos + 1] += e * (7 / 16)
+            err[pos + stride - 1] += e * (3 / 16)
+            err[pos + stride] += e * (5 / 16)
+            err[pos + stride + 1] += e * (1 / 16)
+        return out.reshape(h, w)
+
+    def _load_or_build_lut(self) -> np.ndarray:
+        digest = hashlib.sha1(self.palette.tobytes() + bytes([self.bits])).hexdigest()[:16]
+        path = os.path.join(self.cache_dir, f"palette-lut-{digest}.npy") if self.cache_dir else None
+        if path and os.path.exists(path):
+            try:
+                return np.load(path)
+            except (OSError, ValueError):
+                logger.warning("Rebuilding unreadable palette LUT %s", path)
+        lut = self._build_lut()
+        if path:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                np.save(path, lut)
+            except OSError:
+                logger.warning("Could not cache palette LUT to %s", path)
+        return lut
+
+    def _build_lut(self) -> np.ndarray:
+        levels = 1 << self.bits
+        # Sample each bucket at its centre
+        axis = (np.arange(levels, dtype=np.float32) + 0.5) * (256 / levels)
+        palette = self.palette.astype(np.float32)
+        gg, bb = np.meshgrid(axis, axis, indexing="ij")
+        lut = np.empty((levels, levels, levels), dtype=np.uint8)
+        # One red plane at a time keeps the temporary distance arrays small on a Pi Zero
+        for i, r in enumerate(axis):
+            plane = np.stack([np.full_like(gg, r), gg, bb], axis=-1)[..., None, :]
+            lut[i] = ((plane - palette) ** 2).sum(axis=-1).argmin(axis=-1)
+        return lut
@@ -1,28 +1,118 @@
-from typing import Tuple
+from typing import TYPE_CHECKING, Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
 
 from PIL import Image, ImageDraw, ImageFont
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+import atexit
+import functools
+import hashlib
+import json
+import logging
 import os
-import base64
+import re
+import threading
+import time
 from io import BytesIO
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager
-from urllib.parse import quote
 
+from .layout import SPARK_WIDTH, LayoutEngine, file_stamp, theme_variables
+from .metrics import metrics
+from .quantize import PaletteQuantizer, impression_palette
+from .sparkline import sparkline_points, svg_points
+from .tiles import TileCompositor
+from ..widgets.base import Rect, Widget
+
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
+    from .browser import BrowserSession
+
+
+logger = logging.getLogger(__name__)
 
 BASE_LANDSCAPE: Tuple[int, int] = (800, 480)  # Inky Impression 7.3 base orientation
+SPARK_VIEWBOX: Tuple[int, int] = (400, 80)  # the market sparkline <svg> in display.html
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "templates")
+
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_CSS_SPACE = re.compile(r"\s+")
+_CSS_PUNCT = re.compile(r"\s*([{};,>])\s*")
+
+
+def minify_css(css: str) -> str:
+    """Drop comments and insignificant whitespace (never around ``:``, which selectors use)."""
+    css = _CSS_SPACE.sub(" ", _CSS_COMMENT.sub("", css))
+    return _CSS_PUNCT.sub(r"\1", css).replace(";}", "}").strip()
+
+
+def template_keys(name: str) -> Optional[FrozenSet[str]]:
+    """Context variables template ``name`` reads, including templates it extends or includes.
+
+    ``None`` when the template cannot be read or parsed, so callers assume it needs everything.
+    """
+    path = os.path.join(TEMPLATES_DIR, name)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _template_keys(name, st.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=16)
+def _template_keys(name: str, stamp: int) -> Optional[FrozenSet[str]]:
+    from jinja2 import Environment, FileSystemLoader, TemplateError, meta
+
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
+    keys: set = set()
+    pending, seen = [name], set()
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        try:
+            ast = env.parse(env.loader.get_source(env, current)[0])
+        except TemplateError:
+            return None
+        keys |= meta.find_undeclared_variables(ast)
+        pending.extend(t for t in meta.find_referenced_templates(ast) if t)
+    return frozenset(keys)
+
+
+def panel_frame(image: Image.Image, orientation: str) -> Image.Image:
+    """Rotate and scale a rendered frame to the panel's native 800x480 landscape."""
+    frame = image
+    if orientation == "portrait":
+        # Rotate to match Inky's hardware expectation (800x480 landscape)
+        frame = frame.rotate(90, expand=True)
+    # Ensure final size matches display base landscape
+    if frame.size != BASE_LANDSCAPE:
+        frame = frame.resize(BASE_LANDSCAPE)
+    return frame
 
 
 class DisplayRenderer:
-    def __init__(self, config) -> None:
+    def __init__(self, config, headless: bool = False) -> None:
         self.config = config
+        # Render-only processes (render worker, farm pool) never touch the panel or its state
+        self.headless = headless
         self._inky = None
-        self._jinja_env = Environment(
-            loader=FileSystemLoader(os.path.join(self._base_dir(), "templates")),
-            autoescape=select_autoescape(["html", "xml"]),
-        )
+        # Selenium and Jinja are only needed in html mode; both load on first use
+        self._browser: Optional["BrowserSession"] = None
+        self._jinja_env: Optional["Environment"] = None
+        self._styles: Tuple[Any, str] = (None, "")
+        self._styles_lock = threading.Lock()
+        # Warm page (display.browser.warm_page): JSON text of each value the live page shows
+        self._page_values: Dict[str, str] = {}
+        self._page_lock = threading.Lock()
+        self._layout = LayoutEngine(config, self._base_dir())
+        self._quantizer: Optional[PaletteQuantizer] = None
+        self._tiles = TileCompositor()
+        # Regions changed by the last render_widgets() call, for panels/clients with partial updates
+        self.dirty_rects: List[Rect] = []
+        self._panel_state_file = os.path.join(config.cache_dir, "panel.json")
+        self._frame_hash: Optional[str] = None
+        self._last_full_refresh = 0.0
+        if headless:
+            return
+        self._load_panel_state()
         try:
             from inky.auto import auto
 
@@ -31,8 +121,39 @@ class DisplayRenderer:
         except Exception:
             self._inky = None
 
+    @property
+    def browser(self) -> "BrowserSession":
+        if self._browser is None:
+            from .browser import BrowserSession
+
+            self._browser = BrowserSession(self.config, self.config.cache_dir)
+        return self._browser
+
+    def close(self) -> None:
+        """Quit the Chrome this renderer started, if any (the render farm evicts idle devices)."""
+        browser, self._browser = self._browser, None
+        if browser is not None:
+            browser.close()
+            atexit.unregister(browser.close)
+
+    @property
+    def jinja_env(self) -> "Environment":
+        if self._jinja_env is None:
+            from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+
+            bytecode_dir = os.path.join(self.config.cache_dir, "jinja")
+            os.makedirs(bytecode_dir, exist_ok=True)
+            # Compiled templates survive restarts; auto_reload still recompiles an edited template
+            self._jinja_env = Environment(
+                loader=FileSystemLoader(os.path.join(self._base_dir(), "templates")),
+                autoescape=select_autoescape(["html", "xml"]),
+                bytecode_cache=FileSystemBytecodeCache(bytecode_dir),
+                auto_reload=True,
+            )
+        return self._jinja_env
+
     def _canvas_size(self) -> Tuple[int, int]:
-        orientation = (self.config.get("display.orientation", "portrait") or "portrait").lower()
+        orientation = self.config.get("display.orientation", "portrait")
         if orientation == "portrait":
             return (BASE_LANDSCAPE[1], BASE_LANDSCAPE[0])
         return BASE_LANDSCAPE
@@ -43,22 +164,84 @@ class DisplayRenderer:
         img = Image.new("RGB", size, color=bg)
         return img
 
+    def render_widgets(self, widgets: Sequence[Widget], context: Optional[dict] = None) -> Image.Image:
+        """Compose ``widgets``, first handing them ``context`` (the data they draw) when given."""
+        if context is not None:
+            for widget in widgets:
+                widget.update(context)
+        bg = self.config.get("theme.background", "#000000")
+        image, self.dirty_rects = self._tiles.compose(widgets, self._canvas_size(), bg)
+        return image
+
     def get_draw(self, image: Image.Image) -> ImageDraw.ImageDraw:
         return ImageDraw.Draw(image)
 
-    def show(self, image: Image.Image) -> None:
-        if self._inky is None:
-            image.save("preview.png")
-            return
-        orientation = (self.config.get("display.orientation", "portrait") or "portrait").lower()
-        if orientation == "portrait":
-            # Rotate to match Inky's hardware expectation (800x480 landscape)
-            image = image.rotate(90, expand=True)
-        # Ensure final size matches display base landscape
-        if image.size != BASE_LANDSCAPE:
-            image = image.resize(BASE_LANDSCAPE)
-        self._inky.set_image(image)
-        self._inky.show()
+    def full_refresh_due(self) -> bool:
+        hours = self.config.get("display.full_refresh_hours", 24)
+        return hours > 0 and time.time() - self._last_full_refresh >= hours * 3600
+
+    def show(self, image: Image.Image) -> bool:
+        """Push ``image`` to the panel unless it matches the frame already on screen.
+
+        Returns ``True`` when the panel (or preview file) was actually updated.
+        """
+        if self.headless:
+            raise RuntimeError("a headless renderer has no panel to show frames on")
+        frame = image
+        if self._inky is not None:
+            frame = panel_frame(image, self.config.get("display.orientation", "portrait"))
+
+        with metrics.timer("quantize"):
+            indices = self.quantizer().quantize(frame, self.config.get("display.dither", "bayer") or "none")
+        frame_hash = hashlib.sha1(indices.tobytes()).hexdigest()
+        forced = self.full_refresh_due()
+        if frame_hash == self._frame_hash and not forced:
+            metrics.inc("panel_updates_skipped_total")
+            logger.info("Skipping panel update: frame unchanged (%s)", frame_hash[:12])
+            return False
+
+        if forced:
+            metrics.inc("panel_full_refreshes_total")
+            logger.info("Full panel refresh (every %sh)", self.config.get("display.full_refresh_hours", 24))
+        with metrics.timer("panel"):
+            if self._inky is None:
+                image.save("preview.png")
+            else:
+                # A P-mode image bypasses the driver's own (slow) quantization
+                self._inky.set_image(self.quantizer().to_image(indices))
+                self._inky.show()
+        metrics.inc("panel_updates_total")
+        logger.info("Panel updated (%s)", frame_hash[:12])
+        self._frame_hash = frame_hash
+        if forced or not self._last_full_refresh:
+            self._last_full_refresh = time.time()
+        self._save_panel_state()
+        return True
+
+    def quantizer(self) -> PaletteQuantizer:
+        saturation = self.config.get("display.saturation", 0.5)
+        palette = impression_palette(saturation)
+        if self._quantizer is None or not (self._quantizer.palette == palette).all():
+            self._quantizer = PaletteQuantizer(palette, cache_dir=self.config.cache_dir)
+        return self._quantizer
+
+    def _load_panel_state(self) -> None:
+        # The panel keeps its image across restarts, so remember what is on it
+        try:
+            with open(self._panel_state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self._frame_hash = state.get("frame_hash")
+            self._last_full_refresh = float(state.get("last_full_refresh", 0.0))
+        except (OSError, ValueError):
+            pass
+
+    def _save_panel_state(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self._panel_state_file), exist_ok=True)
+            with open(self._panel_state_file, "w", encoding="utf-8") as f:
+                json.dump({"frame_hash": self._frame_hash, "last_full_refresh": self._last_full_refresh}, f)
+        except OSError:
+            logger.warning("Could not persist panel state to %s", self._panel_state_file)
 
     def load_font(self, size: int) -> ImageFont.FreeTypeFont:
         font_name = self.config.get("theme.font", "DejaVuSans.ttf")
@@ -70,48 +253,92 @@ class DisplayRenderer:
     def _base_dir(self) -> str:
         return os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 
-    def render_html(self, context: dict) -> Image.Image:
+    def render_native(self, context: dict) -> Image.Image:
+        return self._layout.render(context, self._canvas_size())
+
+    def build_html(self, context: dict) -> str:
+        """The complete page ``render_html`` screenshots: styles, theme variables and template."""
         tpl_name = self.config.get("display.template", "display.html")
-        template = self._jinja_env.get_template(tpl_name)
-        # Build CSS variable overrides from theme
-        theme = self.config.get("theme", {}) or {}
-        css_vars = ":root{--bg:%s;--fg:%s;--muted:%s;--accent:%s;--accent2:%s;}" % (
-            theme.get("background", "#0b1220"),
-            theme.get("primary", "#F2F5F9"),
-            theme.get("muted", "#7D8CA3"),
-            theme.get("accent", "#3EC1D3"),
-            theme.get("accent2", "#FF6B6B"),
-        )
-        html = template.render(**context)
+        template = self.jinja_env.get_template(tpl_name)
+        html = template.render(**self.page_values(context))
+        return self.style_block() + html
 
-        width, height = self._canvas_size()
+    def page_values(self, context: dict) -> dict:
+        """Template variables of a frame: the context plus the sparkline's SVG points."""
+        history = (context.get("market") or {}).get("history") or []
+        # The viewBox is scaled down to the column, so more points than its pixels would overlap
+        spark = svg_points(sparkline_points(history, *SPARK_VIEWBOX, max_points=SPARK_WIDTH))
+        return {**context, "spark_points": spark}
+
+    def shell_key(self) -> Any:
+        """Everything a warm page depends on besides the context: template, styles and size."""
+        tpl_name = self.config.get("display.template", "display.html")
+        template = self.jinja_env.get_template(tpl_name)
+        try:
+            st = os.stat(template.filename or "")
+            stamp: Any = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        styles = hashlib.sha1(self.style_block().encode("utf-8")).hexdigest()
+        return (tpl_name, stamp, styles, self._canvas_size())
+
+    def style_block(self) -> str:
+        """Minified ``styles.css`` plus the theme's CSS variables, rebuilt only when either changes."""
         css_path = os.path.join(self._base_dir(), "templates", "styles.css")
-        with open(css_path, "r", encoding="utf-8") as f:
-            css = f.read()
-        full_html = f"<style>{css}</style><style>{css_vars}</style>" + html
+        stamp = file_stamp(css_path)
+        theme = theme_variables(self.config.get("theme", {}) or {})
+        key = (stamp, tuple(theme.items()))
+        with self._styles_lock:
+            if self._styles[0] == key:
+                return self._styles[1]
+            css = ""
+            if stamp is not None:
+                with open(css_path, "r", encoding="utf-8") as f:
+                    css = minify_css(f.read())
+            css_vars = ":root{%s}" % "".join(f"--{name}:{value};" for name, value in theme.items())
+            block = f"<style>{css}</style><style>{css_vars}</style>"
+            self._styles = (key, block)
+            return block
 
+    def render_html(self, context: dict) -> Image.Image:
+        width, height = self._canvas_size()
         try:
-            options = Options()
-            options.add_argument("--headless=new")
-            options.add_argument("--disable-gpu")
-            options.add_argument("--hide-scrollbars")
-            options.add_argument(f"--window-size={width},{height}")
-            service = ChromeService(ChromeDriverManager().install())
-            driver = webdriver.Chrome(service=service, options=options)
-            try:
-                data_url = "data:text/html;charset=utf-8," + quote(full_html)
-                driver.get(data_url)
-                png_bytes = driver.get_screenshot_as_png()
-            finally:
-                driver.quit()
-
-            img = Image.open(BytesIO(png_bytes)).convert("RGB")
+            if self.config.get("display.browser.warm_page", True):
+                png_bytes = self._patch_page(context)
+            else:
+                with metrics.timer("html_build"):
+                    full_html = self.build_html(context)
+                with metrics.timer("screenshot"):
+                    png_bytes = self.browser.screenshot(full_html, (width, height))
+            with metrics.timer("png_decode"):
+                img = Image.open(BytesIO(png_bytes)).convert("RGB")
             return img
         except Exception as exc:  # Fallback: return an error PNG so preview isn't blank
+            metrics.inc("render_failures_total", mode="html")
+            metrics.annotate(render_error=f"{type(exc).__name__}: {str(exc)[:200]}")
+            logger.warning("HTML render failed; showing the error frame", exc_info=True)
             img = Image.new("RGB", (width, height), color="#1b1f2a")
             draw = ImageDraw.Draw(img)
             msg = f"HTML render failed: {type(exc).__name__}\n{str(exc)[:300]}\nInstall Chrome or switch display.mode to 'pil'"
             draw.text((16, 16), msg, fill="#FF6B6B")
             return img
 
-
+    def _patch_page(self, context: dict) -> bytes:
+        """Screenshot of the warm page, sending it only the values that changed since the last frame."""
+        values = self.page_values(context)
+        market = values.get("market")
+        if isinstance(market, dict):
+            # The page draws the sparkline from spark_points; the raw history stays here
+            values["market"] = {k: v for k, v in market.items() if k != "history"}
+        encoded = {key: json.dumps(value, sort_keys=True, default=str) for key, value in values.items()}
+        with self._page_lock:
+            with metrics.timer("html_build"):
+                key = self.shell_key()
+            changed = {k: text for k, text in encoded.items() if self._page_values.get(k) != text}
+            # Until the page confirms it shows these values, the next frame sends everything
+            self._page_values = {}
+            with metrics.timer("screenshot"):
+                png = self.browser.patch_screenshot(key, lambda: self.build_html(context), changed, self._canvas_size())
+            metrics.inc("page_values_sent_total", len(changed))
+            self._page_values = encoded
+        return png
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional, Set, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+MAX_SLEEP = 60.0  # re-check the wall clock at least this often (NTP steps, suspend)
+
+
+def next_boundary(now: datetime, period: float) -> datetime:
+    """First multiple of ``period`` seconds after local midnight that is later than ``now``."""
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = (now - midnight).total_seconds()
+    return midnight + timedelta(seconds=(math.floor(elapsed / period) + 1) * period)
+
+
+def parse_quiet_hours(value: str) -> Optional[Tuple[int, int]]:
+    """``"23:00-07:00"`` as (start, end) minutes after midnight, or ``None``."""
+    if not value:
+        return None
+    start, end = (int(h) * 60 + int(m) for h, m in (part.split(":") for part in value.split("-")))
+    return (start, end) if start != end else None
+
+
+def quiet_until(moment: datetime, quiet: Optional[Tuple[int, int]]) -> Optional[datetime]:
+    """End of the quiet period containing ``moment``, or ``None`` when it is not quiet."""
+    if quiet is None:
+        return None
+    start, end = quiet
+    minute = moment.hour * 60 + moment.minute
+    inside = start <= minute < end if start < end else (minute >= start or minute < end)
+    if not inside:
+        return None
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    until = midnight + timedelta(minutes=end)
+    return until if until > moment else until + timedelta(days=1)
+
+
+class RefreshScheduler:
+    """Drive fetches and panel frames from one asyncio loop.
+
+    Every data source the display draws is refreshed on its own cadence
+    (``app.source_interval``); sources nothing draws are not fetched at all.
+    A frame is only rendered when a source returned new data, a setting changed, or
+    the ``refresh.interval_seconds`` heartbeat is due (which lets the renderer decide
+    on a periodic full refresh). Frames land on wall-clock boundaries of
+    ``refresh.align_seconds``: rendering starts early by the measured render time and
+    the frame shows the boundary time, so the clock is right once the panel settles.
+    No frames are pushed during ``refresh.quiet_hours``; changes are shown at its end.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+        self.config = app.config
+        self.render_seconds = 0.0  # moving average of render + panel update time
+        self._dirty = False
+        self._force = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._settings_event: Optional[asyncio.Event] = None  # replaced (and set) on every settings change
+        self._renderer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+        self._heartbeat: Optional[datetime] = None
+        self._frame_at: Optional[datetime] = None
+
+    def run_forever(self) -> None:
+        asyncio.run(self.run())
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._settings_event = asyncio.Event()
+        self.config.subscribe("", self._settings_changed)
+        tasks = [asyncio.create_task(self._source_loop(name)) for name in self.app.sources()]
+        tasks.append(asyncio.create_task(self._frame_loop()))
+        await asyncio.gather(*tasks)
+
+    def request_frame(self, force: bool = False) -> None:
+        """Ask for a frame at the next boundary; safe to call from any thread."""
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._mark_dirty, force)
+
+    def _mark_dirty(self, force: bool) -> None:
+        self._dirty = True
+        self._force = self._force or force
+        self._wake.set()
+
+    def _settings_changed(self, changed: Set[str]) -> None:
+        # Sources that were not needed re-check whether a widget or template now draws them
+        self._loop.call_soon_threadsafe(self._signal_settings)
+        if any(p.startswith("refresh.") for p in changed):
+            # Re-plan the heartbeat with the new cadence
+            self._loop.call_soon_threadsafe(setattr, self, "_heartbeat", None)
+        # Cadence settings only move timers; anything else can change the picture
+        self.request_frame(force=any(not p.startswith("refresh.") for p in changed))
+
+    def _signal_settings(self) -> None:
+        event, self._settings_event = self._settings_event, asyncio.Event()
+        event.set()
+
+    async def _sleep(self, seconds: float) -> None:
+        await asyncio.sleep(min(max(seconds, 0.0), MAX_SLEEP))
+
+    async def _source_loop(self, name: str) -> None:
+        loop = asyncio.get_running_loop()
+        fetched: Optional[float] = None
+        while True:
+            interval = self.app.source_interval(name)
+            if interval is None:
+                # Nothing draws this source; fetch it as soon as something does
+                try:
+                    await asyncio.wait_for(self._settings_event.wait(), timeout=MAX_SLEEP)
+                except asyncio.TimeoutError:
+                    pass
+                fetched = None
+                continue
+            # Re-read every pass, so a changed cadence applies to the running wait
+            remaining = fetched + interval - time.monotonic() if fetched is not None else 0
+            if remaining > 0:
+                await self._sleep(remaining)
+                continue
+            try:
+                changed = await loop.run_in_executor(self.app.fetch_executor, self.app.refresh_source, name)
+            except Exception:
+                logger.warning("Refreshing %s failed", name, exc_info=True)
+            else:
+                if changed:
+                    logger.info("New %s data", name)
+                    self._mark_dirty(False)
+            fetched = time.monotonic()
+
+    async def _frame_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        # The first frame goes out as soon as sources have had a chance to report
+        self._mark_dirty(False)
+        while True:
+            target = self._next_frame()
+            start_in = (target - datetime.now().astimezone()).total_seconds() - self.render_seconds
+            if start_in > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=min(start_in, MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heartbeat = self._frame_at is None or target >= self._heartbeat
+            force, self._force = self._force, False
+            self._dirty = False
+            # Boundaries are fixed once chosen; the next ones are picked after this frame
+            self._heartbeat = self._frame_at = None
+            started = time.monotonic()
+            try:
+                await loop.run_in_executor(self._renderer, self.app.render_once, target, force)
+            except Exception:
+                logger.exception("Frame for %s failed", target.strftime("%H:%M:%S"))
+            elapsed = time.monotonic() - started
+            self.render_seconds = elapsed if self.render_seconds == 0 else 0.7 * self.render_seconds + 0.3 * elapsed
+            logger.info(
+                "Frame for %s (%s) took %.1fs",
+                target.strftime("%H:%M:%S"),
+                "heartbeat" if heartbeat else "new data",
+                elapsed,
+            )
+            # Never start the next frame before this boundary has passed
+            await self._sleep((target - datetime.now().astimezone()).total_seconds())
+
+    def _next_frame(self) -> datetime:
+        now = datetime.now().astimezone()
+        lead = timedelta(seconds=self.render_seconds)
+        if self._heartbeat is None:
+            self._heartbeat = next_boundary(now + lead, self.config.get("refresh.interval_seconds"))
+        if self._dirty and self._frame_at is None:
+            self._frame_at = next_boundary(now + lead, self.config.get("refresh.align_seconds"))
+        target = min(self._heartbeat, self._frame_at or self._heartbeat)
+        resume = quiet_until(target, parse_quiet_hours(self.config.get("refresh.quiet_hours", "")))
+        if resume is not None:
+            target = resume
+        return target
+
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices of the points Largest-Triangle-Three-Buckets keeps out of ``len(x)``.
+
+    The first and last points are always kept; every bucket in between keeps the point
+    forming the largest triangle with the previously kept point and the average of the
+    next bucket, which preserves peaks and dips that plain striding would drop.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # Bucket i (for i in 0..threshold-3) covers [edges[i], edges[i + 1]) of the interior points
+    edges = (np.floor(np.arange(threshold - 1) * ((n - 2) / (threshold - 2))) + 1).astype(np.intp)
+    edges[-1] = n - 1
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:-1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:-1], edges[:-1]) / counts
+    # The bucket after the last one is the final point itself
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    keep = np.empty(threshold, dtype=np.intp)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - next_x[i]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (next_y[i] - ay))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def sparkline_points(history: Sequence, width: float, height: float, max_points: int | None = None) -> np.ndarray:
+    """``(k, 2)`` polyline for ``history`` (``(label, value)`` pairs) scaled to ``width`` x ``height``.
+
+    Long histories are reduced with LTTB to at most ``max_points`` (default: one point
+    per unit of ``width``), so drawing cost stays flat however much history there is.
+    """
+    if len(history) < 2:
+        return np.empty((0, 2))
+    y = np.fromiter((float(v[1]) for v in history), dtype=np.float64, count=len(history))
+    x = np.arange(len(y), dtype=np.float64)
+    keep = lttb(x, y, int(max_points or max(3, width)))
+    x, y = x[keep], y[keep]
+    lo, hi = y.min(), y.max()
+    points = np.empty((len(keep), 2))
+    points[:, 0] = x / x[-1] * width
+    points[:, 1] = height - (y - lo) / (hi - lo + 0.0001) * height
+    return points
+
+
+def svg_points(points: np.ndarray) -> str:
+    """Polyline ``points`` attribute, rounded to a tenth of a unit."""
+    return " ".join(f"{px:.1f},{py:.1f}" for px, py in points.tolist())
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageDraw
+
+from ..widgets.base import Rect, Widget
+
+
+logger = logging.getLogger(__name__)
+
+
+class TileCompositor:
+    """Compose widget tiles onto a persistent canvas, redrawing only what changed.
+
+    Each widget draws into its own tile the size of its region. A tile is reused while
+    the widget's ``cache_key()`` and the region are unchanged; widgets without a
+    ``cache_key`` are redrawn every time. ``compose`` returns the canvas and the
+    rectangles that differ from the previous call.
+    """
+
+    def __init__(self) -> None:
+        self._canvas: Optional[Image.Image] = None
+        self._background: Any = None
+        self._tiles: Dict[Rect, Tuple[Any, Image.Image]] = {}
+        self._lock = threading.Lock()
+
+    def compose(self, widgets: Sequence[Widget], size: Tuple[int, int], background: Any) -> Tuple[Image.Image, List[Rect]]:
+        with self._lock:
+            return self._compose(widgets, size, background)
+
+    def _compose(self, widgets: Sequence[Widget], size: Tuple[int, int], background: Any) -> Tuple[Image.Image, List[Rect]]:
+        regions = self.layout(len(widgets), size)
+
+        full = self._canvas is None or self._canvas.size != size or self._background != background
+        if full:
+            self._canvas = Image.new("RGB", size, color=background)
+            self._background = background
+            self._tiles = {}
+        dirty: List[Rect] = []
+        # Drop tiles whose slots no longer exist (widget count changed)
+        for stale in [r for r in self._tiles if r not in regions]:
+            del self._tiles[stale]
+            self._canvas.paste(background, stale)
+            dirty.append(stale)
+
+        for widget, region in zip(widgets, regions):
+            key = self._key(widget, region)
+            cached = self._tiles.get(region)
+            if key is not None and cached is not None and cached[0] == key:
+                continue
+            x0, y0, x1, y1 = region
+            tile = Image.new("RGB", (x1 - x0, y1 - y0), color=background)
+            widget.draw(ImageDraw.Draw(tile), (0, 0, x1 - x0, y1 - y0))
+            if cached is None or cached[1].tobytes() != tile.tobytes():
+                self._canvas.paste(tile, (x0, y0))
+                dirty.append(region)
+            self._tiles[region] = (key, tile)
+
+        if full:
+            dirty = [(0, 0, size[0], size[1])]
+        logger.debug("Composited %d widget tiles, %d dirty", len(regions), len(dirty))
+        return self._canvas.copy(), dirty
+
+    @staticmethod
+    def layout(count: int, size: Tuple[int, int]) -> List[Rect]:
+        width, height = size
+        slot_h = height // max(1, count)
+        return [(0, i * slot_h, width, (i + 1) * slot_h) for i in range(count)]
+
+    def _key(self, widget: Widget, region: Rect) -> Any:
+        cache_key = getattr(widget, "cache_key", None)
+        if cache_key is None:
+            return None
+        return (type(widget).__name__, region[2] - region[0], region[3] - region[1], cache_key())
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import atexit
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from .config import ConfigManager, ProfileConfig
+from .metrics import Labels, Span, metrics
+from .procs import process_tree, process_tree_rss_kb
+from .renderer import BASE_LANDSCAPE, DisplayRenderer
+from ..widgets.base import Rect, Widget
+
+
+logger = logging.getLogger(__name__)
+
+# Largest frame the worker hands back: an RGB canvas in either orientation
+FRAME_BYTES = BASE_LANDSCAPE[0] * BASE_LANDSCAPE[1] * 3
+
+STOP_GRACE = 10  # seconds a recycled worker gets to close Chrome before it is killed
+
+
+class RenderWorkerError(RuntimeError):
+    """The render worker timed out, died, or failed to render the job."""
+
+
+@dataclass
+class JobResult:
+    job: int
+    size: Optional[Tuple[int, int]] = None  # of the RGB frame now in the shared buffer
+    dirty_rects: List[Rect] = field(default_factory=list)
+    spans: List[Span] = field(default_factory=list)
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    counters: List[Tuple[str, Labels, float]] = field(default_factory=list)  # increments since the last job
+    error: Optional[str] = None
+
+
+def render_frame(config: ConfigManager, renderer: DisplayRenderer, widgets: Sequence[Widget], context: Optional[dict]) -> Image.Image:
+    """One frame in the configured ``display.mode``."""
+    mode = config.get("display.mode")
+    if mode == "html":
+        return renderer.render_html(context or {})
+    if mode == "native":
+        return renderer.render_native(context or {})
+    return renderer.render_widgets(widgets, context)
+
+
+def serve(base_dir: str, shm_name: str, jobs: Any, results: Any) -> None:
+    """Render worker main loop: ``(job, settings or None, context)`` in, ``JobResult`` out.
+
+    ``settings`` is only sent when it changed since the previous job. The renderer
+    (templates, styles, palette LUT, Chrome with its warm page) lives as long as the
+    process; the frame itself is written to the shared buffer ``shm_name``.
+    """
+    from .app import load_widgets
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # Stopped with SIGTERM by the parent: exit normally so atexit hooks close Chrome.
+    # Ctrl-C reaches the whole process group; the parent decides when this process ends.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    config: Optional[ProfileConfig] = None
+    renderer: Optional[DisplayRenderer] = None
+    widgets: List[Widget] = []
+    reported = metrics.counters()
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            job_id, settings, context = job
+            result = JobResult(job_id)
+            try:
+                if settings is not None:
+                    if config is None:
+                        config = ProfileConfig(base_dir, "render-worker", settings)
+                        renderer = DisplayRenderer(config, headless=True)
+                    else:
+                        config.replace(settings)
+                    widgets = load_widgets(config)
+                assert config is not None and renderer is not None, "first job carries no settings"
+                with metrics.trace("worker") as trace:
+                    image = render_frame(config, renderer, widgets, context).convert("RGB")
+                    data = image.tobytes()
+                    if len(data) > shm.size:
+                        raise ValueError(f"{image.size[0]}x{image.size[1]} frame does not fit the shared buffer")
+                    shm.buf[: len(data)] = data
+                result.size = image.size
+                result.dirty_rects = list(renderer.dirty_rects)
+                result.spans, result.attributes = trace.spans, trace.attributes
+            except Exception as exc:
+                logger.exception("Render job %d failed", job_id)
+                result.error = f"{type(exc).__name__}: {exc}"
+            counters = metrics.counters()
+            result.counters = [
+                (name, labels, value - reported.get((name, labels), 0))
+                for (name, labels), value in counters.items()
+                if value != reported.get((name, labels), 0)
+            ]
+            reported = counters
+            results.put(result)
+    finally:
+        shm.close()
+
+
+class RenderWorker:
+    """Renders frames in a separate process, so a hung or leaking Chrome or PIL cannot take the app with it.
+
+    Jobs go to the worker over a local queue together with the settings (only when
+    they changed); the worker keeps the renderer, fonts, templates and browser warm and
+    writes each frame as raw RGB into a shared-memory buffer, so no PNG is encoded or
+    decoded on the way back. The caller waits at most ``display.worker.timeout_seconds``:
+    a worker that takes longer or dies is killed together with its Chrome processes and
+    started again for the next job. A worker whose process tree (Chrome included) grows
+    beyond ``display.worker.max_rss_mb`` is recycled after the job.
+    """
+
+    def __init__(self, config: ConfigManager) -> None:
+        self.config = config
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context("spawn")
+        self._process: Optional[Any] = None
+        self._jobs: Any = None
+        self._results: Any = None
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._sent_settings: Optional[dict] = None
+        self._job_ids = itertools.count(1)
+        atexit.register(self.close)
+
+    def render(self, context: Optional[dict]) -> Tuple[Image.Image, List[Rect]]:
+        """The frame for ``context`` and the regions it changed (widget mode)."""
+        with self._lock:
+            self._ensure()
+            settings = self.config.settings
+            job = next(self._job_ids)
+            # ConfigManager replaces its settings dict on every change, so identity means unchanged
+            self._jobs.put((job, settings if settings is not self._sent_settings else None, context))
+            self._sent_settings = settings
+            started = time.perf_counter()
+            result = self._wait(job)
+            metrics.replay(result.spans, started)
+            metrics.annotate(**result.attributes)
+            for name, labels, amount in result.counters:
+                metrics.inc(name, amount, **dict(labels))
+            image = None
+            if result.size is not None:
+                width, height = result.size
+                assert self._shm is not None
+                image = Image.frombytes("RGB", result.size, bytes(self._shm.buf[: width * height * 3]))
+            self._check_memory()
+        if image is None:
+            raise RenderWorkerError(result.error or "render worker returned no frame")
+        return image, result.dirty_rects
+
+    def close(self) -> None:
+        with self._lock:
+            self._stop(graceful=True)
+            shm, self._shm = self._shm, None
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    def _ensure(self) -> None:
+        if self._process is not None and self._process.is_alive():
+            return
+        if self._process is not None:
+            self._stop(graceful=False)
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=FRAME_BYTES)
+        self._jobs = self._context.Queue()
+        self._results = self._context.Queue()
+        self._process = self._context.Process(
+            target=serve,
+            args=(self.config.base_dir, self._shm.name, self._jobs, self._results),
+            name="render-worker",
+            daemon=True,
+        )
+        self._process.start()
+        self._sent_settings = None
+        metrics.inc("render_worker_starts_total")
+        logger.info("Started render worker (pid %d)", self._process.pid)
+
+    def _wait(self, job: int) -> JobResult:
+        timeout = self.config.get("display.worker.timeout_seconds", 90)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                result = self._results.get(timeout=max(0.05, min(1.0, deadline - time.monotonic())))
+            except queue.Empty:
+                if not self._process.is_alive():
+                    code = self._process.exitcode
+                    logger.error("Render worker exited with code %s; restarting it for the next frame", code)
+                    metrics.inc("render_worker_restarts_total", reason="crashed")
+                    self._stop(graceful=False)
+                    raise RenderWorkerError(f"render worker exited with code {code}")
+                if time.monotonic() >= deadline:
+                    logger.error("Render worker did not answer within %gs; killing it", timeout)
+                    metrics.inc("render_worker_restarts_total", reason="timeout")
+                    self._stop(graceful=False)
+                    raise RenderWorkerError(f"render took longer than {timeout:g}s")
+                continue
+            if result.job == job:
+                return result
+
+    def _check_memory(self) -> None:
+        max_rss_mb = self.config.get("display.worker.max_rss_mb", 500)
+        if not max_rss_mb or self._process is None:
+            return
+        rss_kb = process_tree_rss_kb(self._process.pid)
+        metrics.set("render_worker_rss_bytes", rss_kb * 1024)
+        if rss_kb > max_rss_mb * 1024:
+            logger.info("Recycling render worker at %d MB RSS", rss_kb // 1024)
+            metrics.inc("render_worker_restarts_total", reason="memory")
+            self._stop(graceful=True)
+
+    def _stop(self, graceful: bool) -> None:
+        process, self._process = self._process, None
+        jobs, results = self._jobs, self._results
+        self._jobs = self._results = None
+        self._sent_settings = None
+        if process is None:
+            return
+        if graceful and process.is_alive():
+            jobs.put(None)
+            process.join(STOP_GRACE)
+        if process.is_alive():
+            # A hung worker cannot close Chrome itself; its chromedriver and Chrome go with it
+            tree = process_tree(process.pid)
+            for pid in reversed(tree):
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            process.join(5)
+        for q in (jobs, results):
+            q.cancel_join_thread()
+            q.close()
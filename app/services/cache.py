@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+from ..core.metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    stored_at: float
+    value: Any
+
+    def age(self) -> float:
+        return time.time() - self.stored_at
+
+
+class SWRCache:
+    """Stale-while-revalidate cache persisted as one pickle per key.
+
+    ``get`` returns whatever is cached, however old, and refreshes stale entries on a
+    background thread; only a key that has never been stored is loaded synchronously.
+    Entries older than ``max_age`` are dropped, and the oldest entries are evicted once
+    the store exceeds ``max_entries`` files or ``max_bytes`` on disk.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_entries: int = 64,
+        max_bytes: int = 32 * 1024 * 1024,
+        max_age: float = 7 * 24 * 3600,
+    ) -> None:
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._memory: Dict[str, CacheEntry] = {}
+        self._refreshing: Set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="swr")
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str, ttl: float, loader: Callable[[], Any]) -> Any:
+        source = key.split(":", 1)[0]
+        entry = self.peek(key)
+        if entry is None:
+            metrics.inc("cache_requests_total", source=source, result="miss")
+            return self.put(key, loader())
+        if entry.age() >= ttl:
+            metrics.inc("cache_requests_total", source=source, result="stale")
+            self._refresh(key, loader)
+        else:
+            metrics.inc("cache_requests_total", source=source, result="hit")
+        return entry.value
+
+    def get_many(self, keys: Sequence[str], ttl: float, loader: Callable[[List[str]], Dict[str, Any]]) -> Dict[str, Any]:
+        """``get`` for several keys whose values one ``loader(keys)`` call can produce together.
+
+        Missing keys are loaded synchronously, along with any stale ones so they share the
+        round trip; when only stale keys remain they are refreshed in one background call.
+        Keys the loader does not return are left out of the result.
+        """
+        values: Dict[str, Any] = {}
+        missing: List[str] = []
+        stale: List[str] = []
+        for key in keys:
+            entry = self.peek(key)
+            source = key.split(":", 1)[0]
+            if entry is None:
+                metrics.inc("cache_requests_total", source=source, result="miss")
+                missing.append(key)
+                continue
+            if entry.age() >= ttl:
+                metrics.inc("cache_requests_total", source=source, result="stale")
+                stale.append(key)
+            else:
+                metrics.inc("cache_requests_total", source=source, result="hit")
+            values[key] = entry.value
+        if missing:
+            for key, value in loader(missing + stale).items():
+                values[key] = self.put(key, value)
+        elif stale:
+            self._refresh_many(stale, loader)
+        return values
+
+    def peek(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is None:
+            entry = self._read(key)
+            if entry is not None:
+                with self._lock:
+                    self._memory.setdefault(key, entry)
+        if entry is not None and entry.age() > self.max_age:
+            return None
+        return entry
+
+    def put(self, key: str, value: Any) -> Any:
+        entry = CacheEntry(key=key, stored_at=time.time(), value=value)
+        with self._lock:
+            self._memory[key] = entry
+        self._write(entry)
+        self._evict()
+        return value
+
+    def _refresh(self, key: str, loader: Callable[[], Any]) -> None:
+        self._refresh_many([key], lambda keys: {key: loader()})
+
+    def _refresh_many(self, keys: Sequence[str], loader: Callable[[List[str]], Dict[str, Any]]) -> None:
+        with self._lock:
+            keys = [key for key in keys if key not in self._refreshing]
+            if not keys:
+                return
+            self._refreshing.update(keys)
+
+        def run() -> None:
+            try:
+                for key, value in loader(keys).items():
+                    self.put(key, value)
+            except Exception:
+                metrics.inc("cache_refresh_failures_total", source=keys[0].split(":", 1)[0])
+                logger.warning("Background refresh of %s failed; serving stale value", ", ".join(keys), exc_info=True)
+            finally:
+                with self._lock:
+                    self._refreshing.difference_update(keys)
+
+        self._executor.submit(run)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pkl")
+
+    def _read(self, key: str) -> Optional[CacheEntry]:
+        try:
+            with open(self._path(key), "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Discarding unreadable cache entry for %s", key, exc_info=True)
+            return None
+        return entry if isinstance(entry, CacheEntry) and entry.key == key else None
+
+    def _write(self, entry: CacheEntry) -> None:
+        path = self._path(entry.key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception:
+            logger.warning("Could not persist cache entry for %s", entry.key, exc_info=True)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _evict(self) -> None:
+        files = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if now - st.st_mtime > self.max_age:
+                self._remove(path)
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        while files and (len(files) > self.max_entries or total > self.max_bytes):
+            _, size, path = files.pop(0)
+            total -= size
+            self._remove(path)
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            for key in [k for k in self._memory if self._path(k) == path]:
+                del self._memory[key]
@@ -1,13 +1,23 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import hashlib
+import heapq
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from datetime import datetime, timedelta, timezone
-from typing import List
+from typing import Iterable, List, Optional, Sequence
 
-import requests
-from icalendar import Calendar
 from dateutil import tz
 
+from ..core.metrics import in_context, metrics
+from .cache import SWRCache
+from .http import HttpClient, Validators, shared_client, validators_of
+from .ics import CalendarIndex
+
+
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class CalendarEvent:
@@ -15,51 +25,127 @@ class CalendarEvent:
     end: datetime
     title: str
     location: str | None = None
+    uid: str | None = None
+    label: str | None = None
+    color: str | None = None
+
+
+@dataclass(frozen=True)
+class CalendarSource:
+    url: str
+    label: str = ""
+    color: str = ""
 
 
 class CalendarService:
-    def __init__(self, ics_url: str | None, lookahead_days: int = 3, timezone_name: str | None = None) -> None:
+    def __init__(
+        self,
+        ics_url: str | None,
+        lookahead_days: int = 3,
+        timezone_name: str | None = None,
+        cache: Optional[SWRCache] = None,
+        ttl: float = 300,
+        http: Optional[HttpClient] = None,
+    ) -> None:
         self.ics_url = ics_url
         self.lookahead_days = lookahead_days
+        self.timezone_name = timezone_name
         self.tzinfo = tz.gettz(timezone_name) if timezone_name else tz.tzlocal()
+        self.cache = cache
+        self.ttl = ttl
+        self.http = http or shared_client()
+        self._index: Optional[CalendarIndex] = None
+        self._digest: Optional[str] = None
+        # Of the response self._index was parsed from
+        self._validators: Optional[Validators] = None
 
-    def fetch_events(self) -> List[CalendarEvent]:
+    def fetch_events(self, limit: Optional[int] = None) -> List[CalendarEvent]:
         if not self.ics_url:
             return []
         try:
-            resp = requests.get(self.ics_url, timeout=10)
-            resp.raise_for_status()
-            cal = Calendar.from_ical(resp.text)
-        except Exception:
+            if self.cache is None:
+                index = self._load_index()
+            else:
+                # The parsed index has the zone baked in
+                key = f"calendar:{self.timezone_name or 'local'}:{self.ics_url}"
+                index = self.cache.get(key, self.ttl, self._load_index)
+        except Exception as exc:
+            metrics.inc("upstream_failures_total", service="calendar")
+            logger.warning("Calendar fetch failed: %s", exc)
             return []
-
         now = datetime.now(timezone.utc).astimezone(self.tzinfo)
-        end_window = now + timedelta(days=self.lookahead_days)
-        results: List[CalendarEvent] = []
-        for component in cal.walk():
-            if component.name != "VEVENT":
-                continue
-            dtstart = component.get("dtstart")
-            dtend = component.get("dtend")
-            if not dtstart:
-                continue
-            start = self._to_dt(dtstart.dt)
-            end = self._to_dt(dtend.dt) if dtend else (start + timedelta(hours=1))
-            if start > end_window or end < now:
-                continue
-            title = str(component.get("summary", ""))
-            location = str(component.get("location", "")) or None
-            results.append(CalendarEvent(start=start, end=end, title=title, location=location))
-
-        results.sort(key=lambda e: e.start)
-        return results
-
-    def _to_dt(self, value) -> datetime:
-        if isinstance(value, datetime):
-            if value.tzinfo is None:
-                return value.replace(tzinfo=self.tzinfo)
-            return value.astimezone(self.tzinfo)
-        # Date-only all-day event; assume local midnight
-        return datetime(value.year, value.month, value.day, tzinfo=self.tzinfo)
+        events = index.window(now, now + timedelta(days=self.lookahead_days))
+        return [
+            CalendarEvent(start=e.start, end=e.end, title=e.title, location=e.location, uid=e.uid)
+            for e in events[:limit]
+        ]
+
+    def _load_index(self) -> CalendarIndex:
+        resp = self.http.get(self.ics_url, validators=self._validators if self._index is not None else None)
+        if resp.status_code == 304 and self._index is not None:
+            return self._index
+        # Servers without validators still often send identical bytes; skip the parse then too
+        digest = hashlib.sha1(resp.content).hexdigest()
+        if digest == self._digest and self._index is not None:
+            self._validators = validators_of(resp)
+            return self._index
+        index = CalendarIndex.parse(resp.content, self.tzinfo)
+        self._index, self._digest, self._validators = index, digest, validators_of(resp)
+        return index
+
+
+def merge_events(streams: Sequence[Iterable[CalendarEvent]], limit: Optional[int] = None) -> List[CalendarEvent]:
+    """K-way merge of start-sorted event streams, dropping cross-feed duplicates.
+
+    An event is a duplicate when its occurrence (UID and start time), or its start time
+    and title, was already taken from an earlier stream; every occurrence of a recurring
+    series shares one UID, so the UID alone is not enough. Stops as soon as ``limit`` events are collected.
+    """
+    out: List[CalendarEvent] = []
+    seen_occurrences: set = set()
+    seen_slots: set = set()
+    for event in heapq.merge(*streams, key=lambda e: e.start):
+        slot = (event.start, event.title.strip().casefold())
+        if (event.uid and (event.uid, event.start) in seen_occurrences) or slot in seen_slots:
+            continue
+        if event.uid:
+            seen_occurrences.add((event.uid, event.start))
+        seen_slots.add(slot)
+        out.append(event)
+        if limit is not None and len(out) >= limit:
+            break
+    return out
+
+
+class MultiCalendarService:
+    """Several ICS feeds fetched in parallel and merged into one agenda."""
+
+    def __init__(
+        self,
+        sources: Sequence[CalendarSource],
+        lookahead_days: int = 3,
+        timezone_name: str | None = None,
+        cache: Optional[SWRCache] = None,
+        ttl: float = 300,
+        http: Optional[HttpClient] = None,
+    ) -> None:
+        self.sources = list(sources)
+        self.services = [
+            CalendarService(s.url, lookahead_days=lookahead_days, timezone_name=timezone_name, cache=cache, ttl=ttl, http=http)
+            for s in self.sources
+        ]
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(4, len(self.sources))), thread_name_prefix="ics")
 
+    def fetch_events(self, limit: Optional[int] = None) -> List[CalendarEvent]:
+        # No single feed can contribute more than ``limit`` events to the merged result
+        futures = [self._executor.submit(in_context(svc.fetch_events), limit) for svc in self.services]
+        streams = []
+        for source, future in zip(self.sources, futures):
+            streams.append(
+                [replace(e, label=source.label or None, color=source.color or None) for e in future.result()]
+            )
+        return merge_events(streams, limit)
 
+    def close(self) -> None:
+        """Stop the feed threads; called when settings changes replace this service."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from typing import Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..core.metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# (ETag, Last-Modified) of a response body
+Validators = Tuple[Optional[str], Optional[str]]
+
+
+class HttpClient:
+    """Pooled keep-alive session with conditional GETs and jittered retries.
+
+    ``get`` sends the ``validators`` it is given (see ``validators_of``) as a conditional
+    request; a ``304`` response then carries no body and callers keep using what they
+    parsed from the response those validators came from. Callers keep validators next
+    to that body: several services may fetch one URL and each holds its own copy.
+    """
+
+    def __init__(self, timeout: float = 10, retries: int = 3, backoff: float = 0.5, pool_size: int = 8) -> None:
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate", "User-Agent": "inky-smart-display/1.0"})
+
+    def get(
+        self,
+        url: str,
+        params: Optional[dict] = None,
+        validators: Optional[Validators] = None,
+        stream: bool = False,
+        timeout: Optional[float] = None,
+    ) -> requests.Response:
+        headers = {}
+        if validators is not None:
+            etag, last_modified = validators
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        host = urlsplit(url).hostname or ""
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.get(
+                    url, params=params, headers=headers, stream=stream, timeout=timeout or self.timeout
+                )
+                metrics.inc("http_responses_total", host=host, code=resp.status_code)
+                if resp.status_code not in RETRY_STATUS or attempt >= self.retries:
+                    break
+                resp.close()
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                metrics.inc("http_errors_total", host=host, error=type(exc).__name__)
+                if attempt >= self.retries:
+                    raise
+            attempt += 1
+            metrics.inc("http_retries_total", host=host)
+            # Full jitter keeps several displays from retrying a struggling upstream in lockstep
+            delay = random.uniform(0, self.backoff * (2**attempt))
+            logger.debug("Retrying %s in %.2fs (attempt %d)", url, delay, attempt)
+            time.sleep(delay)
+
+        if resp.status_code == 304:
+            return resp
+        resp.raise_for_status()
+        return resp
+
+
+def validators_of(resp: requests.Response) -> Optional[Validators]:
+    """Validators of a 200 response, to send with the next ``get`` for the same body."""
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    return (etag, last_modified) if etag or last_modified else None
+
+
+_shared: Optional[HttpClient] = None
+_shared_lock = threading.Lock()
+
+
+def shared_client() -> HttpClient:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = HttpClient()
+        return _shared
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta, tzinfo
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dateutil import tz
+from dateutil.rrule import rruleset, rrulestr
+from icalendar import Event
+
+
+logger = logging.getLogger(__name__)
+
+_DTSTART_RE = re.compile(r"^DTSTART[;:].*?(\d{8})", re.MULTILINE)
+_DTEND_RE = re.compile(r"^DTEND[;:].*?(\d{8})", re.MULTILINE)
+_FLOATING_UNTIL_RE = re.compile(r"UNTIL=(\d{8}T\d{6})(?!Z)")
+
+
+def _utc_until(value: str, zone: Optional[tzinfo]) -> str:
+    # A floating UNTIL is wall-clock time in the series' own zone, not UTC
+    until = datetime.strptime(value, "%Y%m%dT%H%M%S").replace(tzinfo=zone)
+    return "UNTIL=" + until.astimezone(tz.UTC).strftime("%Y%m%dT%H%M%SZ")
+
+
+@dataclass
+class IndexedEvent:
+    start: datetime
+    end: datetime
+    title: str
+    location: Optional[str]
+    uid: Optional[str]
+
+
+@dataclass
+class RecurringEvent:
+    """A VEVENT with an RRULE, expanded lazily for whatever window is queried."""
+
+    first: datetime
+    duration: timedelta
+    rules: rruleset
+    title: str
+    location: Optional[str]
+    uid: Optional[str]
+    all_day: bool
+
+    def between(self, start: datetime, end: datetime, zone: tzinfo) -> Iterator[IndexedEvent]:
+        lo, hi = start - self.duration, end
+        if self.all_day:
+            # All-day series are expanded as naive local dates
+            lo, hi = lo.astimezone(zone).replace(tzinfo=None), hi.astimezone(zone).replace(tzinfo=None)
+        for occurrence in self.rules.between(lo, hi, inc=True):
+            begin = occurrence.replace(tzinfo=zone) if self.all_day else occurrence.astimezone(zone)
+            finish = begin + self.duration
+            if finish > start and begin < end:
+                yield IndexedEvent(begin, finish, self.title, self.location, self.uid)
+
+
+def iter_vevents(data: bytes) -> Iterator[str]:
+    """Yield each unfolded ``VEVENT`` block without building the whole calendar."""
+    text = data.decode("utf-8", errors="replace")
+    block: List[str] = []
+    inside = False
+    for raw in text.splitlines():
+        if raw[:1] in (" ", "\t"):
+            if inside and block:
+                block[-1] += raw[1:]
+            continue
+        if raw == "BEGIN:VEVENT":
+            inside, block = True, [raw]
+        elif raw == "END:VEVENT" and inside:
+            block.append(raw)
+            yield "\r\n".join(block) + "\r\n"
+            inside = False
+        elif inside:
+            block.append(raw)
+
+
+def _local_zone(value: datetime) -> datetime:
+    # icalendar attaches pytz zones, whose fixed offsets break DST when dateutil
+    # steps an RRULE across a transition; swap in an equivalent dateutil zone
+    zone_name = getattr(value.tzinfo, "zone", None)
+    if zone_name:
+        return value.replace(tzinfo=tz.gettz(zone_name))
+    return value
+
+
+@dataclass
+class CalendarIndex:
+    """Events of one feed, indexed for fast window queries.
+
+    Single events are kept sorted by start; ``window`` bisects to the first candidate
+    using the longest event duration, so lookups only touch events near the window.
+    Recurring series are expanded per queried day range and the expansion is memoised.
+    """
+
+    zone: tzinfo
+    horizon: datetime
+    singles: List[IndexedEvent] = field(default_factory=list)
+    recurring: List[RecurringEvent] = field(default_factory=list)
+    _starts: List[datetime] = field(default_factory=list, repr=False)
+    _max_duration: timedelta = field(default=timedelta(0), repr=False)
+    _expanded: Dict[Tuple[date, date], Tuple[List[datetime], List[IndexedEvent]]] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def parse(cls, data: bytes, zone: tzinfo, history: timedelta = timedelta(days=2)) -> "CalendarIndex":
+        """Build an index from raw ICS bytes.
+
+        Non-recurring events that ended before ``now - history`` are skipped from a cheap
+        text check without running the full property parser, which is what keeps
+        feeds with a decade of history fast to ingest.
+        """
+        horizon = datetime.now(zone) - history
+        cutoff = horizon.strftime("%Y%m%d")
+        index = cls(zone=zone, horizon=horizon)
+        overrides: Dict[Tuple[str, datetime], Optional[IndexedEvent]] = {}
+        skipped = 0
+        for block in iter_vevents(data):
+            if "\nRRULE" not in block and "\nRECURRENCE-ID" not in block:
+                match = _DTEND_RE.search(block) or _DTSTART_RE.search(block)
+                if match and match.group(1) < cutoff:
+                    skipped += 1
+                    continue
+            try:
+                index._add(Event.from_ical(block), overrides)
+            except Exception:
+                logger.debug("Skipping unparsable VEVENT", exc_info=True)
+
+        # A RECURRENCE-ID instance replaces the occurrence its series would have produced
+        moved: Dict[str, List[datetime]] = {}
+        for uid, recurrence_id in overrides:
+            moved.setdefault(uid, []).append(recurrence_id)
+        for master in index.recurring:
+            for recurrence_id in moved.get(master.uid or "", []):
+                master.rules.exdate(recurrence_id)
+        index.singles.extend(e for e in overrides.values() if e is not None and e.end >= horizon)
+        index.singles.sort(key=lambda e: e.start)
+        index._starts = [e.start for e in index.singles]
+        index._max_duration = max((e.end - e.start for e in index.singles), default=timedelta(0))
+        logger.info(
+            "Indexed %d events and %d series (%d historic events skipped)", len(index.singles), len(index.recurring), skipped
+        )
+        return index
+
+    def window(self, start: datetime, end: datetime) -> List[IndexedEvent]:
+        """Events overlapping ``[start, end)``, sorted by start."""
+        day_range = (start.astimezone(self.zone).date(), end.astimezone(self.zone).date() + timedelta(days=1))
+        cached = self._expanded.get(day_range)
+        if cached is None:
+            lo = datetime.combine(day_range[0], time(), self.zone)
+            hi = datetime.combine(day_range[1], time(), self.zone)
+            occurrences = sorted((e for r in self.recurring for e in r.between(lo, hi, self.zone)), key=lambda e: e.start)
+            cached = ([e.start for e in occurrences], occurrences)
+            # Only the current window is ever asked for again; keep the memo tiny
+            self._expanded = {day_range: cached}
+
+        out: List[IndexedEvent] = []
+        for starts, events in ((self._starts, self.singles), cached):
+            lo_i = bisect.bisect_left(starts, start - self._max_duration) if events is self.singles else 0
+            hi_i = bisect.bisect_left(starts, end)
+            out.extend(e for e in events[lo_i:hi_i] if e.end > start)
+        out.sort(key=lambda e: e.start)
+        return out
+
+    def _add(self, component: Event, overrides: Dict[Tuple[str, datetime], Optional[IndexedEvent]]) -> None:
+        cancelled = str(component.get("status", "")).upper() == "CANCELLED"
+        uid = str(component.get("uid", "")) or None
+        recurrence_id = component.get("recurrence-id")
+        if cancelled:
+            # A cancelled instance still has to knock its occurrence out of the series
+            if recurrence_id is not None and uid:
+                overrides[(uid, self._series_dt(recurrence_id.dt))] = None
+            return
+        dtstart = component.get("dtstart")
+        if not dtstart:
+            return
+        raw_start = dtstart.dt
+        all_day = not isinstance(raw_start, datetime)
+        start = self._to_dt(raw_start)
+        dtend = component.get("dtend")
+        if dtend:
+            end = self._to_dt(dtend.dt)
+        elif component.get("duration"):
+            end = start + component.get("duration").dt
+        else:
+            end = start + (timedelta(days=1) if all_day else timedelta(hours=1))
+        title = str(component.get("summary", ""))
+        location = str(component.get("location", "")) or None
+
+        if recurrence_id is not None and uid:
+            overrides[(uid, self._series_dt(recurrence_id.dt))] = IndexedEvent(start, end, title, location, uid)
+            return
+
+        rrule = component.get("rrule")
+        if rrule is None:
+            if end >= self.horizon:
+                self.singles.append(IndexedEvent(start, end, title, location, uid))
+            return
+
+        first = self._series_dt(raw_start)
+        rule_text = rrule.to_ical().decode("utf-8")
+        if not all_day:
+            # RFC 5545 requires a UTC UNTIL for zoned series; dateutil rejects anything else
+            rule_text = _FLOATING_UNTIL_RE.sub(lambda m: _utc_until(m.group(1), first.tzinfo), rule_text)
+        rules = rrulestr(rule_text, dtstart=first, forceset=True, ignoretz=all_day)
+        exdates = component.get("exdate")
+        for group in exdates if isinstance(exdates, list) else ([exdates] if exdates else []):
+            for value in group.dts:
+                rules.exdate(self._series_dt(value.dt))
+        self.recurring.append(RecurringEvent(first, end - start, rules, title, location, uid, all_day))
+
+    def _series_dt(self, value) -> datetime:
+        """Series times stay in the event's own zone so wall-clock times survive DST."""
+        if isinstance(value, datetime):
+            return _local_zone(value) if value.tzinfo else value.replace(tzinfo=self.zone)
+        return datetime(value.year, value.month, value.day)
+
+    def _to_dt(self, value) -> datetime:
+        if isinstance(value, datetime):
+            if value.tzinfo is None:
+                return value.replace(tzinfo=self.zone)
+            return value.astimezone(self.zone)
+        # Date-only all-day event; assume local midnight
+        return datetime(value.year, value.month, value.day, tzinfo=self.zone)
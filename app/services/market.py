@@ -1,9 +1,22 @@
 from __future__ import annotations
 
+import logging
+import time
+import zlib
 from dataclasses import dataclass
-from typing import Optional, List, Tuple
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Protocol, Sequence, Tuple
 
-import requests
+import numpy as np
+
+from ..core.metrics import metrics
+from .cache import SWRCache
+from .timeseries import SeriesStore
+
+
+logger = logging.getLogger(__name__)
+
+DAY = 86400
 
 
 @dataclass
@@ -13,19 +26,116 @@ class Quote:
     change_pct: float
 
 
+class MarketProvider(Protocol):
+    """Source of daily closing prices."""
+
+    def bars(self, symbol: str, since: Optional[int] = None) -> Sequence[Tuple[int, float]]:
+        """``(unix timestamp, close)`` bars strictly newer than ``since``, oldest first."""
+        ...
+
+
+class FakeProvider:
+    """Deterministic random-walk daily closes, for tests and running without a data feed.
+
+    Every symbol gets its own reproducible series starting ``years`` before today, and a
+    new bar appears each UTC midnight, so incremental sync behaves as with a live feed.
+    """
+
+    def __init__(self, years: float = 5, start_price: float = 100.0, now: Optional[Callable[[], float]] = None) -> None:
+        self.years = years
+        self.start_price = start_price
+        self.now = now or time.time
+        self.calls = 0
+
+    def bars(self, symbol: str, since: Optional[int] = None) -> Sequence[Tuple[int, float]]:
+        self.calls += 1
+        today = int(self.now()) // DAY * DAY
+        first = today - int(self.years * 365) * DAY
+        days = (today - first) // DAY + 1
+        # Same seed and draw order on every call, so earlier bars never change
+        steps = np.random.default_rng(zlib.crc32(symbol.encode("utf-8"))).normal(0.0002, 0.01, size=days)
+        closes = self.start_price * np.exp(np.cumsum(steps))
+        stamps = first + np.arange(days, dtype=np.int64) * DAY
+        skip = 0 if since is None else int(np.searchsorted(stamps, since, side="right"))
+        return list(zip(stamps[skip:].tolist(), np.round(closes[skip:], 4).tolist()))
+
+
+# ``data.market.provider`` -> factory; real feeds register here
+PROVIDERS: Dict[str, Callable[[], MarketProvider]] = {
+    "fake": FakeProvider,
+    "mock": FakeProvider,
+}
+
+
+def provider_for(name: str) -> MarketProvider:
+    factory = PROVIDERS.get((name or "").lower())
+    if factory is None:
+        logger.warning("Market provider %r is not available; using the fake provider", name)
+        factory = FakeProvider
+    return factory()
+
+
 class MarketService:
-    def __init__(self, symbol: str) -> None:
+    """Quotes and history for one symbol, served from a local ``SeriesStore``.
+
+    Only bars newer than the last stored one are requested from the provider. With an
+    ``SWRCache`` the sync runs at most once per ``ttl`` and in the background after the
+    first one, so reads never wait on the provider once history exists locally.
+    """
+
+    def __init__(
+        self,
+        symbol: str,
+        store: SeriesStore,
+        provider: Optional[MarketProvider] = None,
+        cache: Optional[SWRCache] = None,
+        ttl: float = 900,
+    ) -> None:
         self.symbol = symbol
+        self.store = store
+        self.provider = provider or FakeProvider()
+        self.cache = cache
+        self.ttl = ttl
+
+    def sync(self) -> int:
+        """Fetch and store bars newer than the last stored one; returns how many were added."""
+        since = self.store.last_timestamp(self.symbol)
+        added = self.store.append(self.symbol, self.provider.bars(self.symbol, since))
+        if added:
+            logger.info("Stored %d new %s bars", added, self.symbol)
+        return added
 
     def fetch_quote(self) -> Optional[Quote]:
-        # Placeholder: return mock; can be replaced with a real provider
-        return Quote(symbol=self.symbol, price=102.35, change_pct=0.42)
+        bars = self._bars()
+        if not len(bars):
+            return None
+        last = float(bars["close"][-1])
+        previous = float(bars["close"][-2]) if len(bars) > 1 else last
+        change = (last / previous - 1) * 100 if previous else 0.0
+        return Quote(symbol=self.symbol, price=last, change_pct=change)
 
     def fetch_history(self, days: int = 30) -> List[Tuple[str, float]]:
-        # Use Stooq free CSV endpoint for simple history if supported symbol.
-        # Many ETFs like VWCE are not present; return mock normalized series for now.
-        series = [100 + i * 0.2 + (i % 5 - 2) * 0.6 for i in range(days)]
-        out: List[Tuple[str, float]] = [(str(i), v) for i, v in enumerate(series)]
-        return out
+        bars = self._bars()
+        if not len(bars):
+            return []
+        recent = self.store.window(self.symbol, start=int(bars["ts"][-1]) - (days - 1) * DAY)
+        return [
+            (datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d"), close)
+            for ts, close in zip(recent["ts"].tolist(), recent["close"].tolist())
+        ]
 
+    def _bars(self) -> np.ndarray:
+        try:
+            if self.cache is None or self.store.last_timestamp(self.symbol) is None:
+                self.sync()
+            else:
+                self.cache.get(f"market:{self.symbol}", self.ttl, self._sync_stamp)
+        except Exception as exc:
+            # Stored history is still good; serve it
+            metrics.inc("upstream_failures_total", service="market")
+            logger.warning("Market sync for %s failed: %s", self.symbol, exc)
+        return self.store.read(self.symbol)
 
+    def _sync_stamp(self) -> Optional[int]:
+        self.sync()
+        return self.store.last_timestamp(self.symbol)
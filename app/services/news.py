@@ -1,22 +1,206 @@
 from __future__ import annotations
 
-from typing import List
+import functools
+import hashlib
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+from xml.etree.ElementTree import ParseError
 
-import feedparser
+import numpy as np
+
+from ..core.metrics import in_context, metrics
+from .cache import SWRCache
+from .http import HttpClient, Validators, shared_client, validators_of
+from .rss import FeedEntry, iter_entries
+
+
+logger = logging.getLogger(__name__)
+
+# Entries read from the top of each feed; the rest of the document is not downloaded
+PER_FEED = 20
+
+# Character shingle length for SimHash; short enough to match headlines that differ
+# in a word or two, long enough that unrelated headlines share few shingles
+SHINGLE = 4
+
+# SimHash fingerprints within this many differing bits (of 64) are the same story;
+# unrelated headlines sit around 32
+MAX_DISTANCE = 12
+
+_WORD = re.compile(r"\w+")
+_EPOCH = datetime.min.replace(tzinfo=timezone.utc)
 
 
 class NewsService:
-    def __init__(self, rss_url: str, limit: int = 5) -> None:
+    def __init__(
+        self,
+        rss_url: str,
+        limit: int = 5,
+        cache: Optional[SWRCache] = None,
+        ttl: float = 600,
+        http: Optional[HttpClient] = None,
+        per_feed: int = PER_FEED,
+    ) -> None:
         self.rss_url = rss_url
         self.limit = limit
+        self.cache = cache
+        self.ttl = ttl
+        self.http = http or shared_client()
+        self.per_feed = max(per_feed, limit)
+        self._entries: Optional[List[FeedEntry]] = None
+        # Of the response self._entries was read from
+        self._validators: Optional[Validators] = None
 
     def fetch_headlines(self) -> List[str]:
+        return [entry.title for entry in self.fetch_entries()[: self.limit]]
+
+    def fetch_entries(self) -> List[FeedEntry]:
+        """The first ``per_feed`` entries of the feed, in feed order."""
         try:
-            feed = feedparser.parse(self.rss_url)
-            titles = [entry.get("title", "") for entry in feed.entries]
-            titles = [t.strip() for t in titles if t and isinstance(t, str)]
-            return titles[: self.limit]
-        except Exception:
+            if self.cache is None:
+                return self._load_entries()
+            # Entries are cut at per_feed while parsing, so each limit caches its own list
+            return self.cache.get(f"news:entries:{self.per_feed}:{self.rss_url}", self.ttl, self._load_entries)
+        except Exception as exc:
+            metrics.inc("upstream_failures_total", service="news")
+            logger.warning("News fetch from %s failed: %s", self.rss_url, exc)
             return []
 
+    def _load_entries(self) -> List[FeedEntry]:
+        resp = self.http.get(self.rss_url, validators=self._validators if self._entries is not None else None, stream=True)
+        try:
+            if resp.status_code == 304 and self._entries is not None:
+                return self._entries
+            # Let urllib3 undo gzip while streaming; the parser reads the raw socket
+            resp.raw.decode_content = True
+            entries: List[FeedEntry] = []
+            try:
+                entries.extend(iter_entries(resp.raw, self.per_feed))
+            except ParseError as exc:
+                if not entries:
+                    raise ValueError(f"Could not read feed {self.rss_url}: {exc}") from exc
+                logger.warning("Feed %s is malformed after %d entries: %s", self.rss_url, len(entries), exc)
+        finally:
+            # Closing before the end drops the connection instead of draining a large feed
+            resp.close()
+        self._entries, self._validators = entries, validators_of(resp)
+        return entries
+
+
+@functools.lru_cache(maxsize=4096)
+def simhash(text: str) -> int:
+    """64-bit SimHash of ``text`` over character shingles of its normalised words.
+
+    Memoised: the same headlines come back on every refresh.
+    """
+    norm = " ".join(_WORD.findall(text.casefold()))
+    grams = {norm[i : i + SHINGLE] for i in range(max(1, len(norm) - SHINGLE + 1))}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little") for g in grams),
+        dtype=np.uint64,
+        count=len(grams),
+    )
+    bits = np.unpackbits(hashes.view(np.uint8), bitorder="little").reshape(len(grams), 64)
+    majority = bits.sum(axis=0) * 2 > len(grams)
+    return int(np.packbits(majority, bitorder="little").view(np.uint64)[0])
+
+
+def _near(fingerprints: np.ndarray, fp: int, max_distance: int) -> bool:
+    return bool(len(fingerprints)) and bool((np.bitwise_count(fingerprints ^ np.uint64(fp)) <= max_distance).any())
+
+
+def merge_entries(streams: Sequence[Sequence[FeedEntry]]) -> List[FeedEntry]:
+    """All entries newest first; undated entries follow the dated ones in feed order."""
+    return sorted((e for stream in streams for e in stream), key=lambda e: e.published or _EPOCH, reverse=True)
+
+
+def collapse_duplicates(entries: Sequence[FeedEntry], max_distance: int = MAX_DISTANCE) -> List[Tuple[int, FeedEntry]]:
+    """``(fingerprint, entry)`` for each story, keeping the first entry of every near-duplicate group."""
+    kept = np.empty(len(entries), dtype=np.uint64)
+    out: List[Tuple[int, FeedEntry]] = []
+    for entry in entries:
+        fp = simhash(entry.title)
+        if _near(kept[: len(out)], fp, max_distance):
+            continue
+        kept[len(out)] = fp
+        out.append((fp, entry))
+    return out
+
+
+class SeenStories:
+    """Fingerprints of the last ``capacity`` stories put on the display, oldest dropped first."""
+
+    def __init__(self, capacity: int = 512, max_distance: int = MAX_DISTANCE) -> None:
+        self.max_distance = max_distance
+        self._ring = np.zeros(capacity, dtype=np.uint64)
+        self._size = 0
+        self._next = 0
+
+    def __contains__(self, fp: int) -> bool:
+        return _near(self._ring[: self._size], fp, self.max_distance)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, fp: int) -> None:
+        if fp in self:
+            return
+        self._ring[self._next] = fp
+        self._next = (self._next + 1) % len(self._ring)
+        self._size = min(self._size + 1, len(self._ring))
+
+
+class MultiNewsService:
+    """Several RSS/Atom feeds fetched in parallel and merged into one list of headlines.
+
+    Entries are merged by publish time and near-duplicates across outlets (same story,
+    slightly different headline) are collapsed by SimHash distance. Whenever the merged
+    stories change, stories that have not been on the display yet are picked first, so
+    a story that stays at the top of its feed for hours does not hold its slot.
+    """
+
+    def __init__(
+        self,
+        feeds: Sequence[str],
+        limit: int = 5,
+        per_feed: int = PER_FEED,
+        cache: Optional[SWRCache] = None,
+        ttl: float = 600,
+        http: Optional[HttpClient] = None,
+        seen_capacity: int = 512,
+    ) -> None:
+        self.feeds = list(dict.fromkeys(feeds))
+        self.limit = limit
+        self.services = [
+            NewsService(url, limit=limit, cache=cache, ttl=ttl, http=http, per_feed=per_feed) for url in self.feeds
+        ]
+        self.seen = SeenStories(seen_capacity)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(8, len(self.feeds))), thread_name_prefix="rss")
+        self._lock = threading.Lock()
+        self._stories: Tuple[int, ...] = ()
+        self._headlines: List[str] = []
+
+    def fetch_headlines(self) -> List[str]:
+        futures = [self._executor.submit(in_context(svc.fetch_entries)) for svc in self.services]
+        stories = collapse_duplicates(merge_entries([future.result() for future in futures]))
+        with self._lock:
+            # Pick again only when the feeds changed, so re-reads (previews) do not rotate
+            fingerprints = tuple(fp for fp, _ in stories)
+            if fingerprints != self._stories:
+                self._stories = fingerprints
+                shown = [fp in self.seen for fp, _ in stories]
+                fresh = [story for story, was_shown in zip(stories, shown) if not was_shown]
+                repeat = [story for story, was_shown in zip(stories, shown) if was_shown]
+                chosen = (fresh + repeat)[: self.limit]
+                for fp, _ in chosen:
+                    self.seen.add(fp)
+                self._headlines = [entry.title for _, entry in chosen]
+            return list(self._headlines)
 
+    def close(self) -> None:
+        """Stop the feed threads; called when settings changes replace this service."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import html
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import BinaryIO, Dict, Iterator, Optional
+from xml.etree.ElementTree import iterparse
+
+
+# RSS 2.0 <item> and Atom <entry>; namespaces are ignored
+ENTRY_TAGS = {"item", "entry"}
+
+# First match wins: RSS pubDate, Atom published/updated, Dublin Core dc:date
+DATE_TAGS = ("pubDate", "published", "updated", "date")
+
+
+@dataclass
+class FeedEntry:
+    title: str
+    link: str = ""
+    published: Optional[datetime] = None
+
+
+def iter_entries(stream: BinaryIO, limit: Optional[int] = None) -> Iterator[FeedEntry]:
+    """Entries of an RSS or Atom document in feed order, read incrementally from ``stream``.
+
+    Each entry element is dropped as soon as it has been read and parsing stops after
+    ``limit`` entries, so at most one entry (plus the bytes the parser buffers) is held
+    in memory and the rest of a large feed is never downloaded. Feeds list their newest
+    entries first, which makes the first ``limit`` the newest ones.
+    """
+    count = 0
+    for _, elem in iterparse(stream, events=("end",)):
+        if _local(elem.tag) not in ENTRY_TAGS:
+            continue
+        fields: Dict[str, str] = {}
+        for child in elem:
+            name = _local(child.tag)
+            # Atom links carry the URL in href; prefer the alternate (or untyped) one
+            if name == "link" and child.get("href") is not None:
+                if child.get("rel", "alternate") == "alternate":
+                    fields.setdefault("link", child.get("href", ""))
+                continue
+            fields.setdefault(name, (child.text or "").strip())
+        elem.clear()
+        title = html.unescape(fields.get("title", "")).strip()
+        if not title:
+            continue
+        published = next((parse_date(fields[tag]) for tag in DATE_TAGS if fields.get(tag)), None)
+        yield FeedEntry(title=" ".join(title.split()), link=fields.get("link", ""), published=published)
+        count += 1
+        if limit is not None and count >= limit:
+            return
+
+
+def parse_date(text: str) -> Optional[datetime]:
+    """RFC 822 (RSS) or ISO 8601 (Atom) timestamp as an aware datetime; ``None`` if unreadable."""
+    try:
+        value = parsedate_to_datetime(text)
+    except (TypeError, ValueError, IndexError):
+        try:
+            value = datetime.fromisoformat(text.strip().replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
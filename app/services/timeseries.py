@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# One fixed-size record per bar; files are plain arrays of these, oldest first
+BAR = np.dtype([("ts", "<i8"), ("close", "<f8")])
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]")
+
+
+class SeriesStore:
+    """Append-only (timestamp, close) series per symbol, read through ``np.memmap``.
+
+    Each symbol is one ``<symbol>.bars`` file of ``BAR`` records in strictly increasing
+    timestamp order. Appends only ever add records newer than the last one, so the
+    file doubles as the sync cursor, and reads map the file instead of parsing it:
+    opening years of daily bars costs a ``mmap`` call, and a window is two
+    ``searchsorted`` lookups. A torn final record (crash mid-append) is ignored on
+    read and cut off by the next append.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._maps: Dict[str, Tuple[int, np.ndarray]] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, symbol: str) -> str:
+        return os.path.join(self.directory, _UNSAFE.sub("_", symbol) + ".bars")
+
+    def read(self, symbol: str) -> np.ndarray:
+        """All bars for ``symbol`` as a read-only structured array (empty if none)."""
+        path = self.path(symbol)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return np.empty(0, dtype=BAR)
+        count = size // BAR.itemsize
+        with self._lock:
+            cached = self._maps.get(symbol)
+            if cached is not None and cached[0] == count:
+                return cached[1]
+            bars = np.memmap(path, dtype=BAR, mode="r", shape=(count,)) if count else np.empty(0, dtype=BAR)
+            self._maps[symbol] = (count, bars)
+            return bars
+
+    def window(self, symbol: str, start: Optional[int] = None, end: Optional[int] = None) -> np.ndarray:
+        """Bars with ``start <= ts < end``."""
+        bars = self.read(symbol)
+        ts = bars["ts"]
+        lo = 0 if start is None else int(np.searchsorted(ts, start, side="left"))
+        hi = len(bars) if end is None else int(np.searchsorted(ts, end, side="left"))
+        return bars[lo:hi]
+
+    def last_timestamp(self, symbol: str) -> Optional[int]:
+        bars = self.read(symbol)
+        return int(bars["ts"][-1]) if len(bars) else None
+
+    def append(self, symbol: str, bars: Iterable[Tuple[int, float]]) -> int:
+        """Append bars newer than the last stored one; returns how many were written."""
+        new = np.array(sorted(bars), dtype=BAR) if not isinstance(bars, np.ndarray) else np.sort(bars.astype(BAR), order="ts")
+        if not len(new):
+            return 0
+        path = self.path(symbol)
+        with self._lock:
+            last = self._last_on_disk(path)
+            if last is not None:
+                new = new[new["ts"] > last]
+            # Keep the first of any duplicate timestamps
+            if len(new) > 1:
+                new = new[np.concatenate(([True], np.diff(new["ts"]) > 0))]
+            if not len(new):
+                return 0
+            with open(path, "ab") as f:
+                torn = f.tell() % BAR.itemsize
+                if torn:
+                    logger.warning("Dropping %d bytes of a torn record in %s", torn, path)
+                    f.truncate(f.tell() - torn)
+                f.write(new.tobytes())
+            self._maps.pop(symbol, None)
+        return len(new)
+
+    def symbols(self) -> List[str]:
+        return sorted(name[: -len(".bars")] for name in os.listdir(self.directory) if name.endswith(".bars"))
+
+    def _last_on_disk(self, path: str) -> Optional[int]:
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                count = size // BAR.itemsize
+                if not count:
+                    return None
+                f.seek((count - 1) * BAR.itemsize)
+                return int(np.frombuffer(f.read(BAR.itemsize), dtype=BAR)["ts"][0])
+        except FileNotFoundError:
+            return None
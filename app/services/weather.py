@@ -1,9 +1,27 @@
 from __future__ import annotations
 
+import logging
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
-import requests
+import numpy as np
+
+from ..core.metrics import metrics
+from .cache import SWRCache
+from .http import HttpClient, shared_client
+
+
+logger = logging.getLogger(__name__)
+
+
+OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
+
+# Hourly steps the display shows; requests ask for no more than this
+HOURLY_STEPS = 6
+
+# Coordinates are rounded to ~1 km before requesting and caching, so nearby
+# settings share one cache entry
+COORD_DECIMALS = 2
 
 
 @dataclass
@@ -17,42 +35,108 @@ class WeatherNow:
     hourly: List[Tuple[str, float]] | None = None
 
 
+@dataclass(frozen=True)
+class Location:
+    lat: float
+    lon: float
+    name: str = ""
+
+    def rounded(self) -> "Location":
+        return Location(round(self.lat, COORD_DECIMALS), round(self.lon, COORD_DECIMALS), self.name)
+
+    @property
+    def key(self) -> str:
+        return f"weather:{self.lat:.{COORD_DECIMALS}f},{self.lon:.{COORD_DECIMALS}f}"
+
+
 class WeatherService:
-    def __init__(self, lat: float, lon: float) -> None:
+    """Current conditions for a home location and, optionally, a few more places.
+
+    All locations go out in one Open-Meteo request (it takes comma-separated
+    coordinate lists and answers with one result per location) asking only for
+    ``hours`` hourly steps and today's high/low. Results are cached per rounded
+    location, so only the places whose entry is missing or stale are requested.
+    """
+
+    def __init__(
+        self,
+        lat: float,
+        lon: float,
+        cache: Optional[SWRCache] = None,
+        ttl: float = 900,
+        http: Optional[HttpClient] = None,
+        api_url: str = OPEN_METEO_URL,
+        locations: Sequence[Location] = (),
+        hours: int = HOURLY_STEPS,
+    ) -> None:
         self.lat = lat
         self.lon = lon
+        self.cache = cache
+        self.ttl = ttl
+        self.http = http or shared_client()
+        self.api_url = api_url
+        self.hours = hours
+        self.locations = [Location(lat, lon).rounded(), *(loc.rounded() for loc in locations)]
 
     def fetch(self) -> Optional[WeatherNow]:
+        """Weather at the home location."""
+        return self.fetch_all()[0]
+
+    def fetch_all(self) -> List[Optional[WeatherNow]]:
+        """Weather for the home location followed by each extra location, ``None`` where unavailable."""
         try:
-            url = (
-                "https://api.open-meteo.com/v1/forecast?latitude=%s&longitude=%s&current=temperature_2m,wind_speed_10m,weather_code&hourly=temperature_2m&daily=temperature_2m_max,temperature_2m_min&timezone=auto"
-                % (self.lat, self.lon)
-            )
-            r = requests.get(url, timeout=10)
-            r.raise_for_status()
-            j = r.json()
-            cur = j.get("current", {})
-            daily = j.get("daily", {})
-            hourly = j.get("hourly", {})
-            wcode = int(cur.get("weather_code", 0))
-            icon, cond = self._icon_for_code(wcode)
-            hourly_list: List[Tuple[str, float]] = []
-            times = hourly.get("time", [])
-            temps = hourly.get("temperature_2m", [])
-            for t, temp in list(zip(times, temps))[:6]:
-                label = t[-5:]
-                hourly_list.append((label, float(temp)))
-            return WeatherNow(
-                temperature_c=float(cur.get("temperature_2m", 0)),
-                wind_kph=float(cur.get("wind_speed_10m", 0)),
-                condition=cond,
-                icon=icon,
-                high_c=float((daily.get("temperature_2m_max") or [None])[0] or 0),
-                low_c=float((daily.get("temperature_2m_min") or [None])[0] or 0),
-                hourly=hourly_list,
-            )
-        except Exception:
-            return None
+            if self.cache is None:
+                found = self._load([loc.key for loc in self.locations])
+            else:
+                found = self.cache.get_many([loc.key for loc in self.locations], self.ttl, self._load)
+        except Exception as exc:
+            metrics.inc("upstream_failures_total", service="weather")
+            logger.warning("Weather fetch failed: %s", exc)
+            return [None] * len(self.locations)
+        return [found.get(loc.key) for loc in self.locations]
+
+    def _load(self, keys: List[str]) -> Dict[str, WeatherNow]:
+        by_key = {loc.key: loc for loc in self.locations}
+        wanted = [by_key[key] for key in dict.fromkeys(keys)]
+        params = {
+            "latitude": ",".join(f"{loc.lat:.{COORD_DECIMALS}f}" for loc in wanted),
+            "longitude": ",".join(f"{loc.lon:.{COORD_DECIMALS}f}" for loc in wanted),
+            "current": "temperature_2m,wind_speed_10m,weather_code",
+            "hourly": "temperature_2m",
+            "daily": "temperature_2m_max,temperature_2m_min",
+            "forecast_hours": self.hours,
+            "forecast_days": 1,
+            "timezone": "auto",
+        }
+        payload = self.http.get(self.api_url, params=params).json()
+        # One location answers with an object, several with a list in request order
+        results = payload if isinstance(payload, list) else [payload]
+        if len(results) != len(wanted):
+            raise ValueError(f"expected {len(wanted)} results, got {len(results)}")
+        return {loc.key: self._decode(result) for loc, result in zip(wanted, results)}
+
+    def _decode(self, j: Dict[str, Any]) -> WeatherNow:
+        cur = j.get("current", {})
+        daily = j.get("daily", {})
+        hourly = j.get("hourly", {})
+        icon, cond = self._icon_for_code(int(cur.get("weather_code") or 0))
+        times = np.asarray(hourly.get("time", []), dtype=str)
+        temps = np.asarray(hourly.get("temperature_2m", []), dtype=np.float64)[: len(times)]
+        # Servers that ignore ``forecast_hours`` send whole days; start at the current hour
+        start = 0
+        if cur.get("time") and len(times):
+            start = max(0, int(np.searchsorted(times, cur["time"][:13] + ":00", side="right")) - 1)
+        times, temps = times[start : start + self.hours], temps[start : start + self.hours]
+        keep = ~np.isnan(temps)
+        return WeatherNow(
+            temperature_c=float(cur.get("temperature_2m") or 0),
+            wind_kph=float(cur.get("wind_speed_10m") or 0),
+            condition=cond,
+            icon=icon,
+            high_c=_first(daily.get("temperature_2m_max")),
+            low_c=_first(daily.get("temperature_2m_min")),
+            hourly=[(t[-5:], temp) for t, temp in zip(times[keep].tolist(), temps[keep].tolist())],
+        )
 
     def _icon_for_code(self, code: int) -> tuple[str, str]:
         mapping = {
@@ -71,3 +155,6 @@ class WeatherService:
         return mapping.get(code, ("☁", "Clouds"))
 
 
+def _first(values: Optional[Sequence[Any]]) -> Optional[float]:
+    first = np.asarray(values[:1] if values else [None], dtype=np.float64)[0]
+    return None if np.isnan(first) else float(first)
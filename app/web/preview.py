@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from ..core.app import SmartDisplayApp
+from ..core.frames import FrameHistory, pack_indices
+from ..core.metrics import metrics
+from ..core.renderer import BASE_LANDSCAPE, panel_frame
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PreviewFrame:
+    png: bytes
+    etag: str
+    signature: str
+    rendered_at: float
+    dirty_rects: Optional[List[tuple]] = None
+    frame_hash: str = ""  # of the panel palette indices, as served by ``history``
+
+
+class PreviewCache:
+    """Last rendered preview PNG, kept fresh by a single background worker.
+
+    HTTP handlers never render: they read the cached frame, or wait for the worker
+    when none exists yet, so any number of concurrent requests share one render. The
+    worker re-renders after ``invalidate()`` (settings saved, "Render Now") or when a
+    periodic check finds the settings or the template data changed. Each frame is
+    also quantized for the panel and kept in ``history`` for the binary frame endpoint.
+    """
+
+    def __init__(self, app: SmartDisplayApp, poll_seconds: float = 60) -> None:
+        self.app = app
+        self.poll_seconds = poll_seconds
+        self._frame: Optional[PreviewFrame] = None
+        self._cond = threading.Condition()
+        self._requested = 1  # generation the next render must satisfy
+        self._rendered = 0
+        self._force = True
+        self.history = FrameHistory(*BASE_LANDSCAPE)
+        self._thread = threading.Thread(target=self._run, name="preview-render", daemon=True)
+        self._thread.start()
+
+    def invalidate(self, force: bool = False) -> int:
+        """Ask for a re-render; returns the generation to pass to ``get``."""
+        with self._cond:
+            self._requested += 1
+            self._force = self._force or force
+            self._cond.notify_all()
+            return self._requested
+
+    def get(self, generation: int = 0, timeout: float = 90) -> Optional[PreviewFrame]:
+        """Current frame, waiting for the worker to reach ``generation`` (or any frame)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._frame is None or self._rendered < generation:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._frame
+
+    @property
+    def generation(self) -> int:
+        with self._cond:
+            return self._requested
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._rendered >= self._requested:
+                    self._cond.wait(self.poll_seconds)
+                target, force = self._requested, self._force
+                self._force = False
+            try:
+                with metrics.trace("preview", forced=force):
+                    self._render(force)
+            except Exception:
+                logger.exception("Preview render failed")
+            with self._cond:
+                self._rendered = max(self._rendered, target)
+                self._cond.notify_all()
+
+    def _render(self, force: bool) -> None:
+        app = self.app
+        settings = json.dumps(app.config.settings, sort_keys=True, default=str)
+        with metrics.timer("context"):
+            context = app.data.build_context()
+        signature = hashlib.sha1((settings + app.context_digest(context)).encode("utf-8")).hexdigest()
+        current = self._frame
+        if not force and current is not None and current.signature == signature:
+            metrics.inc("preview_renders_skipped_total")
+            metrics.annotate(skipped="unchanged")
+            return
+
+        started = time.monotonic()
+        image = app.render_image(context)
+        buf = io.BytesIO()
+        with metrics.timer("png_encode"):
+            image.save(buf, format="PNG")
+        png = buf.getvalue()
+        with metrics.timer("quantize"):
+            config = app.config
+            indices = app.renderer.quantizer().quantize(
+                panel_frame(image, config.get("display.orientation", "portrait")),
+                config.get("display.dither", "bayer") or "none",
+            )
+        frame_hash = hashlib.sha1(indices.tobytes()).hexdigest()
+        self.history.add(frame_hash, pack_indices(indices))
+        frame = PreviewFrame(
+            png=png,
+            etag=hashlib.sha1(png).hexdigest(),
+            signature=signature,
+            rendered_at=time.time(),
+            dirty_rects=None if app.uses_context() else list(app.renderer.dirty_rects),
+            frame_hash=frame_hash,
+        )
+        with self._cond:
+            self._frame = frame
+        logger.info("Preview rendered in %.1fs", time.monotonic() - started)
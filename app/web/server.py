@@ -1,16 +1,52 @@
 from __future__ import annotations
 
-import io
+import json
 from typing import Any
 
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, jsonify, request
 
 from ..core.app import SmartDisplayApp
+from ..core.frames import CODINGS, FrameHistory
+from ..core.metrics import metrics
+from .preview import PreviewCache
+
+
+def frame_response(history: FrameHistory) -> Response:
+    """Latest packed frame: ``304`` if the client has it, a delta against ``?base=`` if known, else a key frame."""
+    coding = request.args.get("coding", "zlib")
+    if coding not in CODINGS:
+        return Response(f"coding must be one of {', '.join(CODINGS)}", status=400)
+    base = request.args.get("base") or None
+    latest = history.latest
+    if latest is not None and (base == latest or latest in request.if_none_match):
+        metrics.inc("frame_responses_total", kind="not_modified", coding=coding)
+        response = Response(status=304)
+        response.set_etag(latest)
+        return response
+    encoded = history.encode(base, coding)
+    if encoded is None:
+        return Response("No frame rendered yet", status=503, headers={"Retry-After": "30"})
+    frame_hash, delta, body = encoded
+    metrics.inc("frame_responses_total", kind="delta" if delta else "key", coding=coding)
+    metrics.inc("frame_response_bytes_total", len(body), kind="delta" if delta else "key", coding=coding)
+    response = Response(body, mimetype="application/octet-stream")
+    response.set_etag(frame_hash)
+    response.headers["Cache-Control"] = "no-cache"
+    if delta:
+        response.headers["X-Frame-Base"] = base
+    return response
 
 
 def create_app() -> Flask:
     flask_app = Flask(__name__)
-    app = SmartDisplayApp()
+    app = flask_app.config["DISPLAY_APP"] = SmartDisplayApp()
+    preview = PreviewCache(app, poll_seconds=float(app.config.get("server.preview_poll_seconds", 60) or 60))
+    farm = None
+    if app.config.get("devices"):
+        from ..core.farm import RenderFarm
+
+        farm = RenderFarm(app.config, cache=app.cache)
+        farm.start()
 
     @flask_app.get("/api/settings")
     def get_settings():
@@ -19,31 +55,64 @@ def create_app() -> Flask:
     @flask_app.post("/api/settings")
     def update_settings():
         data: dict[str, Any] = request.get_json(force=True)  # type: ignore[assignment]
-        for k, v in data.items():
-            app.config.set(k, v)
+        app.config.update(data)
         app.config.save()
-        return jsonify({"ok": True})
+        return jsonify({"ok": True, "generation": preview.invalidate()})
+
+    @flask_app.post("/api/render")
+    def render_now():
+        return jsonify({"ok": True, "generation": preview.invalidate(force=True)})
 
     @flask_app.get("/api/preview.png")
     def preview_image():
-        mode = (app.config.get("display.mode", "html") or "html").lower()
-        if mode == "html":
-            image = app.renderer.render_html(app._build_context())
-        else:
-            image = app.renderer.create_canvas()
-            draw = app.renderer.get_draw(image)
-            width, height = image.size
-            num = max(1, len(app.widgets))
-            slot_h = height // num
-            y = 0
-            for widget in app.widgets:
-                region = (0, y, width, y + slot_h)
-                widget.draw(draw, region)
-                y += slot_h
-        buf = io.BytesIO()
-        image.save(buf, format="PNG")
-        buf.seek(0)
-        return send_file(buf, mimetype="image/png")
+        frame = preview.get(request.args.get("generation", 0, type=int))
+        if frame is None:
+            return Response("Preview is still rendering", status=503, headers={"Retry-After": "5"})
+        response = Response(frame.png, mimetype="image/png")
+        response.set_etag(frame.etag)
+        response.headers["Cache-Control"] = "no-cache"
+        if frame.dirty_rects is not None:
+            response.headers["X-Dirty-Rects"] = json.dumps(frame.dirty_rects)
+        return response.make_conditional(request)
+
+    @flask_app.get("/api/devices")
+    def devices():
+        return jsonify(farm.status() if farm is not None else [])
+
+    @flask_app.get("/api/devices/<name>/frame.png")
+    def device_frame(name: str):
+        if farm is None or name not in farm.devices():
+            return Response("Unknown device", status=404)
+        frame = farm.frame(name)
+        if frame is None:
+            return Response("Frame is still rendering", status=503, headers={"Retry-After": "30"})
+        response = Response(frame.png, mimetype="image/png")
+        response.set_etag(frame.etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
+
+    @flask_app.get("/api/frame.bin")
+    def preview_frame():
+        # Waits for the first preview render; later requests answer from the history
+        preview.get(0)
+        return frame_response(preview.history)
+
+    @flask_app.get("/api/devices/<name>/frame.bin")
+    def device_frame_bin(name: str):
+        if farm is None or name not in farm.devices():
+            return Response("Unknown device", status=404)
+        history = farm.history(name)
+        if history is None:
+            return Response("Frame is still rendering", status=503, headers={"Retry-After": "30"})
+        return frame_response(history)
+
+    @flask_app.get("/metrics")
+    def prometheus_metrics():
+        return Response(metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+
+    @flask_app.get("/api/traces")
+    def traces():
+        return jsonify(metrics.traces(request.args.get("limit", None, type=int)))
 
     @flask_app.get("/")
     def index():
@@ -63,7 +132,7 @@ def create_app() -> Flask:
               </head>
               <body>
                 <h2>Preview</h2>
-                <img id="preview" src="/api/preview.png" />
+                <img id="preview" />
                 <h3>Settings</h3>
                 <form id="form">
                   <label>Orientation</label>
@@ -74,6 +143,7 @@ def create_app() -> Flask:
                   <label>Mode</label>
                   <select name="display.mode">
                     <option value="html">HTML</option>
+                    <option value="native">Native</option>
                     <option value="pil">PIL</option>
                   </select>
                   <label>Template</label>
@@ -108,8 +178,16 @@ def create_app() -> Flask:
                       for (const k of path) { if (node && k in node) node = node[k]; else { node = undefined; break; } }
                       if (node !== undefined) el.value = node;
                     }
-                    // initial preview cache-bust
-                    document.getElementById('preview').src = '/api/preview.png?t=' + Date.now();
+                    await reloadPreview(0);
+                  }
+                  async function reloadPreview(generation) {
+                    // Revalidate with the server's ETag; a 304 reuses the image the browser already has
+                    const r = await fetch('/api/preview.png?generation=' + generation, { cache: 'no-cache' });
+                    if (!r.ok) return;
+                    const img = document.getElementById('preview');
+                    const old = img.src;
+                    img.src = URL.createObjectURL(await r.blob());
+                    if (old.startsWith('blob:')) URL.revokeObjectURL(old);
                   }
                   async function save(e) {
                     e.preventDefault();
@@ -117,11 +195,12 @@ def create_app() -> Flask:
                     for (const el of document.querySelectorAll('#form [name]')) {
                       data[el.name] = el.value;
                     }
-                    await fetch('/api/settings', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(data) });
-                    document.getElementById('preview').src = '/api/preview.png?t=' + Date.now();
+                    const r = await fetch('/api/settings', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(data) });
+                    await reloadPreview((await r.json()).generation);
                   }
                   async function refresh() {
-                    document.getElementById('preview').src = '/api/preview.png?t=' + Date.now();
+                    const r = await fetch('/api/render', { method: 'POST' });
+                    await reloadPreview((await r.json()).generation);
                   }
                   load();
                   document.getElementById('form').addEventListener('submit', save);
@@ -1,39 +1,44 @@
-from datetime import datetime, timedelta
-from typing import List, Tuple
+from typing import ClassVar, Dict, Hashable, List
 
 from PIL import ImageDraw
 
-from .base import Widget, Rect
+from .base import Rect, data_key, theme_key
 
 
 class AgendaWidget:
+    requires: ClassVar[Dict[str, float]] = {"calendar": 900}
+
     def __init__(self, config) -> None:
         self.config = config
+        self.events: List[dict] = []
+
+    def update(self, context: dict) -> None:
+        self.events = list(context.get("agenda") or [])
+
+    def cache_key(self) -> Hashable:
+        return (theme_key(self.config), data_key(self.events))
 
     def draw(self, draw: ImageDraw.ImageDraw, region: Rect) -> None:
         x0, y0, x1, y1 = region
-        width = x1 - x0
-        height = y1 - y0
 
-        title_font = draw.font if hasattr(draw, "font") else None
         # Header
         draw.rectangle(region, fill=self.config.get("theme.background"))
         fg = self.config.get("theme.primary")
         accent = self.config.get("theme.accent")
+        muted = self.config.get("theme.muted")
         draw.text((x0 + 16, y0 + 8), "Agenda", fill=accent)
 
-        # Mock data for now
-        now = datetime.now()
-        events = [
-            (now.replace(hour=9, minute=0), "Standup", "Zoom"),
-            (now.replace(hour=12, minute=30), "Lunch", "Kitchen"),
-            (now.replace(hour=15, minute=0), "1:1", "Room 2"),
-        ]
-
+        if not self.events:
+            draw.text((x0 + 16, y0 + 40), "No upcoming events", fill=muted)
+            return
         y = y0 + 40
-        for dt, title, loc in events:
-            time_str = dt.strftime("%H:%M")
-            draw.text((x0 + 16, y), f"{time_str}  {title} — {loc}", fill=fg)
+        for event in self.events:
+            if y + 28 > y1:
+                break
+            time_str = f"{event.get('time', '')}  "
+            draw.text((x0 + 16, y), time_str, fill=event.get("color") or fg)
+            line = event.get("title", "")
+            if event.get("location"):
+                line += f" — {event['location']}"
+            draw.text((x0 + 16 + draw.textlength(time_str), y), line, fill=fg)
             y += 28
-
-
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Protocol, Tuple
+from typing import ClassVar, Dict, Hashable, Protocol, Tuple
 
 from PIL import ImageDraw
 
@@ -9,7 +9,29 @@ Rect = Tuple[int, int, int, int]
 
 
 class Widget(Protocol):
+    # Data sources the widget draws from -> the oldest data (seconds) it accepts. Only
+    # sources required by an enabled widget (or the html/native template) are fetched.
+    requires: ClassVar[Dict[str, float]]
+
     def __init__(self, config) -> None: ...
+
+    # Take the values this widget draws from the frame context, before draw()
+    def update(self, context: dict) -> None: ...
+
     def draw(self, draw: ImageDraw.ImageDraw, region: Rect) -> None: ...
 
+    # Everything draw() depends on; a widget's tile is reused while this is unchanged
+    def cache_key(self) -> Hashable: ...
+
+
+def theme_key(config) -> Tuple:
+    return tuple(config.get(f"theme.{name}") for name in ("background", "primary", "accent", "muted", "font"))
+
 
+def data_key(value) -> Hashable:
+    """Hashable form of context data (lists of dicts and such) for ``cache_key``."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, data_key(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(data_key(v) for v in value)
+    return value
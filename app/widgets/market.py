@@ -1,13 +1,24 @@
-from typing import Tuple
+from typing import ClassVar, Dict, Hashable
 
 from PIL import ImageDraw
 
-from .base import Rect
+from .base import Rect, data_key, theme_key
 
 
 class MarketWidget:
+    requires: ClassVar[Dict[str, float]] = {"market": 900}
+
     def __init__(self, config) -> None:
         self.config = config
+        self.quote: dict = {}
+
+    def update(self, context: dict) -> None:
+        # The history only feeds sparklines; keep it out of the tile key
+        market = context.get("market") or {}
+        self.quote = {k: v for k, v in market.items() if k != "history"}
+
+    def cache_key(self) -> Hashable:
+        return (theme_key(self.config), data_key(self.quote))
 
     def draw(self, draw: ImageDraw.ImageDraw, region: Rect) -> None:
         x0, y0, x1, y1 = region
@@ -16,10 +27,10 @@ class MarketWidget:
         accent = self.config.get("theme.accent")
         draw.text((x0 + 16, y0 + 8), "Market", fill=accent)
 
-        # Placeholder market info
-        symbol = self.config.get("data.market.symbol", "VWCE.DE")
-        price = "102.35"
-        change = "+0.42%"
-        draw.text((x0 + 16, y0 + 44), f"{symbol}  {price}  ({change})", fill=fg)
-
-
+        symbol = self.quote.get("symbol") or self.config.get("data.market.symbol", "VWCE")
+        price = self.quote.get("price", "-")
+        change = self.quote.get("change_pct")
+        line = f"{symbol}  {price}"
+        if change is not None:
+            line += f"  ({change:+.2f}%)"
+        draw.text((x0 + 16, y0 + 44), line, fill=fg)
@@ -1,13 +1,22 @@
-from typing import List
+from typing import ClassVar, Dict, Hashable, List
 
 from PIL import ImageDraw
 
-from .base import Widget, Rect
+from .base import Rect, theme_key
 
 
 class NewsWidget:
+    requires: ClassVar[Dict[str, float]] = {"news": 1800}
+
     def __init__(self, config) -> None:
         self.config = config
+        self.headlines: List[str] = []
+
+    def update(self, context: dict) -> None:
+        self.headlines = list(context.get("headlines") or [])
+
+    def cache_key(self) -> Hashable:
+        return (theme_key(self.config), tuple(self.headlines))
 
     def draw(self, draw: ImageDraw.ImageDraw, region: Rect) -> None:
         x0, y0, x1, y1 = region
@@ -16,18 +25,9 @@ class NewsWidget:
         accent = self.config.get("theme.accent")
         draw.text((x0 + 16, y0 + 8), "Top News", fill=accent)
 
-        # Temporary mocked headlines
-        headlines: List[str] = [
-            "Markets steady as inflation cools",
-            "Tech unveils new AI chips",
-            "Global travel demand surges",
-            "Energy prices decline",
-            "New health guidelines released",
-        ]
-
         y = y0 + 40
-        for title in headlines[:5]:
+        for title in self.headlines[:5]:
+            if y + 24 > y1:
+                break
             draw.text((x0 + 16, y), f"• {title}", fill=fg)
             y += 24
-
-
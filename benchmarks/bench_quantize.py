@@ -0,0 +1,89 @@
+"""Compare the NumPy palette quantizer with the Inky library's default path.
+
+Usage: python benchmarks/bench_quantize.py [--repeat N] [--image frame.png]
+
+Without ``--image`` an 800x480 frame is drawn with the native layout engine so the
+numbers reflect a typical dashboard (large flat areas, anti-aliased text, gradients).
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.layout import LayoutEngine  # noqa: E402
+from app.core.quantize import DITHER_METHODS, PaletteQuantizer, impression_palette  # noqa: E402
+
+
+class _StaticConfig:
+    def get(self, path, default=None):
+        return default
+
+
+SAMPLE_CONTEXT = {
+    "now_str": "Sun 18 Oct • 10:00",
+    "agenda": [
+        {"time": "09:00", "title": "Standup", "location": "Zoom"},
+        {"time": "12:30", "title": "Lunch", "location": "Kitchen"},
+        {"time": "15:00", "title": "1:1", "location": "Room 2"},
+    ],
+    "headlines": ["Markets steady as inflation cools", "Tech unveils new AI chips", "Global travel demand surges"],
+    "market": {"symbol": "VWCE", "price": "102.35", "change_pct": 0.42, "history": [(str(i), 100 + i * 0.2 + (i % 5 - 2) * 0.6) for i in range(30)]},
+    "weather": {"temp": "12°C", "cond": "Cloudy", "icon": "☁", "hi": "14°", "lo": "8°", "hourly": []},
+}
+
+
+def sample_frame() -> Image.Image:
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    portrait = LayoutEngine(_StaticConfig(), base_dir).render(SAMPLE_CONTEXT, (480, 800))
+    return portrait.rotate(90, expand=True)
+
+
+def timed(fn, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--image", help="800x480 frame to quantize instead of the sample dashboard")
+    args = parser.parse_args()
+
+    frame = Image.open(args.image).convert("RGB") if args.image else sample_frame()
+    palette = impression_palette(0.5)
+
+    # What inky.set_image() does with an RGB image
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette(palette.flatten().tolist() + [255, 255, 255])
+    results = {"pil/inky default": timed(lambda: frame.convert("RGB").quantize(7, palette=palette_image), args.repeat)}
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold = PaletteQuantizer(palette, cache_dir=cache_dir)
+        results["numpy lut build"] = timed(lambda: cold._build_lut(), 1)
+        cold.lut  # writes the cache file
+        results["numpy lut load"] = timed(lambda: PaletteQuantizer(palette, cache_dir=cache_dir).lut, args.repeat)
+        quantizer = PaletteQuantizer(palette, cache_dir=cache_dir)
+        for method in DITHER_METHODS:
+            results[f"numpy {method}"] = timed(lambda m=method: quantizer.quantize(frame, m), args.repeat)
+
+    print(f"{frame.size[0]}x{frame.size[1]} frame, {args.repeat} runs")
+    print(f"{'stage':<20} {'median ms':>10} {'min ms':>10}")
+    for name, samples in results.items():
+        print(f"{name:<20} {statistics.median(samples):>10.1f} {min(samples):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
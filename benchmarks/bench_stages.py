@@ -0,0 +1,300 @@
+"""Time each stage of the display pipeline on its own, offline, against recorded fixtures.
+
+Usage:
+    python benchmarks/bench_stages.py [--repeat N] [--stage NAME ...] [--output results.json]
+    python benchmarks/bench_stages.py --compare baseline.json [--threshold 0.15]
+
+The calendar, news and weather stages fetch the payloads in ``benchmarks/fixtures``
+from a local HTTP stand-in, so the numbers include the real client and parser code
+but no network. Each stage runs in a fresh interpreter, which makes its peak RSS
+its own. ``--compare`` runs the suite (or loads ``--output`` if given with
+``--no-run``) and reports stages whose p50 got slower than ``--threshold``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import http.server
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_quantize import SAMPLE_CONTEXT, sample_frame, timed  # noqa: E402
+
+
+class FixtureServer:
+    """Serve ``benchmarks/fixtures`` on an ephemeral localhost port."""
+
+    def __init__(self) -> None:
+        handler = functools.partial(_QuietHandler, directory=FIXTURES)
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}/{name}"
+
+    def __enter__(self) -> "FixtureServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args) -> None:  # noqa: A002
+        pass
+
+
+def _renderer(base_dir: str):
+    from app.core.config import ConfigManager
+    from app.core.renderer import DisplayRenderer
+
+    return DisplayRenderer(ConfigManager(base_dir))
+
+
+def _sample_png() -> bytes:
+    buf = BytesIO()
+    sample_frame().rotate(-90, expand=True).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+# Each setup runs once in the stage's own process and returns the callable to time
+def setup_ics_parse(server: FixtureServer, base_dir: str) -> Callable[[], object]:
+    from app.services.calendar import CalendarService
+
+    url = server.url("calendar.ics")
+    return lambda: CalendarService(url, lookahead_days=3, timezone_name="Europe/Amsterdam").fetch_events(limit=6)
+
+
+def setup_rss_parse(server: FixtureServer, base_dir: str) -> Callable[[], object]:
+    from app.services.news import NewsService
+
+    url = server.url("news.rss")
+    return lambda: NewsService(url, limit=3).fetch_headlines()
+
+
+def setup_news_merge(server: FixtureServer, base_dir: str) -> Callable[[], object]:
+    from app.services.news import MultiNewsService
+
+    # The same feed under eight URLs: every story is a duplicate across "outlets"
+    feeds = [server.url(f"news.rss?outlet={i}") for i in range(8)]
+    return lambda: MultiNewsService(feeds, limit=3).fetch_headlines()
+
+
+def setup_weather_decode(server: FixtureServer, base_dir: str) -> Callable[[], object]:
+    from app.services.weather import WeatherService
+
+    url = server.url("weather.json")
+    return lambda: WeatherService(52.3676, 4.9041, api_url=url).fetch()
+
+
+def setup_weather_batch(server: FixtureServer, base_dir: str) -> Callable[[], object]:
+    from app.services.weather import Location, WeatherService
+
+    url = server.url("weather_batch.json")
+    places = (Location(48.8566, 2.3522, "Paris"), Location(52.52, 13.405, "Berlin"))
+    return lambda: WeatherService(52.3676, 4.9041, api_url=url, locations=places).fetch_all()
+
+
+def setup_jinja_render(server: FixtureServer, base_dir: str) -> Callable[[], object]:
+    renderer = _renderer(base_dir)
+    return lambda: renderer.build_html(SAMPLE_CONTEXT)
+
+
+def setup_screenshot(server: FixtureServer, base_dir: str) -> Callable[[], object]:
+    renderer = _renderer(base_dir)
+    html = renderer.build_html(SAMPLE_CONTEXT)
+    size = renderer._canvas_size()
+    renderer.browser.screenshot(html, size)  # start Chrome outside the timed runs
+    return lambda: renderer.browser.screenshot(html, size)
+
+
+def setup_png_decode(server: FixtureServer, base_dir: str) -> Callable[[], object]:
+    png = _sample_png()
+    return lambda: Image.open(BytesIO(png)).convert("RGB")
+
+
+def setup_rotate_resize(server: FixtureServer, base_dir: str) -> Callable[[], object]:
+    from app.core.renderer import panel_frame
+
+    portrait = sample_frame().rotate(-90, expand=True)
+    return lambda: panel_frame(portrait, "portrait")
+
+
+def setup_quantize(server: FixtureServer, base_dir: str) -> Callable[[], object]:
+    renderer = _renderer(base_dir)
+    frame = sample_frame()
+    quantizer = renderer.quantizer()
+    quantizer.lut  # load or build the LUT outside the timed runs
+    return lambda: quantizer.quantize(frame, "bayer")
+
+
+STAGES: Dict[str, Callable[[FixtureServer, str], Callable[[], object]]] = {
+    "ics_parse": setup_ics_parse,
+    "rss_parse": setup_rss_parse,
+    "news_merge": setup_news_merge,
+    "weather_decode": setup_weather_decode,
+    "weather_batch": setup_weather_batch,
+    "jinja_render": setup_jinja_render,
+    "screenshot": setup_screenshot,
+    "png_decode": setup_png_decode,
+    "rotate_resize": setup_rotate_resize,
+    "quantize": setup_quantize,
+}
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(q * (len(ordered) - 1))))
+    return ordered[rank]
+
+
+def _rss_kb() -> int:
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _run_stage(name: str, repeat: int, base_dir: str, conn) -> None:
+    try:
+        with FixtureServer() as server:
+            fn = STAGES[name](server, base_dir)
+            fn()  # warm-up: imports, caches, first connection
+            rss_before = _rss_kb()
+            samples = timed(fn, repeat)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        conn.send(
+            {
+                "runs": repeat,
+                "p50_ms": round(percentile(samples, 0.50), 3),
+                "p95_ms": round(percentile(samples, 0.95), 3),
+                "min_ms": round(min(samples), 3),
+                "rss_before_kb": rss_before,
+                "peak_rss_kb": peak,
+            }
+        )
+    except Exception as exc:
+        conn.send({"skipped": f"{type(exc).__name__}: {str(exc).splitlines()[0] if str(exc) else ''}"})
+    finally:
+        conn.close()
+
+
+def run_suite(stages: List[str], repeat: int, timeout: float) -> Dict[str, dict]:
+    ctx = multiprocessing.get_context("spawn")
+    results: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as base_dir:
+        for name in stages:
+            parent, child = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=_run_stage, args=(name, repeat, base_dir, child))
+            process.start()
+            child.close()
+            if parent.poll(timeout):
+                results[name] = parent.recv()
+            else:
+                results[name] = {"skipped": f"timed out after {timeout:.0f}s"}
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+            print(_format_row(name, results[name]), flush=True)
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _format_row(name: str, result: dict) -> str:
+    if "skipped" in result:
+        return f"{name:<16} skipped ({result['skipped']})"
+    return (
+        f"{name:<16} {result['p50_ms']:>10.2f} {result['p95_ms']:>10.2f} "
+        f"{result['peak_rss_kb'] / 1024:>9.1f} {(result['peak_rss_kb'] - result['rss_before_kb']) / 1024:>+9.1f}"
+    )
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """Print p50/p95 changes per stage; returns the stages whose p50 regressed."""
+    regressions = []
+    print(f"\ncompared with {baseline.get('meta', {}).get('commit') or 'baseline'}")
+    print(f"{'stage':<16} {'p50 before':>11} {'p50 now':>10} {'change':>8} {'p95 change':>11}")
+    for name, now in current["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if not before or "skipped" in before or "skipped" in now:
+            continue
+        p50 = now["p50_ms"] / before["p50_ms"] - 1 if before["p50_ms"] else 0.0
+        p95 = now["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        flag = "  REGRESSION" if p50 > threshold else ""
+        print(f"{name:<16} {before['p50_ms']:>11.2f} {now['p50_ms']:>10.2f} {p50:>+8.0%} {p95:>+11.0%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--stage", action="append", choices=list(STAGES), help="run only these stages")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.15, help="p50 slowdown that counts as a regression")
+    parser.add_argument("--no-run", action="store_true", help="with --compare, compare --output instead of running")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before a stage is abandoned")
+    args = parser.parse_args()
+
+    if args.no_run:
+        if not (args.compare and args.output):
+            parser.error("--no-run needs --compare and --output")
+        with open(args.output, "r", encoding="utf-8") as f:
+            current = json.load(f)
+    else:
+        print(f"{'stage':<16} {'p50 ms':>10} {'p95 ms':>10} {'peak MB':>9} {'stage MB':>9}")
+        current = {
+            "meta": {
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "repeat": args.repeat,
+                "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            },
+            "stages": run_suite(args.stage or list(STAGES), args.repeat, args.timeout),
+        }
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(current, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, current, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,93 @@
+import argparse
+import logging
 import os
+import re
+import signal
+import subprocess
 import sys
 import time
 
+
+# Optional dependencies that should only load when the config needs them
+HEAVY_MODULES = ("selenium", "webdriver_manager", "jinja2", "requests", "icalendar", "dateutil", "asyncio")
+
+_STARTUP_PROBE = """
+import sys, time
+started = time.perf_counter()
 from app.core.app import SmartDisplayApp
+imported = time.perf_counter()
+app = SmartDisplayApp()
+built = time.perf_counter()
+print("STARTUP", app.mode, round((imported - started) * 1000, 1), round((built - imported) * 1000, 1))
+print("LOADED", " ".join(m for m in sys.argv[1:] if m in sys.modules))
+"""
+
+
+def profile_startup(top: int = 15) -> None:
+    """Report what importing and constructing the app costs, in a fresh interpreter."""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _STARTUP_PROBE, *HEAVY_MODULES],
+        cwd=base_dir,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        sys.exit(proc.returncode)
+
+    # "import time: self [us] | cumulative | imported package"; group self time by top-level package
+    packages: dict = {}
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+\d+ \| *(\S+)", line)
+        if match:
+            root = match.group(2).split(".")[0]
+            packages[root] = packages.get(root, 0) + int(match.group(1))
+    stdout = dict(line.split(" ", 1) for line in proc.stdout.splitlines() if " " in line)
+    mode, import_ms, build_ms = stdout.get("STARTUP", "? 0 0").split()
+    loaded = stdout.get("LOADED", "").split()
+
+    print(f"display.mode={mode}: import {import_ms} ms, SmartDisplayApp() {build_ms} ms")
+    print(f"heavy modules loaded at start-up: {', '.join(loaded) or 'none'}")
+    print(f"\n{'ms':>8}  package (own import time, all submodules)")
+    for root, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"{self_us / 1000:>8.1f}  {root}")
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Inky smart display")
+    parser.add_argument("--profile-startup", action="store_true", help="report import and start-up time, then exit")
+    parser.add_argument("--top", type=int, default=15, help="packages to list with --profile-startup")
+    parser.add_argument("--serve", action="store_true", help="run the web server (and the render farm when devices are configured)")
+    parser.add_argument("--client", metavar="URL", help="thin client: show this device's frames from a render farm at URL")
+    parser.add_argument("--device", default=os.uname().nodename, help="device profile name for --client (default: hostname)")
+    parser.add_argument("--poll", type=float, default=60, help="seconds between frame polls with --client")
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup(args.top)
+        return
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # systemd stops the service with SIGTERM; exit normally so atexit hooks close Chrome
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    if args.client:
+        from app.client import FrameClient
+
+        FrameClient(args.client, args.device, poll_seconds=args.poll).run_forever()
+        return
+    if args.serve:
+        from app.web.server import create_app
+
+        flask_app = create_app()
+        config = flask_app.config["DISPLAY_APP"].config
+        flask_app.run(host=config.get("server.host"), port=config.get("server.port"), threaded=True)
+        return
+
+    started = time.perf_counter()
+    from app.core.app import SmartDisplayApp
+
     app = SmartDisplayApp()
+    logging.getLogger(__name__).info("Started in %.2fs (display.mode=%s)", time.perf_counter() - started, app.mode)
     app.run()
 
 
@@ -15,4 +96,3 @@ if __name__ == "__main__":
         main()
     except KeyboardInterrupt:
         print("Exiting...")
-